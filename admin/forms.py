@@ -67,6 +67,13 @@ class UnpublishedBulkActionForm(BulkActionForm):
 
 
 class UserBulkActionForm(BulkActionForm):
+    BULK_ACTION_CHOICES = [
+        ('delete', _('Delete')),
+        ('hide', _('Hide')),
+        ('unhide', _('Reveal')),
+        ('hide_all', _('Hide on all my sites')),
+    ]
+    action = forms.ChoiceField(choices=BULK_ACTION_CHOICES)
     choices = forms.ModelMultipleChoiceField(
         queryset=UserModel.objects.all(),
         widget=forms.CheckboxSelectMultiple,
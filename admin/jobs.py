@@ -0,0 +1,201 @@
+"""
+Admin bulk actions run as DB-backed jobs. Jobs are processed in chunks of
+ADMIN_JOB_CHUNK_SIZE objects, each chunk in its own transaction, so large
+actions (e.g. deleting all comments of a spammer) neither hold long
+transactions nor time out request workers. Jobs of a single chunk are run
+directly in the request, others by a runner thread of the web process (see
+ADMIN_JOB_LOCAL_RUNNER) or by run_bulk_jobs command. Progress of jobs is
+reported by job_progress view.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from datetime import timedelta
+import logging
+import threading
+
+from comments.models import Comment, CustomUser
+from models import BulkJob
+
+logger = logging.getLogger(__name__)
+
+
+def delete_comments(params, offset, size):
+    ids = params['ids'][offset:offset + size]
+    Comment.objects.bulk_delete(ids)
+    return len(ids)
+
+
+def set_comments_hidden(params, offset, size):
+    ids = params['ids'][offset:offset + size]
+    Comment.objects.bulk_set_hidden(ids, params['hidden'])
+    return len(ids)
+
+
+def get_user_comments(params):
+    comments = Comment.objects.filter(user__in=params['users'])
+    if params.get('sites') is not None:
+        comments = comments.filter(thread__site__in=params['sites'])
+    return comments
+
+
+def delete_user_comments(params, offset, size):
+    # deleted comments don't match any more, so the first chunk is taken
+    ids = list(get_user_comments(params).order_by().values_list(
+        'id', flat=True)[:size])
+    Comment.objects.bulk_delete(ids)
+    return len(ids)
+
+
+def set_users_hidden(params, offset, size):
+    ids = params['users'][offset:offset + size]
+    if ids:
+        CustomUser.objects.bulk_set_hidden(
+            ids, params['sites'], params['hidden'])
+    return len(ids)
+
+
+def count_ids(params):
+    return len(params['ids'])
+
+
+def count_users(params):
+    return len(params['users'])
+
+
+def count_user_comments(params):
+    return get_user_comments(params).count()
+
+
+# maps actions to functions processing a chunk of objects (which return
+# number of processed objects, 0 when the job is finished) and functions
+# counting objects of the job
+ACTIONS = {
+    'delete_comments': (delete_comments, count_ids),
+    'set_comments_hidden': (set_comments_hidden, count_ids),
+    'delete_user_comments': (delete_user_comments, count_user_comments),
+    'set_users_hidden': (set_users_hidden, count_users),
+}
+
+
+def create_job(action, user=None, status=BulkJob.PENDING, **params):
+    """
+    Creates job of action with given parameters (pending by default).
+    """
+    process, count = ACTIONS[action]
+    return BulkJob.objects.create(
+        user=user, action=action, params=params, total=count(params),
+        status=status)
+
+
+def submit(action, user=None, **params):
+    """
+    Creates job of action with given parameters and runs it in this request
+    if it fits in a single chunk, otherwise it's left to job runners. Returns
+    the job.
+    """
+    # job is created as running, so runners don't take it before it's known
+    # whether it's run here
+    job = create_job(action, user, BulkJob.RUNNING, **params)
+    if job.total <= settings.ADMIN_JOB_CHUNK_SIZE:
+        run_job(job)
+    else:
+        job.status = BulkJob.PENDING
+        job.save(update_fields=['status'])
+        transaction.on_commit(start_local_runner)
+    return job
+
+
+def run_job(job, progress=None):
+    """
+    Processes job chunk by chunk until it's finished, progress is called
+    with the job after each chunk.
+    """
+    process, count = ACTIONS[job.action]
+    size = settings.ADMIN_JOB_CHUNK_SIZE
+    job.status = BulkJob.RUNNING
+
+    try:
+        while True:
+            with transaction.atomic():
+                processed = process(job.params, job.processed, size)
+                if not processed:
+                    break
+                job.processed += processed
+                job.updated = timezone.now()
+                job.save(update_fields=['processed', 'updated'])
+            if progress is not None:
+                progress(job)
+    except Exception as e:
+        logger.exception("Bulk job %d failed", job.id)
+        job.status = BulkJob.FAILED
+        job.error = str(e)
+    else:
+        job.status = BulkJob.DONE
+
+    job.updated = job.finished = timezone.now()
+    job.save(update_fields=['status', 'error', 'updated', 'finished'])
+
+
+def claim_job():
+    """
+    Returns the oldest pending job (or running job which didn't progress in
+    ADMIN_JOB_TIMEOUT seconds) marked as running, or None if there are no
+    such jobs. Jobs locked by other runners are skipped.
+    """
+    now = timezone.now()
+    stalled = now - timedelta(seconds=settings.ADMIN_JOB_TIMEOUT)
+    with transaction.atomic():
+        job = BulkJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status=BulkJob.PENDING) |
+            Q(status=BulkJob.RUNNING, updated__lt=stalled)
+        ).order_by('created').first()
+        if job is not None:
+            job.status = BulkJob.RUNNING
+            job.updated = now
+            job.save(update_fields=['status', 'updated'])
+    return job
+
+
+def run_jobs(limit=None, progress=None):
+    """
+    Runs claimed jobs until there are none left (or limit jobs are run).
+    Returns number of run jobs.
+    """
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job, progress)
+        count += 1
+    return count
+
+
+runner = None
+runner_lock = threading.Lock()
+
+
+def run_local_jobs():
+    try:
+        run_jobs()
+    finally:
+        connection.close()
+
+
+def start_local_runner():
+    """
+    Starts thread running pending jobs in this process, unless it's already
+    running or ADMIN_JOB_LOCAL_RUNNER is disabled.
+    """
+    global runner
+    if not settings.ADMIN_JOB_LOCAL_RUNNER:
+        return
+    with runner_lock:
+        if runner is not None and runner.is_alive():
+            return
+        runner = threading.Thread(target=run_local_jobs)
+        runner.daemon = True
+        runner.start()
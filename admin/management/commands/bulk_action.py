@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from admin.jobs import ACTIONS, create_job, run_job
+from admin.models import BulkJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs admin bulk action as a job in chunks of ADMIN_JOB_CHUNK_SIZE "
+        "objects, the same way as actions of admin pages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=sorted(ACTIONS))
+        parser.add_argument(
+            '--ids', type=int, nargs='+', default=[],
+            help="Ids of comments (comment actions)."
+        )
+        parser.add_argument(
+            '--users', type=int, nargs='+', default=[],
+            help="Ids of users (user actions)."
+        )
+        parser.add_argument(
+            '--sites', type=int, nargs='+',
+            help="Ids of sites (user actions, comments of users on all "
+                 "sites are deleted by default)."
+        )
+        parser.add_argument(
+            '--unhide', action='store_true',
+            help="Reveal comments or users instead of hiding them."
+        )
+
+    def get_params(self, action, options):
+        if action in ('delete_comments', 'set_comments_hidden'):
+            params = {'ids': options['ids']}
+        else:
+            params = {'users': options['users'], 'sites': options['sites']}
+            if action == 'set_users_hidden' and not options['sites']:
+                raise CommandError("--sites are required by %s" % action)
+        if action.startswith('set_'):
+            params['hidden'] = not options['unhide']
+        return params
+
+    def progress(self, job):
+        self.stdout.write("Processed %d of %d" % (job.processed, job.total))
+
+    def handle(self, *args, **options):
+        action = options['action']
+        job = create_job(
+            action, status=BulkJob.RUNNING,
+            **self.get_params(action, options))
+        run_job(job, self.progress)
+
+        if job.status == BulkJob.FAILED:
+            raise CommandError("Job %d failed: %s" % (job.id, job.error))
+        self.stdout.write("Job %d finished" % job.id)
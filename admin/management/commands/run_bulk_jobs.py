@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from admin.jobs import run_jobs
+
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs admin bulk jobs which are too large to be run in requests. "
+        "Keeps polling for new jobs unless --once is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit when there are no pending jobs."
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help="Number of seconds between polls for new jobs."
+        )
+
+    def progress(self, job):
+        self.stdout.write(
+            "Job %d (%s): %d of %d" % (
+                job.id, job.action, job.processed, job.total))
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_jobs(progress=self.progress)
+            if options['once']:
+                break
+            if not count:
+                time.sleep(options['interval'])
+
+        self.stdout.write("Finished %d jobs" % count)
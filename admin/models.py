@@ -1,3 +1,45 @@
+from django.conf import settings
+from django.contrib.postgres.fields import JSONField
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class BulkJob(models.Model):
+    """
+    Admin bulk action processed in chunks outside of the request, see
+    admin/jobs.py. Parameters of the action (ids of objects and sites) are
+    kept in params, processed counts objects handled by finished chunks.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    class Meta:
+        index_together = (('status', 'created'),)
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL,
+        related_name='bulk_jobs')
+    action = models.CharField(max_length=32)
+    params = JSONField(default=dict)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    # time of the last progress of running job, jobs which don't progress
+    # for ADMIN_JOB_TIMEOUT seconds are taken over by other runners
+    updated = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(null=True)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
@@ -1,16 +1,308 @@
-from django.core.paginator import (Paginator, EmptyPage, PageNotAnInteger)
+"""
+Keyset (cursor) pagination of admin lists. Pages are fetched by comparing
+ordering fields with values of the last (or first) object of the previous
+(or next) page instead of OFFSET, so deep pages cost the same as the first
+one. Page links carry the cursor together with the page number, which is
+used only to show object range. Totals are counted up to
+ADMIN_EXACT_COUNT_LIMIT objects, larger totals are estimated by the query
+planner. Counts are cached for ADMIN_COUNT_CACHE_TIMEOUT seconds.
+"""
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.http import (
+    urlencode, urlsafe_base64_decode, urlsafe_base64_encode
+)
 
-def paginate_data(request, data, per_page=settings.PER_PAGE):
-    paginator = Paginator(data, per_page)
+import hashlib
+import json
+import math
+
+
+def estimate_count(queryset):
+    """
+    Returns number of rows of queryset estimated by the query planner.
+    """
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_objects(queryset):
+    """
+    Returns number of objects in queryset and flag telling if the number is
+    estimated. Counting stops after ADMIN_EXACT_COUNT_LIMIT objects, so it
+    doesn't scan large tables.
+    """
+    sql, params = queryset.query.sql_with_params()
+    key = 'admin_count:%s' % hashlib.md5(
+        (sql % tuple(map(repr, params))).encode('utf-8')).hexdigest()
+
+    result = cache.get(key)
+    if result is None:
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        count = queryset.order_by()[:limit + 1].count()
+        estimated = count > limit
+        if estimated:
+            count = max(estimate_count(queryset), count)
+        result = (count, estimated)
+        cache.set(key, result, settings.ADMIN_COUNT_CACHE_TIMEOUT)
+
+    return result
+
+
+class CursorPaginator(object):
+    """
+    Paginates queryset by ordering fields, the last of which has to be
+    unique (e.g. '-id'). NULL values of nullable fields are ordered last.
+    """
+
+    def __init__(self, queryset, ordering, per_page, count=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.fields = []
+        for name in ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            field = queryset.model._meta.get_field(name)
+            self.fields.append((field, descending))
+
+        if count is None:
+            self.count, self.estimated = count_objects(queryset)
+        else:
+            self.count, self.estimated = count, False
+
+    @property
+    def num_pages(self):
+        return max(int(math.ceil(float(self.count) / self.per_page)), 1)
+
+    def get_ordering(self, reverse=False):
+        ordering = []
+        for field, descending in self.fields:
+            nulls = {}
+            if field.null:
+                nulls['nulls_first' if reverse else 'nulls_last'] = True
+            if descending != reverse:
+                ordering.append(F(field.attname).desc(**nulls))
+            else:
+                ordering.append(F(field.attname).asc(**nulls))
+        return ordering
+
+    def get_cursor(self, obj):
+        values = [
+            None if getattr(obj, field.attname) is None
+            else field.value_to_string(obj)
+            for field, descending in self.fields
+        ]
+        return urlsafe_base64_encode(json.dumps(values))
+
+    def parse_cursor(self, cursor):
+        """
+        Returns values of ordering fields encoded in cursor, or None if the
+        cursor is invalid.
+        """
+        try:
+            values = json.loads(urlsafe_base64_decode(cursor))
+            if len(values) != len(self.fields):
+                return None
+            return [
+                None if value is None else field.to_python(value)
+                for (field, descending), value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            return None
+
+    def get_keyset_filter(self, values, reverse=False):
+        """
+        Returns filter of objects following (or with reverse set preceding)
+        object with given values of ordering fields.
+        """
+        q = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.fields, values):
+            name = field.attname
+            if value is None:
+                compare = Q(**{name + '__isnull': False}) if reverse else None
+                same = Q(**{name + '__isnull': True})
+            else:
+                lookup = 'gt' if descending == reverse else 'lt'
+                compare = Q(**{'%s__%s' % (name, lookup): value})
+                if field.null and not reverse:
+                    compare |= Q(**{name + '__isnull': True})
+                same = Q(**{name: value})
+
+            if compare is not None:
+                q |= equal & compare
+            equal &= same
+        return q
+
+    def fetch(self, values=None, reverse=False, size=None):
+        """
+        Returns list of at most size (per_page by default) objects following
+        (or preceding) given cursor values and flag telling if there are more
+        objects in that direction.
+        """
+        size = size or self.per_page
+        queryset = self.queryset.order_by(*self.get_ordering(reverse))
+        if values is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(values, reverse))
+        objects = list(queryset[:size + 1])
+        more = len(objects) > size
+        objects = objects[:size]
+        if reverse:
+            objects.reverse()
+        return objects, more
+
+    def page(self, number=1, after=None, before=None, last=False):
+        """
+        Returns page with given number following cursor after, preceding
+        cursor before or the last page. Without cursors pages are fetched
+        using OFFSET.
+        """
+        after = after and self.parse_cursor(after)
+        before = before and self.parse_cursor(before)
+
+        if last:
+            number = self.num_pages
+            size = self.count - (number - 1) * self.per_page
+            if self.estimated or size < 1:
+                size = self.per_page
+            objects, has_previous = self.fetch(reverse=True, size=size)
+            has_next = False
+        elif before:
+            objects, has_previous = self.fetch(before, reverse=True)
+            has_next = True
+        elif after:
+            objects, has_next = self.fetch(after)
+            has_previous = True
+        else:
+            offset = (number - 1) * self.per_page
+            queryset = self.queryset.order_by(*self.get_ordering())
+            objects = list(queryset[offset:offset + self.per_page + 1])
+            if not objects and number > 1:
+                return self.page(last=True)
+            has_next = len(objects) > self.per_page
+            objects = objects[:self.per_page]
+            has_previous = number > 1
+
+        if not has_previous:
+            number = 1
+        elif number == 1:
+            number = 2
+
+        return CursorPage(self, objects, number, has_previous, has_next)
 
-    page = request.GET.get('page')
 
+class CursorPage(object):
+    """
+    Page of CursorPaginator, it has the same interface as Django pages
+    (except for page numbers of previous and next pages, which are valid
+    only with cursors). Links to other pages are provided by *_page_query
+    properties, which keep other parameters of the request.
+    """
+
+    def __init__(self, paginator, objects, number, has_previous, has_next):
+        self.paginator = paginator
+        self.object_list = objects
+        self.number = number
+        self._has_previous = has_previous
+        self._has_next = has_next
+        self.params = {}
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1 \
+            if self.object_list else 0
+
+    def get_query(self, **params):
+        query = dict(self.params)
+        for key in ('page', 'after', 'before'):
+            query.pop(key, None)
+        query.update(params)
+        return '?' + urlencode(sorted(query.items()))
+
+    @property
+    def first_page_query(self):
+        return self.get_query(page=1)
+
+    @property
+    def previous_page_query(self):
+        if not self.object_list:
+            return self.first_page_query
+        return self.get_query(
+            page=self.previous_page_number(),
+            before=self.paginator.get_cursor(self.object_list[0]))
+
+    @property
+    def next_page_query(self):
+        return self.get_query(
+            page=self.next_page_number(),
+            after=self.paginator.get_cursor(self.object_list[-1]))
+
+    @property
+    def last_page_query(self):
+        return self.get_query(page='last')
+
+
+def paginate_data(request, data, ordering, per_page=settings.PER_PAGE,
+                  count=None):
+    """
+    Returns page of queryset data ordered by given fields requested by page,
+    after and before parameters (see CursorPaginator.page). If count of
+    objects is already known, it can be passed so it isn't counted.
+    """
+    paginator = CursorPaginator(data, ordering, per_page, count)
+
+    page = request.GET.get('page')
+    last = page == 'last'
     try:
-        data = paginator.page(page)
-    except PageNotAnInteger:
-        data = paginator.page(1)
-    except EmptyPage:
-        data = paginator.page(paginator.num_pages)
+        number = max(int(page), 1)
+    except (TypeError, ValueError):
+        number = 1
+
+    data = paginator.page(
+        number,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        last=last
+    )
+    data.params = dict(request.GET.items())
+    # progress of jobs is shown only on the page they were submitted from
+    data.params.pop('job', None)
 
     return data
@@ -1,3 +1,5 @@
 from thread import *
 from comment import *
 from user import *
+from paginator import *
+from jobs import *
@@ -0,0 +1,122 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import Client, TestCase, override_settings
+from django.utils.six import StringIO
+from django.utils.timezone import now
+
+from datetime import timedelta
+import json
+
+from admin.jobs import claim_job, create_job, run_jobs, submit
+from admin.models import BulkJob
+from comments.models import Comment, Site, Thread
+
+User = get_user_model()
+
+
+@override_settings(ADMIN_JOB_CHUNK_SIZE=2)
+class BulkJobTestCases(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            "donald@duck.com",
+            "password"
+        )
+        self.user = User.objects.create_user(
+            "scrooge@duck.com",
+            "password",
+        )
+        self.site = Site.objects.create(domain='www.google.com')
+        thread = Thread.objects.create(site=self.site)
+        for i in range(5):
+            Comment.objects.create(thread=thread, user=self.user)
+
+        self.client = Client()
+        self.client.login(email="donald@duck.com", password="password")
+
+    def get_progress(self, job):
+        resp = self.client.get(
+            reverse("c4all_admin:job_progress", args=[job.id]))
+        return json.loads(resp.content)
+
+    def test_job_of_single_chunk_is_run_in_request(self):
+        ids = list(Comment.objects.values_list('id', flat=True)[:2])
+
+        job = submit('delete_comments', self.admin, ids=ids)
+
+        self.assertEqual(job.status, BulkJob.DONE)
+        self.assertEqual(job.processed, 2)
+        self.assertEqual(Comment.objects.count(), 3)
+
+    def test_large_job_is_left_to_runners(self):
+        resp = self.client.get(reverse(
+            "c4all_admin:delete_user", args=[self.site.id, self.user.id]))
+
+        job = BulkJob.objects.get()
+        self.assertRedirects(
+            resp, reverse("c4all_admin:get_users") + '?job=%d' % job.id,
+            fetch_redirect_response=False)
+        self.assertEqual(job.status, BulkJob.PENDING)
+        self.assertEqual(job.total, 5)
+        self.assertEqual(Comment.objects.count(), 5)
+
+        progress = []
+        self.assertEqual(run_jobs(progress=lambda job: progress.append(
+            job.processed)), 1)
+
+        self.assertEqual(progress, [2, 4, 5])
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(self.get_progress(job), {
+            'status': BulkJob.DONE,
+            'total': 5,
+            'processed': 5,
+            'error': '',
+        })
+
+    def test_running_jobs_are_claimed_only_when_stalled(self):
+        job = create_job(
+            'delete_user_comments', status=BulkJob.RUNNING,
+            users=[self.user.id], sites=None)
+        self.assertEqual(claim_job(), None)
+
+        BulkJob.objects.filter(id=job.id).update(
+            updated=now() - timedelta(hours=1))
+
+        self.assertEqual(claim_job(), job)
+
+    def test_progress_of_other_admin_job_is_not_found(self):
+        job = create_job('delete_comments', ids=[])
+        staff = User.objects.create_user("daffy@duck.com", "password")
+        staff.is_staff = True
+        staff.save()
+        self.site.admins.add(staff)
+
+        client = Client()
+        client.login(email="daffy@duck.com", password="password")
+        resp = client.get(reverse("c4all_admin:job_progress", args=[job.id]))
+
+        self.assertEqual(resp.status_code, 404)
+
+    def test_invalid_job_parameter_is_ignored(self):
+        resp = self.client.get(
+            reverse("c4all_admin:get_users"), {'job': 'abc'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse('job-progress' in resp.content)
+
+    def test_job_parameter_isnt_passed_to_other_pages(self):
+        resp = self.client.get(
+            reverse("c4all_admin:get_users"), {'job': 1})
+
+        self.assertTrue('job-progress' in resp.content)
+        self.assertFalse('job' in resp.context['users'].params)
+
+    def test_bulk_action_command_runs_job(self):
+        out = StringIO()
+        call_command(
+            'bulk_action', 'set_users_hidden', users=[self.user.id],
+            sites=[self.site.id], stdout=out)
+
+        self.assertTrue(self.user.hidden.filter(id=self.site.id).exists())
+        self.assertTrue("Processed 1 of 1" in out.getvalue())
+        self.assertEqual(BulkJob.objects.get().status, BulkJob.DONE)
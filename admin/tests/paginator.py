@@ -0,0 +1,91 @@
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils.timezone import now
+
+from datetime import timedelta
+
+from admin.paginator import CursorPaginator, paginate_data
+from comments.models import Site, Thread
+
+
+class CursorPaginatorTestCases(TestCase):
+    def setUp(self):
+        self.site = Site.objects.create()
+        created = now()
+        self.threads = []
+        for i in range(5):
+            thread = Thread.objects.create(site=self.site, url='url_%d' % i)
+            self.threads.append(thread)
+        # two threads without comments, ordered last
+        for i, thread in enumerate(self.threads[:3]):
+            thread.last_comment_at = created - timedelta(microseconds=i)
+            thread.save()
+        self.ordering = ('-last_comment_at', '-id')
+        self.expected = [t.id for t in self.threads[:3]] + \
+            [self.threads[4].id, self.threads[3].id]
+
+    def get_page(self, query=''):
+        request = RequestFactory().get('/threads' + query)
+        return paginate_data(
+            request, Thread.objects.all(), self.ordering, per_page=2)
+
+    def get_ids(self, page):
+        return [thread.id for thread in page]
+
+    def test_pages_are_followed_by_cursors(self):
+        page = self.get_page()
+        ids = self.get_ids(page)
+        self.assertFalse(page.has_previous())
+
+        while page.has_next():
+            page = self.get_page(page.next_page_query)
+            ids += self.get_ids(page)
+
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(page.number, 3)
+        self.assertEqual((page.start_index(), page.end_index()), (5, 5))
+
+        ids = []
+        while page.has_previous():
+            page = self.get_page(page.previous_page_query)
+            ids = self.get_ids(page) + ids
+
+        self.assertEqual(ids, self.expected[:4])
+        self.assertEqual(page.number, 1)
+
+    def test_last_page(self):
+        page = self.get_page('?page=last')
+
+        self.assertEqual(self.get_ids(page), self.expected[4:])
+        self.assertEqual(page.number, 3)
+        self.assertFalse(page.has_next())
+
+    def test_page_number_without_cursor(self):
+        page = self.get_page('?page=2')
+
+        self.assertEqual(self.get_ids(page), self.expected[2:4])
+        self.assertEqual(page.number, 2)
+
+    def test_page_links_keep_request_parameters(self):
+        page = self.get_page('?sort_by=thread_date&page=1')
+
+        self.assertTrue('sort_by=thread_date' in page.next_page_query)
+        self.assertTrue('after=' in page.next_page_query)
+
+    def test_invalid_cursor_falls_back_to_page_number(self):
+        page = self.get_page('?page=2&after=quack')
+
+        self.assertEqual(self.get_ids(page), self.expected[2:4])
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_large_counts_are_estimated(self):
+        paginator = CursorPaginator(Thread.objects.all(), self.ordering, 2)
+
+        self.assertTrue(paginator.estimated)
+        self.assertTrue(paginator.count >= 3)
+
+    def test_small_counts_are_exact(self):
+        paginator = CursorPaginator(Thread.objects.all(), self.ordering, 2)
+
+        self.assertFalse(paginator.estimated)
+        self.assertEqual(paginator.count, 5)
+        self.assertEqual(paginator.num_pages, 3)
@@ -2,6 +2,7 @@ from django.test import TestCase
 from django.test import Client
 from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
+from django.db.models.query import QuerySet
 from django.utils.timezone import now
 
 from comments.models import (Site, Thread, Comment)
@@ -232,6 +233,25 @@ class AdminThreadTestCases(TestCase):
         self.assertEqual(threads[0].id, t2.id)
         self.assertEqual(threads[1].id, t1.id)
 
+    def test_get_threads_by_latest_comment_are_paginated_in_db(self):
+        self.client.login(email="donald@duck.com", password="password")
+
+        threads = [
+            Thread.objects.create(site=self.site, url='test_url_%d' % i)
+            for i in range(3)
+        ]
+        Comment.objects.create(thread=threads[1], user=self.admin)
+        Comment.objects.create(thread=threads[0], user=self.admin)
+
+        resp = self.client.get(reverse("c4all_admin:get_threads"))
+
+        page = resp.context['threads']
+        self.assertTrue(isinstance(page.paginator.queryset, QuerySet))
+        self.assertEqual(
+            [t.id for t in page.object_list],
+            [threads[0].id, threads[1].id, threads[2].id]
+        )
+
     def test_get_threads_returns_all_threads_by_thread_date(self):
         self.client.login(email="donald@duck.com", password="password")
 
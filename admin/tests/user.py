@@ -48,7 +48,7 @@ class AdminUsertestCases(TestCase):
             args=[self.site.id]))
 
         self.assertEqual(resp.status_code, 200)
-        users = resp.context['users'].object_list
+        users = [activity.user for activity in resp.context['users']]
 
         self.assertTrue(self.user in users)
         self.assertTrue(self.user_hidden in users)
@@ -63,11 +63,35 @@ class AdminUsertestCases(TestCase):
             args=[self.site.id]), {"hidden": True})
         self.assertTrue(resp.status_code, 200)
 
-        users = resp.context['users'].object_list
+        users = [activity.user for activity in resp.context['users']]
 
         self.assertTrue(self.user_hidden in users)
         self.assertFalse(self.user in users)
 
+    def test_get_users_orders_users_by_last_comment(self):
+        thread = Thread.objects.create(site=self.site)
+        Comment.objects.create(thread=thread, user=self.user_hidden)
+        Comment.objects.create(thread=thread, user=self.user)
+
+        resp = self.client.get(
+            reverse("c4all_admin:get_users", args=[self.site.id]))
+
+        users = [activity.user for activity in resp.context['users']]
+        self.assertEqual(users, [self.user, self.user_hidden])
+        self.assertEqual(resp.context['hidden_users_count'], 1)
+
+    def test_get_users_of_single_site_if_site_isnt_selected(self):
+        other_site = Site.objects.create(domain='www.example.com')
+        for site in (self.site, other_site):
+            thread = Thread.objects.create(site=site)
+            Comment.objects.create(thread=thread, user=self.user)
+
+        resp = self.client.get(reverse("c4all_admin:get_users"))
+
+        self.assertTrue(resp.context['selected_site'] is not None)
+        users = [activity.user for activity in resp.context['users']]
+        self.assertEqual(users, [self.user])
+
     def test_user_bulk_actions_delete_successfully_deletes_user_comments(self):
         thread = Thread.objects.create(site=self.site)
         Comment.objects.create(thread=thread, user=self.user)
@@ -161,6 +185,35 @@ class AdminUsertestCases(TestCase):
         self.assertEqual(users.count(), 1)
         self.assertTrue(self.user_hidden in users)
 
+    def test_user_bulk_actions_unhide_reveals_users(self):
+        resp = self.client.post(
+            reverse("c4all_admin:user_bulk_actions"),
+            {
+                "site_id": self.site.id,
+                "action": ["unhide"],
+                "choices": [self.user_hidden.id]
+            }
+        )
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertFalse(User.objects.filter(hidden__isnull=False).exists())
+
+    def test_user_bulk_actions_hide_all_hides_users_on_all_sites(self):
+        site2 = Site.objects.create(domain='www.example.com')
+
+        resp = self.client.post(
+            reverse("c4all_admin:user_bulk_actions"),
+            {
+                "site_id": self.site.id,
+                "action": ["hide_all"],
+                "choices": [self.user.id]
+            }
+        )
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(
+            set(self.user.hidden.all()), set([self.site, site2]))
+
     def test_user_hide_not_ajax_call_fails(self):
         """
         Tests endpoint's response to non-ajax call. Endpoint should return
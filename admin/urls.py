@@ -1,9 +1,10 @@
 from django.conf.urls import url
 
-from views import (threads, comments, hide_comment, unhide_comment,
-    delete_comment, login_admin, logout_admin, users, user_bulk_actions,
-    comment_bulk_actions, hide_user, unhide_user, delete_user, change_password,
-    unpublished_comments, unpublished_comment_bulk_actions
+from views import (
+    threads, comments, hide_comment, unhide_comment, delete_comment,
+    login_admin, logout_admin, users, user_bulk_actions, comment_bulk_actions,
+    hide_user, unhide_user, delete_user, change_password, unpublished_comments,
+    unpublished_comment_bulk_actions, job_progress
 )
 
 urlpatterns = [
@@ -41,4 +42,6 @@ urlpatterns = [
         change_password,
         name="change_password"
     ),
+    url(r'^job/(?P<job_id>\d+)/progress$', job_progress,
+        name='job_progress'),
 ]
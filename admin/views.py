@@ -3,13 +3,18 @@ from django.http import HttpResponse
 from django.views.decorators.http import require_POST
 from django.contrib.auth import login, logout
 from django.contrib.auth.forms import AdminPasswordChangeForm
+from django.core.urlresolvers import reverse
+from django.utils.http import urlencode
 from django.utils.translation import ugettext as _
-from django.db.models import Max
 
-from comments.models import Thread, Comment, CustomUser, Site
+from comments.models import (
+    Thread, Comment, CustomUser, UserSiteActivity
+)
 from comments.forms import StaffUserLoginForm
+from admin import jobs
 from admin.decorators import admin_required, ajax_required
-from admin.paginator import paginate_data
+from admin.models import BulkJob
+from admin.paginator import count_objects, paginate_data
 from admin.forms import (
     IntervalSelectionForm, UserBulkActionForm, CommentBulkActionForm,
     UnpublishedCommentBulkActionForm
@@ -18,6 +23,20 @@ from admin.forms import (
 import json
 
 
+def get_ids(queryset):
+    return list(queryset.values_list('id', flat=True))
+
+
+def redirect_to_job(url, job):
+    """
+    Redirects to url, with id of job in job parameter if the job isn't
+    finished, so the page can show its progress.
+    """
+    if job is not None and not job.is_finished:
+        url += '?' + urlencode({'job': job.id})
+    return redirect(url)
+
+
 def login_admin(request):
     if request.user.is_authenticated and request.user.is_staff:
         if 'last_site_id' in request.session:
@@ -91,8 +110,7 @@ def threads(request, site_id=None):
     if interval_selection_form.is_valid():
         date = interval_selection_form.get_date()
 
-    thread_list = Thread.objects.filter(site__in=sites).annotate(
-        max_comment_date=Max('comments__created'))
+    thread_list = Thread.objects.filter(site__in=sites)
 
     if date:
         thread_list = thread_list.filter(created__gte=date)
@@ -103,17 +121,12 @@ def threads(request, site_id=None):
     sort_by = request.GET.get("sort_by", None)
 
     if sort_by == "thread_date":
-        thread_list = thread_list.order_by('-created')
+        ordering = ('-created', '-id')
     else:
-        list_thread_list = list(thread_list.filter(
-                    max_comment_date__isnull=False).order_by('-max_comment_date'))
-
-        list_thread_list += list(thread_list.filter(
-                    max_comment_date__isnull=True).order_by('-max_comment_date'))
-
-        thread_list = list_thread_list
+        # threads without comments go last
+        ordering = ('-last_comment_at', '-id')
 
-    threads = paginate_data(request, thread_list)
+    threads = paginate_data(request, thread_list, ordering)
 
     if site:
         request.session['last_site_id'] = site.id
@@ -142,13 +155,16 @@ def comments(request, thread_id):
 
     hidden = request.GET.get('hidden', False)
     comments_list = thread.comments.all()
+    count = thread.comment_count
 
     if hidden:
         comments_list = comments_list.filter(hidden=True)
+        count = thread.hidden_count
 
-    hidden_comments_count = comments_list.filter(hidden=True).count()
+    hidden_comments_count = thread.hidden_count
 
-    comments = paginate_data(request, comments_list)
+    comments = paginate_data(
+        request, comments_list, ('created', 'id'), count=count)
 
     bulk_action_form = CommentBulkActionForm(initial={'site_id':thread.site.id})
 
@@ -180,9 +196,9 @@ def unpublished_comments(request, site_id=None):
         site = sites[0] if sites.exists() else None
 
     comments_list = Comment.objects.filter(hidden=True, thread__site__id=site_id)
-    hidden_comments_count = comments_list.count()
 
-    comments = paginate_data(request, comments_list)
+    comments = paginate_data(request, comments_list, ('created', 'id'))
+    hidden_comments_count = comments.paginator.count
 
     bulk_action_form = UnpublishedCommentBulkActionForm(initial={'site_id':site.id})
 
@@ -238,7 +254,8 @@ def delete_comment(request, comment_id):
 @admin_required
 def users(request, site_id):
     """
-    Returns all users if hidden parameter not provided, hidden users if
+    Returns activity of users commenting on site (ordered by their last
+    comment) if hidden parameter not provided, activity of hidden users if
     hidden parameter is True.
     """
     site = None
@@ -253,17 +270,22 @@ def users(request, site_id):
         site = sites[0] if sites.exists() else None
 
     hidden = request.GET.get('hidden', False)
-    user_list = request.user.get_users()
+    # activity is kept per site, so users are always listed for a single
+    # site (none if the admin has no sites)
+    activity = UserSiteActivity.objects.filter(
+        site=site, user__is_staff=False)
     if site:
-        user_list = user_list.filter(comments__thread__site=site)
         request.session['last_site_id'] = site.id
 
-    if hidden and site:
-        user_list = user_list.filter(hidden__in=[site])
+    hidden_users_count = count_objects(activity.filter(hidden=True))[0]
 
-    hidden_users_count = user_list.filter(hidden__in=[site]).count()
+    if hidden:
+        activity = activity.filter(hidden=True)
 
-    users = paginate_data(request, user_list)
+    users = paginate_data(
+        request, activity.select_related('user'),
+        ('-last_comment_at', '-id')
+    )
 
     bulk_action_form = UserBulkActionForm()
     return render(
@@ -284,25 +306,35 @@ def users(request, site_id):
 @require_POST
 def user_bulk_actions(request):
     """
-    Endpoint which handles bulk actions (namely hide and delete) for users.
-    Redirects user to users page from which he came.
+    Endpoint which handles bulk actions (namely hide, unhide, hide on all
+    sites of admin and delete) for users. Redirects user to users page from
+    which he came.
     """
     form = UserBulkActionForm(request.POST or None)
+    job = None
 
     if form.is_valid():
         cd = form.cleaned_data
-        site = get_object_or_404(Site, id=form.cleaned_data['site_id'])
+        sites = request.user.get_sites()
+        site = get_object_or_404(sites, id=form.cleaned_data['site_id'])
 
         if cd['action'] == 'delete':
             users = cd['choices'].filter(
                 id__in=request.user.get_users(), is_staff=False)
-            Comment.objects.filter(user__id__in=users).delete()
-        if cd['action'] == 'hide':
+            job = jobs.submit(
+                'delete_user_comments', request.user,
+                users=get_ids(users), sites=None)
+        if cd['action'] in ('hide', 'unhide', 'hide_all'):
             users = cd['choices'].filter(id__in=request.user.get_users())
-            for user in users:
-                user.hidden.add(site)
+            if cd['action'] == 'hide_all':
+                site_ids = get_ids(sites)
+            else:
+                site_ids = [site.id]
+            job = jobs.submit(
+                'set_users_hidden', request.user, users=get_ids(users),
+                sites=site_ids, hidden=cd['action'] != 'unhide')
 
-    return redirect("c4all_admin:get_users")
+    return redirect_to_job(reverse("c4all_admin:get_users"), job)
 
 
 @admin_required
@@ -313,35 +345,43 @@ def comment_bulk_actions(request, thread_id):
     Redirects user to comments page from which he came.
     """
     form = CommentBulkActionForm(request.POST or None)
+    job = None
 
     if form.is_valid():
         cd = form.cleaned_data
-        comments = cd['choices'].filter(id__in=request.user.get_comments())
+        comments = get_ids(
+            cd['choices'].filter(id__in=request.user.get_comments()))
         if cd['action'] == 'delete':
-            Comment.objects.bulk_delete(comments)
+            job = jobs.submit('delete_comments', request.user, ids=comments)
         if cd['action'] == 'hide':
-            Comment.objects.filter(
-                id__in=comments).update(hidden=True)
+            job = jobs.submit(
+                'set_comments_hidden', request.user, ids=comments,
+                hidden=True)
 
-    return redirect("c4all_admin:get_thread_comments", thread_id)
+    return redirect_to_job(
+        reverse("c4all_admin:get_thread_comments", args=[thread_id]), job)
 
 
 @admin_required
 @require_POST
 def unpublished_comment_bulk_actions(request, site_id):
     form = UnpublishedCommentBulkActionForm(request.POST or None)
+    job = None
 
     if form.is_valid():
         cd = form.cleaned_data
-        comments = cd['choices'].filter(id__in=request.user.get_comments())
+        comments = get_ids(
+            cd['choices'].filter(id__in=request.user.get_comments()))
         if cd['action'] == 'delete':
-            Comment.objects.bulk_delete(comments)
-            pass
+            job = jobs.submit('delete_comments', request.user, ids=comments)
         if cd['action'] == 'unhide':
-            Comment.objects.filter(
-                id__in=comments).update(hidden=False)
+            job = jobs.submit(
+                'set_comments_hidden', request.user, ids=comments,
+                hidden=False)
 
-    return redirect("c4all_admin:unpublished_comments", site_id)
+    return redirect_to_job(
+        reverse("c4all_admin:unpublished_comments",
+                args=[site_id] if site_id else []), job)
 
 
 @admin_required
@@ -392,7 +432,31 @@ def delete_user(request, site_id, user_id):
     """
     user = get_object_or_404(
         request.user.get_users(), id=user_id, is_staff=False)
-    comments = user.comments.filter(thread__site__id=site_id)
-    comments.delete()
+    site = get_object_or_404(request.user.get_sites(), id=site_id)
+    job = jobs.submit(
+        'delete_user_comments', request.user, users=[user.id],
+        sites=[site.id])
+
+    return redirect_to_job(reverse("c4all_admin:get_users"), job)
+
+
+@admin_required
+def job_progress(request, job_id):
+    """
+    Returns status and progress of bulk job started by admin (superusers can
+    see all jobs).
+    """
+    job_list = BulkJob.objects.all()
+    if not request.user.is_superuser:
+        job_list = job_list.filter(user=request.user)
+    job = get_object_or_404(job_list, id=job_id)
 
-    return redirect("c4all_admin:get_users")
+    return HttpResponse(
+        json.dumps({
+            'status': job.status,
+            'total': job.total,
+            'processed': min(job.processed, job.total),
+            'error': job.error,
+        }),
+        content_type="application/json"
+    )
@@ -7,3 +7,7 @@ class C4allAdminConfig(AppConfig):
 class C4allCommentsConfig(AppConfig):
     name = 'comments'
     label = 'c4all_comments'
+
+    def ready(self):
+        import comments.checks  # noqa
+        import comments.signals  # noqa
@@ -136,7 +136,7 @@ TEMPLATES = [
 
 MIDDLEWARE_CLASSES = (
     'django.middleware.common.CommonMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'comments.middleware.AnonymousSessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -210,11 +210,116 @@ DOMAIN_URL_PATTERN = "(https?:\/\/)?([a-z0-9_.-]+\.[a-z0-9]{2,5}(:\d+)?)"
 
 # pagination settings
 PER_PAGE = 20
+# admin list totals are counted exactly up to ADMIN_EXACT_COUNT_LIMIT objects
+# (larger totals are estimated) and cached for ADMIN_COUNT_CACHE_TIMEOUT
+# seconds, see admin/paginator.py
+ADMIN_EXACT_COUNT_LIMIT = 10000
+ADMIN_COUNT_CACHE_TIMEOUT = 60
 
 TITLE_SELECTOR = '#c4all-admin-page-title'
 
 # spellchecking ability (disabled by default)
 SPELLCHECK_ENABLED = False
+# number of words whose suggested corrections are cached by each process
+SPELLCHECK_CACHE_SIZE = 10000
+
+# spellchecking is run in a pool of SPELLCHECK_POOL_SIZE processes (0 runs it
+# in request workers), at most SPELLCHECK_QUEUE_SIZE tasks of a request worker
+# can wait in the pool and checks return partial results after
+# SPELLCHECK_TIMEOUT seconds. Each request worker starts its own pool, so
+# there are up to workers * SPELLCHECK_POOL_SIZE spellcheck processes. Use
+# spellcheck_metrics command (requires shared cache) to size the pool.
+SPELLCHECK_POOL_SIZE = 2
+SPELLCHECK_QUEUE_SIZE = 50
+SPELLCHECK_TIMEOUT = 2
 
 # default number of comments
 WIDGET_COMMENTS_DEFAULT_NUMBER = 10
+
+# timeout (in seconds) of rendered widget comments cache, cached HTML is
+# invalidated on every thread change anyway
+COMMENTS_CACHE_TIMEOUT = 60 * 60
+
+# max-age (in seconds) of publicly cacheable widget responses, responses
+# are revalidated by ETag/Last-Modified afterwards
+WIDGET_CACHE_MAX_AGE = 10
+
+# max number of threads whose comment counts can be requested at once
+COMMENT_COUNTS_MAX_THREADS = 100
+
+# number of seconds by which cursors of comment changes overlap, so changes
+# committed while the previous changes were fetched are not missed
+COMMENT_CHANGES_OVERLAP = 5
+
+# backend delivering thread events to comment streams, use
+# comments.pubsub.PostgresPubSub when running more than one process
+COMMENTS_PUBSUB_BACKEND = 'comments.pubsub.LocalPubSub'
+
+# comment streams (Server-Sent Events) are disabled by default, the widget
+# polls for changes every COMMENTS_POLL_INTERVAL seconds instead. Streams
+# are long-lived, so enabling them requires async (e.g. gevent) gunicorn
+# workers and comments.pubsub.PostgresPubSub backend (LocalPubSub doesn't
+# deliver events published by other worker processes).
+COMMENTS_STREAM_ENABLED = False
+COMMENTS_POLL_INTERVAL = 30
+
+# comment streams are closed after COMMENTS_STREAM_TIMEOUT seconds and
+# clients reconnect after COMMENTS_STREAM_RETRY seconds. Keepalive comments
+# are sent when nothing happens for COMMENTS_STREAM_KEEPALIVE seconds.
+COMMENTS_STREAM_TIMEOUT = 5 * 60
+COMMENTS_STREAM_RETRY = 3
+COMMENTS_STREAM_KEEPALIVE = 15
+
+# anonymous votes can be buffered in cache and saved to DB every
+# VOTE_BUFFER_FLUSH_INTERVAL seconds by flush_votes command, which has to be
+# kept running (see comments/votes.py). Cache has to be shared by all
+# processes (memcached or redis) for flush_votes command to see buffered
+# votes, so the buffer is disabled by default.
+VOTE_BUFFER_ENABLED = False
+VOTE_BUFFER_FLUSH_INTERVAL = 10
+
+# sites resolved by domain are cached in shared cache until they are changed
+# (at most SITE_CACHE_TIMEOUT seconds) and in process memory for
+# SITE_LOCAL_CACHE_TIMEOUT seconds, so changes of sites can take that long to
+# reach other processes. If the default cache isn't shared (e.g. locmem),
+# sites are cached in it for at most SITE_LOCAL_CACHE_TIMEOUT seconds too.
+SITE_CACHE_TIMEOUT = 60 * 60
+SITE_LOCAL_CACHE_TIMEOUT = 10
+
+# ids of sites on which users are hidden are cached until they change
+# (changes aren't seen by other processes if cache isn't shared, so writes
+# of users check DB directly)
+USER_HIDDEN_CACHE_TIMEOUT = 60 * 60
+
+# votes and comments of anonymous users are kept in session only for
+# SESSION_THREADS_LIMIT most recently voted (or commented) threads and for
+# at most SESSION_STATE_IDS_LIMIT comments and threads in total, which keeps
+# signed cookie sessions below browser cookie size limit
+SESSION_THREADS_LIMIT = 20
+SESSION_STATE_IDS_LIMIT = 200
+
+# sessions of anonymous users are kept in ANONYMOUS_SESSION_ENGINE (signed
+# cookies, or 'django.contrib.sessions.backends.cache' if cache is shared by
+# all processes) and moved to DB on login (see comments/middleware.py)
+ANONYMOUS_SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+ANONYMOUS_SESSION_COOKIE_NAME = 'anonsessionid'
+
+# expired sessions are deleted by clear_expired_sessions command in batches
+SESSION_CLEANUP_BATCH_SIZE = 1000
+
+# admin bulk actions are run as jobs (see admin/jobs.py) in chunks of
+# ADMIN_JOB_CHUNK_SIZE objects, each in its own transaction. Actions of a
+# single chunk are run in the request, larger ones by a runner thread of the
+# web process (if ADMIN_JOB_LOCAL_RUNNER is set) or run_bulk_jobs command.
+# Running jobs which don't progress for ADMIN_JOB_TIMEOUT seconds are taken
+# over by other runners.
+ADMIN_JOB_CHUNK_SIZE = 500
+ADMIN_JOB_LOCAL_RUNNER = True
+ADMIN_JOB_TIMEOUT = 5 * 60
+
+# comments, users, threads and sites are deleted in chunks of
+# DELETION_CHUNK_SIZE rows (see comments/deletion.py). With
+# COMMENTS_SOFT_DELETE comments are only marked as deleted (hiding them at
+# once) and removed from DB by purge_deleted_comments command.
+DELETION_CHUNK_SIZE = 1000
+COMMENTS_SOFT_DELETE = False
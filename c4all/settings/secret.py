@@ -0,0 +1 @@
+SECRET_KEY = u'_3i5v7qjhv=m=vsy&uoc3swhndge2wcs34+##xg$g+f2&dt*f2'
@@ -14,6 +14,12 @@ CACHES = {
     }
 }
 
+# votes can't be buffered without cache
+VOTE_BUFFER_ENABLED = False
+
+# spellcheck pool processes are started by tests which need them
+SPELLCHECK_POOL_SIZE = 0
+
 try:
     import django_nose  # noqa
     import os.path
@@ -37,3 +43,6 @@ PASSWORD_HASHERS = (
 )
 
 LANGUAGE_CODE = 'en'
+
+# bulk jobs are run by tests which need them
+ADMIN_JOB_LOCAL_RUNNER = False
@@ -10,7 +10,12 @@
     var SPELLCHECK_ENABLED = false;
     var MIN_PARENT_WIDTH = 600;
     var SPELLCHECK_LOCALIZATION;
+    var COMMENTS_CURSOR = null;
+    var STREAM_ENABLED = false;
+    var POLL_INTERVAL = 30;
     var spellchecker;
+    // suggestions for incorrect words returned by the last spellcheck
+    var spellcheckSuggestions = {};
     var READSPEAKER_BASE_URL = 'http://app.eu.readspeaker.com/cgi-bin/rsent?';
 
     // try to get c4all domain from the script tag
@@ -131,20 +136,67 @@
     }
 
 
-    function makeCrossDomainGet(url, params) {
-        return jQuery.ajax({
-            type: 'GET',
-            url: url,
-            data: params,
-            dataType: 'jsonp',
-            crossDomain: true
-        }).then(function (data) {
+    // pending JSONP requests by their callback name
+    var jsonpRequests = {};
+
+    function getJsonp(url, params, name) {
+        // callback names are fixed per endpoint (instead of random ones),
+        // so identical requests have identical URLs and responses can be
+        // revalidated by ETag and cached by browsers and CDNs
+        var send = function() {
+            return jQuery.ajax({
+                type: 'GET',
+                url: url,
+                data: params,
+                dataType: 'jsonp',
+                jsonpCallback: 'c4all_' + name,
+                cache: true,
+                crossDomain: true
+            });
+        };
+        // requests sharing a callback name can't be pending at once
+        var request = $.when(jsonpRequests[name]).then(send, send);
+        jsonpRequests[name] = request;
+        return request;
+    }
+
+    function makeCrossDomainGet(url, params, name) {
+        return getJsonp(url, params, name).then(function (data) {
             var id = '#' + data.html_container_name;
             jQuery(id).html(data.html);
+            if (data.cursor) {
+                COMMENTS_CURSOR = data.cursor;
+            }
+            if (data.overlay) {
+                applyCommentsOverlay(data.overlay);
+            }
             return data;
         });
     }
 
+    function applyCommentsOverlay(overlay) {
+        // rendered comments are shared between users, so marks of user's
+        // own comments and votes are applied on the client side
+        var comment = function(id) {
+            return jQuery('.comment-list-item[data-comment-id="' + id + '"]');
+        };
+
+        jQuery.each(overlay.posted_comments, function(i, id) {
+            comment(id).addClass('my-comment').removeClass('last-comment');
+        });
+        if (overlay.last_posted_comment_id) {
+            var last = comment(overlay.last_posted_comment_id);
+            last.find('.tag-my-comment').removeClass('element-hidden');
+            last.find('.tag-last-comment').remove();
+        }
+        jQuery.each(overlay.liked_comments, function(i, id) {
+            comment(id).find('.thumb-up').addClass('state-active');
+        });
+        jQuery.each(overlay.disliked_comments, function(i, id) {
+            comment(id).find('.thumb-down').addClass('state-active');
+        });
+    }
+
     function makeUrl(action) {
         var path = '';
         if (jQuery.inArray(action, ['like', 'dislike']) >= 0) {
@@ -160,7 +212,7 @@
     }
 
     function doGet(action, params) {
-        return makeCrossDomainGet(C4ALL_SERVER + makeUrl(action), params);
+        return makeCrossDomainGet(C4ALL_SERVER + makeUrl(action), params, action);
     }
 
     function fetchHtml(part, add_params) {
@@ -272,7 +324,7 @@
         var commentId = $(this).closest('.comment-list-item').data('comment-id');
         var action = el.data('action');
         var url = C4ALL_SERVER + '/comment/' + commentId + '/' + action;
-        makeCrossDomainPost(url, { 'domain': DOMAIN });
+        makeCrossDomainPost(url, { 'domain': DOMAIN, 'compact': 1 });
         return false;
     }
 
@@ -444,6 +496,7 @@
                 return false;
             },
             '#btn-viev-all-comments': get_all_comments,
+            '#btn-load-more-comments': loadMoreComments,
         };
 
         for (var handler in handlers) {
@@ -460,6 +513,12 @@
             responsive_design();
         });
 
+        $(document).on('visibilitychange', function() {
+            if (!document.hidden) {
+                fetchCommentChanges();
+            }
+        });
+
         $('#comments_footer').on('click keyup', '#comment-input-ceditable', function() {
             var el = this;
             clearTimeout(keyupTimeout);
@@ -534,6 +593,156 @@
         return false;
     }
 
+    function setVoteCount(container, count) {
+        container.find('.count').text(count);
+        var extra = container.find('.extra');
+        extra.text(' ' + extra.data(count === 1 ? 'singular' : 'plural'));
+    }
+
+    function applyCommentState(state) {
+        var comment = $('#comments_container .comment-list-item[data-comment-id="' + state.id + '"]');
+
+        setVoteCount(comment.find('.thumb-up').parent(), state.likes);
+        setVoteCount(comment.find('.thumb-down').parent(), state.dislikes);
+        comment.find('.thumb-up').toggleClass('state-active', state.liked);
+        comment.find('.thumb-down').toggleClass('state-active', state.disliked);
+        comment.find('[data-action="hide"]').toggleClass('element-hidden', state.hidden);
+        comment.find('[data-action="unhide"]').toggleClass('element-hidden', !state.hidden);
+    }
+
+    function applyCommentChanges(data) {
+        var list = $('#comments_container .comment-list > ol');
+        var allLoaded = !$('#btn-load-more-comments').length;
+        var reload = false;
+
+        jQuery.each(data.changes, function(i, change) {
+            var comment = list.find('.comment-list-item[data-comment-id="' + change.id + '"]');
+            if (change.hidden) {
+                comment.remove();
+                return;
+            }
+            if (!comment.length) {
+                // comment was published again, its place in the list is
+                // known only to the server
+                reload = reload || allLoaded;
+                return;
+            }
+            setVoteCount(comment.find('.thumb-up').parent(), change.likes);
+            setVoteCount(comment.find('.thumb-down').parent(), change.dislikes);
+        });
+
+        if (reload) {
+            return $.when(fetchHtml('comments')).then(assignReadSpeakerToComments);
+        }
+
+        // new comments belong to the end of the thread, so they can be added
+        // only if all comments are loaded
+        if (data.html && allLoaded) {
+            var items = $(data.html).filter('.comment-list-item').filter(function() {
+                return !list.find('.comment-list-item[data-comment-id="' + $(this).data('comment-id') + '"]').length;
+            });
+            if (items.length) {
+                list.find('.last-comment').removeClass('last-comment')
+                    .find('.tag-last-comment').remove();
+                list.append(items);
+                assignReadSpeakerToComments();
+            }
+        }
+
+        applyCommentsOverlay(data.overlay);
+    }
+
+    function fetchCommentChanges() {
+        if (!COMMENTS_CURSOR) {
+            return;
+        }
+
+        var params = {
+            thread: THREAD,
+            domain: DOMAIN,
+            since: COMMENTS_CURSOR
+        };
+
+        return getJsonp(C4ALL_SERVER + '/comments/changes', params, 'changes').then(function(data) {
+            COMMENTS_CURSOR = data.cursor;
+            if (data.reload) {
+                return $.when(fetchHtml('comments')).then(assignReadSpeakerToComments);
+            }
+            applyCommentChanges(data);
+        });
+    }
+
+    function applyCommentEvent(state) {
+        var comment = $('#comments_container .comment-list-item[data-comment-id="' + state.id + '"]');
+
+        if (!comment.length) {
+            // comment was published again, its place in the list is known
+            // only to the server
+            if (state.hidden === false) {
+                fetchCommentChanges();
+            }
+            return;
+        }
+        if (state.hidden) {
+            comment.remove();
+            return;
+        }
+        if (state.likes !== undefined) {
+            setVoteCount(comment.find('.thumb-up').parent(), state.likes);
+            setVoteCount(comment.find('.thumb-down').parent(), state.dislikes);
+        }
+    }
+
+    function pollCommentChanges() {
+        setTimeout(function() {
+            // hidden pages are updated when they become visible again
+            var request = document.hidden ? null : fetchCommentChanges();
+            $.when(request).always(pollCommentChanges);
+        }, POLL_INTERVAL * 1000);
+    }
+
+    function listenCommentEvents() {
+        if (!THREAD) {
+            return;
+        }
+        if (!STREAM_ENABLED || !window.EventSource) {
+            pollCommentChanges();
+            return;
+        }
+
+        var source = new EventSource(C4ALL_SERVER + '/comments/stream?' + $.param({
+            thread: THREAD,
+            domain: DOMAIN
+        }));
+        source.addEventListener('comment', function() {
+            fetchCommentChanges();
+        });
+        source.addEventListener('state', function(e) {
+            applyCommentEvent(JSON.parse(e.data));
+        });
+    }
+
+    function loadMoreComments(){
+        var button = $(this);
+        var params = {
+            thread: THREAD,
+            domain: DOMAIN,
+            start: button.data('start')
+        };
+
+        getJsonp(C4ALL_SERVER + '/comments', params, 'more_comments').then(function(data) {
+            $('#comments_container .comment-list > ol').append(data.html);
+            if (data.next) {
+                button.data('start', data.next);
+            } else {
+                button.closest('.action-list-bottom').remove();
+            }
+            applyCommentsOverlay(data.overlay);
+            assignReadSpeakerToComments();
+        });
+        return false;
+    }
+
     function buildHtml() {
         // divide main container to 3 parts
         jQuery('#c4all-widget-container')
@@ -558,10 +767,16 @@
 
             if ((data.status_code === 200) && response.placement && response.content) {
                 $('#' + response.placement).html(response.content);
+                if (response.overlay) {
+                    applyCommentsOverlay(response.overlay);
+                }
             }
             if (response.placement === "comments_container"){
                 assignReadSpeakerToComments();
             }
+            if ((data.status_code === 200) && response.comment) {
+                applyCommentState(response.comment);
+            }
         } catch (e) { }
 
         if (data.iframeId){
@@ -591,6 +806,9 @@
             sendComment();
             $.when(fetchHtml('footer')).then(assignMagnificPopup).then(assignJquerySpellChecker).then(assignReadSpeakerToEditor);
             break;
+        case '/spellcheck/check':
+            handleSpellcheck(response);
+            break;
         case '/spellcheck/incorrect_words':
             handleIncorrectWords(response);
             break;
@@ -614,13 +832,28 @@
         spellchecker.suggestBox.onGetWords(resp.data);
     }
 
+    // incorrect words are returned with their suggestions, so they
+    // don't have to be requested per word
+    function handleSpellcheck(resp){
+        var words = [];
+        spellcheckSuggestions = {};
+        jQuery.each(resp.data, function(i, item) {
+            words.push(item.word);
+            // suggestions not found in time are requested when needed
+            if (item.suggestions !== null) {
+                spellcheckSuggestions[item.word] = item.suggestions;
+            }
+        });
+        handleIncorrectWords({data: [words]});
+    }
+
     // removes span tags if any (span tags appear
     // as a result of a spellchecking process)
     function sanitizeSpellcheckedHtml(html){
         return html.replace(/(<(?!(img|\/img|br|\/br)).+?>)/ig, "");
     }
 
-    function fetchThreadId(){
+    function fetchWidget(){
         var params = {
             thread: THREAD_URL,
             domain: DOMAIN,
@@ -629,12 +862,22 @@
             h1_title: $('h1').first().text()
         };
 
-        var url = C4ALL_SERVER + '/thread_info';
-        return makeCrossDomainGet(url, params).then(function(data) {
+        var url = C4ALL_SERVER + '/widget';
+        return getJsonp(url, params, 'widget').then(function(data) {
             THREAD = data.thread_id;
             COMMENTS_ENABLED = data.comments_enabled;
             SPELLCHECK_ENABLED = data.spellcheck_enabled;
             SPELLCHECK_LOCALIZATION = data.spellcheck_localization;
+            COMMENTS_CURSOR = data.cursor;
+            STREAM_ENABLED = data.stream_enabled;
+            POLL_INTERVAL = data.poll_interval || POLL_INTERVAL;
+
+            for (var container in data.html) {
+                jQuery('#' + container).html(data.html[container]);
+            }
+            if (data.overlay) {
+                applyCommentsOverlay(data.overlay);
+            }
             return data;
         });
     }
@@ -716,7 +959,6 @@
     }
 
     function main() {
-        fetchThreadId();
         $('<link>', {
             rel: 'stylesheet',
             type: 'text/css',
@@ -741,10 +983,11 @@
         }
 
         $(function() {
-            $.when(fetchThreadId(), myIP())
+            $.when(myIP())
                 .then(buildHtml)
-                .then(fetchHtml)
+                .then(fetchWidget)
                 .then(bindEvents)
+                .then(listenCommentEvents)
                 .then(assignMagnificPopup)
                 .then(function(){
                     if (SPELLCHECK_ENABLED){
@@ -826,11 +1069,15 @@
         };
 
         spellchecker.webservice.checkWords = function(text){
-            this.makeRequest("spellcheck/incorrect_words", {'text': sanitizeNewlines($('#comment-input-ceditable').html())});
+            this.makeRequest("spellcheck/check", {'text': sanitizeNewlines($('#comment-input-ceditable').html())});
         };
 
         spellchecker.webservice.getSuggestions = function(word){
-            this.makeRequest("spellcheck/suggestions", {'word': word});
+            if (spellcheckSuggestions.hasOwnProperty(word)) {
+                spellchecker.suggestBox.onGetWords(spellcheckSuggestions[word]);
+            } else {
+                this.makeRequest("spellcheck/suggestions", {'word': word});
+            }
         };
 
         $("#button-spellcheck").on('click', function(){
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core import checks
+
+from utils.cache import is_cache_shared
+
+
+@checks.register()
+def check_vote_buffer_cache(app_configs, **kwargs):
+    """
+    Buffered votes are counted in cache of the process which received them,
+    so they are saved by flush_votes command only if cache is shared.
+    """
+    if settings.VOTE_BUFFER_ENABLED and not is_cache_shared():
+        return [checks.Error(
+            "VOTE_BUFFER_ENABLED requires cache shared by all processes.",
+            hint="Use memcached or redis cache backend, or disable "
+                 "VOTE_BUFFER_ENABLED.",
+            id='c4all.E001',
+        )]
+    return []
@@ -1,8 +1,13 @@
+from django.conf import settings
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
 from comments.models import Site
 
+from calendar import timegm
+import hashlib
 import json
 
 
@@ -18,15 +23,67 @@ def json_response(func):
             return objects
 
         data = json.dumps(objects)
-        if 'callback' in request:
+        callback = request.GET.get('callback', request.POST.get('callback'))
+        if callback:
             # a jsonp response!
-            data = '%s(%s);' % (request['callback'], data)
+            data = '%s(%s);' % (callback, data)
             return HttpResponse(data, "text/javascript")
 
         return HttpResponse(data, "application/json")
     return decorator
 
 
+def conditional_response(validators):
+    """
+    A decorator which adds conditional GET support to read-only widget
+    endpoints. validators is called with view arguments before the view
+    and returns (etag, last_modified) tuple describing response content
+    (last_modified may be None) or None if response shouldn't be
+    conditional (e.g. it's meant for logged in user). If request
+    preconditions match, 304 response is returned without calling the view.
+
+    JSONP callback is part of the response body, so it's added to the ETag
+    (the widget uses a fixed callback name per endpoint, so its responses
+    are shared by all clients).
+    Conditional responses which don't change session are publicly cacheable
+    for WIDGET_CACHE_MAX_AGE seconds, everything else is private.
+    """
+    def wrapper(func):
+        def decorator(request, *args, **kwargs):
+            etag = last_modified = None
+
+            current = validators(request, *args, **kwargs)
+            if current is not None:
+                etag, last_modified = current
+                etag = quote_etag(hashlib.md5('%s:%s' % (
+                    etag, request.GET.get('callback', ''))).hexdigest())
+                if last_modified is not None:
+                    last_modified = timegm(last_modified.utctimetuple())
+
+            resp = None
+            if etag is not None:
+                resp = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified)
+            if resp is None:
+                resp = func(request, *args, **kwargs)
+
+            if etag is not None and resp.status_code in (200, 304):
+                resp['ETag'] = etag
+                if last_modified is not None:
+                    resp['Last-Modified'] = http_date(last_modified)
+
+                if not request.session.modified:
+                    patch_cache_control(
+                        resp, public=True,
+                        max_age=settings.WIDGET_CACHE_MAX_AGE)
+                    return resp
+
+            patch_cache_control(resp, private=True, no_cache=True)
+            return resp
+        return decorator
+    return wrapper
+
+
 def cross_domain_post_response(func):
     def decorator(request, *args, **kwargs):
         resp = func(request, *args, **kwargs)
@@ -54,7 +111,7 @@ def host_check(func):
 
         if domain:
             try:
-                Site.objects.get(domain=domain)
+                Site.objects.get_for_domain(domain)
             except Site.DoesNotExist:
                 data = {
                     'placement': 'comments_container',
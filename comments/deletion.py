@@ -0,0 +1,93 @@
+"""
+Deletion of rows with raw set-based statements instead of Django's
+Collector, which loads all related rows (and M2M through rows) into memory
+and sends signals for each of them. Rows are deleted by ids together with
+rows depending on them (following on_delete of foreign keys pointing to
+them, which includes M2M through tables), rows with dependents of their own
+are deleted in chunks of DELETION_CHUNK_SIZE. Deletion signals aren't sent,
+callers are responsible for their side effects.
+"""
+from django.conf import settings
+from django.db import connections, models
+
+
+def iter_id_chunks(queryset, size=None):
+    """
+    Yields lists of at most size (DELETION_CHUNK_SIZE by default) primary
+    keys of queryset in ascending order. Chunks are fetched by keyset, so
+    rows can be deleted (or changed to not match the queryset) while they
+    are iterated.
+    """
+    size = size or settings.DELETION_CHUNK_SIZE
+    queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        ids = list(chunk[:size])
+        if not ids:
+            return
+        yield ids
+        if len(ids) < size:
+            return
+        last = ids[-1]
+
+
+def get_dependents(model):
+    """
+    Returns foreign keys (of other models, including M2M through tables)
+    pointing to model.
+    """
+    return [
+        relation.field for relation in model._meta.get_fields(
+            include_hidden=True)
+        if relation.auto_created and not relation.concrete and
+        (relation.one_to_many or relation.one_to_one)
+    ]
+
+
+def execute(model, sql, params):
+    connection = connections[model._base_manager.db]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def delete_objects(model, ids):
+    """
+    Deletes rows of model with given primary keys and rows depending on
+    them. Returns number of deleted rows of model.
+    """
+    if not ids:
+        return 0
+
+    quote_name = connections[model._base_manager.db].ops.quote_name
+    ids = list(ids)
+
+    for field in get_dependents(model):
+        related_model = field.model
+        on_delete = field.remote_field.on_delete
+        table = quote_name(related_model._meta.db_table)
+        column = quote_name(field.column)
+
+        if on_delete is models.CASCADE:
+            if get_dependents(related_model):
+                related = related_model._base_manager.filter(
+                    **{field.attname + '__in': ids})
+                for chunk in iter_id_chunks(related):
+                    delete_objects(related_model, chunk)
+            else:
+                execute(related_model,
+                        'DELETE FROM %s WHERE %s = ANY(%%s)' % (
+                            table, column), [ids])
+        elif on_delete is models.SET_NULL:
+            execute(related_model,
+                    'UPDATE %s SET %s = NULL WHERE %s = ANY(%%s)' % (
+                        table, column, column), [ids])
+        elif on_delete is not models.DO_NOTHING:
+            raise ValueError(
+                "Deletion of %s rows referenced by %s.%s isn't supported" % (
+                    model.__name__, related_model.__name__, field.name))
+
+    return execute(model, 'DELETE FROM %s WHERE %s = ANY(%%s)' % (
+        quote_name(model._meta.db_table), quote_name(model._meta.pk.column)
+    ), [ids])
@@ -4,7 +4,8 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.contrib.auth import authenticate
 
-from models import (Comment, Site, Thread)
+from models import (Comment, Site)
+from pubsub import publish_event
 from django.utils.translation import ugettext as _
 
 import re
@@ -41,7 +42,8 @@ class RegularUserLoginForm(UserLoginForm):
         if not self.user:
             return self.cleaned_data
 
-        if self.user.hidden.filter(id__in=[self.cleaned_data['site_id']]):
+        if self.user.is_hidden_on(
+                int(self.cleaned_data['site_id']), cached=False):
             raise forms.ValidationError(_("user hidden"))
 
         return self.cleaned_data
@@ -175,12 +177,13 @@ class PostCommentForm(forms.ModelForm):
         domain = self.cleaned_data.get('domain')
 
         if domain:
-            if Site.objects.filter(domain=domain).exists():
-                return domain
-            else:
+            try:
+                self.site = Site.objects.get_for_domain(domain)
+            except Site.DoesNotExist:
                 raise forms.ValidationError(
                     _("site with domain %s does not exist") % domain
                 )
+            return domain
         else:
             raise forms.ValidationError(_("domain not provided"))
 
@@ -194,15 +197,13 @@ class PostCommentForm(forms.ModelForm):
         if not thread.allow_comments:
             raise forms.ValidationError(_("comments not allowed"))
 
-        try:
-            site = Site.objects.get(domain=domain)
-            if not self.user.is_anonymous():
-                if self.user.hidden.filter(id=site.id):
-                    raise forms.ValidationError(
-                        _('user is disabled on site with id %s') % site.id
-                    )
-            site.threads.get(id=thread.id)
-        except Thread.DoesNotExist:
+        site = self.site
+        if not self.user.is_anonymous():
+            if self.user.is_hidden_on(site.id, cached=False):
+                raise forms.ValidationError(
+                    _('user is disabled on site with id %s') % site.id
+                )
+        if thread.site_id != site.id:
             raise forms.ValidationError(
                 _('thread with id %s does not exist') % thread.id
             )
@@ -223,6 +224,8 @@ class PostCommentForm(forms.ModelForm):
             comment.ip_address = self.ip_address
         comment.save()
 
+        publish_event(comment.thread_id, 'comment', {'id': comment.id})
+
         return comment
 
 
@@ -230,10 +233,19 @@ class GetRequestValidationForm(forms.Form):
 
     domain = forms.CharField()
     thread = forms.IntegerField()
-    start = forms.DateTimeField(required=False)
+    # id of the first comment of requested page
+    start = forms.IntegerField(required=False)
     count = forms.IntegerField(required=False, initial=100)
 
 
+class CommentChangesForm(forms.Form):
+
+    domain = forms.CharField()
+    thread = forms.IntegerField()
+    # cursor returned by comments endpoints
+    since = forms.IntegerField(min_value=0)
+
+
 class SiteForm(forms.ModelForm):
 
     class Meta:
@@ -0,0 +1,41 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired sessions in batches of SESSION_CLEANUP_BATCH_SIZE "
+        "sessions, so cleanup doesn't lock session table for long."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.SESSION_CLEANUP_BATCH_SIZE,
+            help="Number of sessions deleted by one query."
+        )
+
+    def handle(self, *args, **options):
+        engine = import_module(settings.SESSION_ENGINE)
+        if not hasattr(engine.SessionStore, 'get_model_class'):
+            # sessions not stored in DB expire on their own
+            engine.SessionStore.clear_expired()
+            return
+
+        sessions = engine.SessionStore.get_model_class().objects
+        now = timezone.now()
+        count = 0
+        while True:
+            keys = list(
+                sessions.filter(expire_date__lt=now).values_list(
+                    'session_key', flat=True
+                )[:options['batch_size']]
+            )
+            if not keys:
+                break
+            count += sessions.filter(session_key__in=keys).delete()[0]
+
+        self.stdout.write("Deleted %d expired sessions" % count)
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from comments.votes import flush_votes
+
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Saves anonymous votes buffered in cache to liked_by_count and "
+        "disliked_by_count counters of comments and threads. Keeps flushing "
+        "votes every VOTE_BUFFER_FLUSH_INTERVAL seconds unless --once is "
+        "given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit after flushing buffered votes once."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = flush_votes()
+            if options['once']:
+                break
+            time.sleep(settings.VOTE_BUFFER_FLUSH_INTERVAL)
+
+        self.stdout.write("Flushed votes of %d comments and threads" % count)
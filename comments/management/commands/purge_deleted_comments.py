@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from comments.models import Comment
+
+
+class Command(BaseCommand):
+    help = (
+        "Removes soft deleted comments (see COMMENTS_SOFT_DELETE) from DB in "
+        "chunks of DELETION_CHUNK_SIZE comments."
+    )
+
+    def handle(self, *args, **options):
+        count = Comment.objects.purge_deleted()
+
+        self.stdout.write("Purged %d deleted comments" % count)
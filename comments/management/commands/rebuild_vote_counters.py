@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from comments.models import Comment, Thread
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds liked_users_count and disliked_users_count counters of "
+        "comments and threads from liked_by/disliked_by relations."
+    )
+
+    def handle(self, *args, **options):
+        for model in (Comment, Thread):
+            with transaction.atomic():
+                self.rebuild(model, 'liked_by', 'liked_users_count')
+                self.rebuild(model, 'disliked_by', 'disliked_users_count')
+
+            self.stdout.write(
+                "Rebuilt vote counters for %s" %
+                model._meta.verbose_name_plural
+            )
+
+    def rebuild(self, model, relation, counter):
+        field = model._meta.get_field(relation)
+        through = field.remote_field.through
+        source_name = field.m2m_field_name()
+
+        votes = through.objects.filter(
+            **{source_name: OuterRef('pk')}
+        ).order_by().values(source_name).annotate(
+            count=Count('pk')
+        ).values('count')
+
+        model.objects.update(**{
+            counter: Coalesce(
+                Subquery(votes, output_field=IntegerField()), 0
+            )
+        })
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from comments.spellcheck import get_metrics
+from comments.utils.cache import is_cache_shared
+
+
+class Command(BaseCommand):
+    help = (
+        "Shows metrics of spellcheck pools of all processes: queue depth, "
+        "number of finished, timed out, rejected and failed tasks and mean "
+        "latency. Metrics are counted in the default cache, so it has to be "
+        "shared by all processes."
+    )
+
+    def handle(self, *args, **options):
+        if not is_cache_shared():
+            raise CommandError(
+                "Spellcheck metrics are counted in the default cache of "
+                "each process, configure cache shared by all processes "
+                "(e.g. memcached) to see them.")
+
+        metrics = get_metrics()
+
+        self.stdout.write("Queued tasks: %d" % metrics['queued'])
+        self.stdout.write("Finished tasks: %d" % metrics['tasks'])
+        self.stdout.write("Timed out tasks: %d" % metrics['timeouts'])
+        self.stdout.write("Rejected tasks: %d" % metrics['rejected'])
+        self.stdout.write("Failed tasks: %d" % metrics['failures'])
+        self.stdout.write("Mean latency: %d ms" % metrics['mean_latency'])
@@ -0,0 +1,127 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.exceptions import SuspiciousOperation
+from django.utils.cache import patch_vary_headers
+from django.utils.http import cookie_date
+
+
+class AnonymousSessionMiddleware(SessionMiddleware):
+    """
+    Session middleware which keeps sessions of anonymous users in
+    ANONYMOUS_SESSION_ENGINE (signed cookies or cache) under
+    ANONYMOUS_SESSION_COOKIE_NAME cookie and sessions of logged in users in
+    SESSION_ENGINE. Sessions are moved between engines when users log in or
+    out, so anonymous widget traffic doesn't write sessions to DB.
+    """
+
+    def __init__(self, get_response=None):
+        super(AnonymousSessionMiddleware, self).__init__(get_response)
+        engine = import_module(settings.ANONYMOUS_SESSION_ENGINE)
+        self.AnonymousSessionStore = engine.SessionStore
+
+    def process_request(self, request):
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        request.anonymous_session = not session_key
+        if request.anonymous_session:
+            request.session = self.AnonymousSessionStore(
+                request.COOKIES.get(settings.ANONYMOUS_SESSION_COOKIE_NAME))
+        else:
+            request.session = self.SessionStore(session_key)
+
+    def get_cookie_name(self, anonymous):
+        if anonymous:
+            return settings.ANONYMOUS_SESSION_COOKIE_NAME
+        return settings.SESSION_COOKIE_NAME
+
+    def delete_cookie(self, request, response, anonymous):
+        cookie_name = self.get_cookie_name(anonymous)
+        if cookie_name in request.COOKIES:
+            response.delete_cookie(
+                cookie_name,
+                path=settings.SESSION_COOKIE_PATH,
+                domain=settings.SESSION_COOKIE_DOMAIN,
+            )
+
+    def move_session(self, request, response):
+        """
+        Moves session data to the other engine and deletes the old session
+        and its cookie.
+        """
+        old_session = request.session
+        if request.anonymous_session:
+            session = self.SessionStore()
+        else:
+            session = self.AnonymousSessionStore()
+        session.update(old_session.items())
+        old_session.delete()
+        self.delete_cookie(request, response, request.anonymous_session)
+
+        request.session = session
+        request.anonymous_session = not request.anonymous_session
+
+    def save_session(self, request, response):
+        """
+        Saves session and sets its cookie (unless the response is an error).
+        """
+        if request.session.get_expire_at_browser_close():
+            max_age = None
+            expires = None
+        else:
+            max_age = request.session.get_expiry_age()
+            expires = cookie_date(time.time() + max_age)
+        # skip session save for 500 responses, refs Django #3881
+        if response.status_code == 500:
+            return
+        try:
+            request.session.save()
+        except UpdateError:
+            raise SuspiciousOperation(
+                "The request's session was deleted before the "
+                "request completed. The user may have logged "
+                "out in a concurrent request, for example."
+            )
+        response.set_cookie(
+            self.get_cookie_name(request.anonymous_session),
+            request.session.session_key, max_age=max_age,
+            expires=expires, domain=settings.SESSION_COOKIE_DOMAIN,
+            path=settings.SESSION_COOKIE_PATH,
+            secure=settings.SESSION_COOKIE_SECURE or None,
+            httponly=settings.SESSION_COOKIE_HTTPONLY or None,
+        )
+
+    def process_response(self, request, response):
+        """
+        Same as SessionMiddleware.process_response, except that the session
+        is first moved to the engine matching user's login state and its
+        cookie name depends on the engine.
+        """
+        try:
+            accessed = request.session.accessed
+            modified = request.session.modified
+        except AttributeError:
+            return response
+
+        if accessed or modified:
+            logged_in = SESSION_KEY in request.session
+            if logged_in == request.anonymous_session:
+                self.move_session(request, response)
+                modified = True
+
+        cookie_name = self.get_cookie_name(request.anonymous_session)
+        empty = request.session.is_empty()
+
+        if cookie_name in request.COOKIES and empty:
+            self.delete_cookie(request, response, request.anonymous_session)
+            return response
+
+        if accessed:
+            patch_vary_headers(response, ('Cookie',))
+        if (modified or settings.SESSION_SAVE_EVERY_REQUEST) and not empty:
+            self.save_session(request, response)
+
+        return response
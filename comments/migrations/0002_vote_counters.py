@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_vote_counters(apps, schema_editor):
+    for model_name in ('Comment', 'Thread'):
+        model = apps.get_model('c4all_comments', model_name)
+        for relation, counter in (('liked_by', 'liked_users_count'),
+                                  ('disliked_by', 'disliked_users_count')):
+            field = model._meta.get_field(relation)
+            source_name = field.m2m_field_name()
+            votes = field.remote_field.through.objects.filter(
+                **{source_name: OuterRef('pk')}
+            ).order_by().values(source_name).annotate(
+                count=Count('pk')
+            ).values('count')
+            model.objects.update(**{
+                counter: Coalesce(
+                    Subquery(votes, output_field=IntegerField()), 0
+                )
+            })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('c4all_comments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='disliked_users_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='liked_users_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='disliked_users_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='liked_users_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(
+            populate_vote_counters, migrations.RunPython.noop
+        ),
+    ]
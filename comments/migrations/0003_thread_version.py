@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('c4all_comments', '0002_vote_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('c4all_comments', '0003_thread_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
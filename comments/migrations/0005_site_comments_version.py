@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('c4all_comments', '0004_thread_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='site',
+            name='comments_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('c4all_comments', '0005_site_comments_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='updated',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='comments_deleted',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together=set([('thread', 'updated')]),
+        ),
+    ]
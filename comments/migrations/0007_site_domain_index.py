@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('c4all_comments', '0006_comment_changes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='site',
+            name='domain',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
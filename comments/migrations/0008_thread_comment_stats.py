@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, DateTimeField, IntegerField, Max
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_comment_stats(apps, schema_editor):
+    Thread = apps.get_model('c4all_comments', 'Thread')
+    Comment = apps.get_model('c4all_comments', 'Comment')
+    comments = Comment.objects.filter(
+        thread=OuterRef('pk')
+    ).order_by().values('thread')
+
+    def count(comments):
+        return Coalesce(Subquery(
+            comments.annotate(count=Count('pk')).values('count'),
+            output_field=IntegerField()
+        ), 0)
+
+    Thread.objects.update(
+        comment_count=count(comments),
+        hidden_count=count(comments.filter(hidden=True)),
+        last_comment_at=Subquery(
+            comments.annotate(last=Max('created')).values('last'),
+            output_field=DateTimeField()
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('c4all_comments', '0007_site_domain_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='hidden_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_comment_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            populate_comment_stats, migrations.RunPython.noop
+        ),
+        # admin threads list is ordered by the last comment (threads without
+        # comments last)
+        migrations.RunSQL(
+            'CREATE INDEX c4all_comments_thread_last_comment_at '
+            'ON c4all_comments_thread '
+            '(site_id, last_comment_at DESC NULLS LAST, id DESC)',
+            'DROP INDEX c4all_comments_thread_last_comment_at'
+        ),
+    ]
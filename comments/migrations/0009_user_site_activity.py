@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 16:04
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Exists, Max, Min, OuterRef
+import django.db.models.deletion
+
+
+def populate_user_site_activity(apps, schema_editor):
+    UserSiteActivity = apps.get_model('c4all_comments', 'UserSiteActivity')
+    Comment = apps.get_model('c4all_comments', 'Comment')
+    CustomUser = apps.get_model('c4all_comments', 'CustomUser')
+    Hidden = CustomUser._meta.get_field('hidden').remote_field.through
+
+    stats = Comment.objects.filter(user__isnull=False).order_by().values(
+        'user', 'thread__site'
+    ).annotate(
+        count=Count('pk'), first=Min('created'), last=Max('created'))
+
+    UserSiteActivity.objects.bulk_create((
+        UserSiteActivity(
+            user_id=row['user'],
+            site_id=row['thread__site'],
+            comment_count=row['count'],
+            first_comment_at=row['first'],
+            last_comment_at=row['last'],
+        ) for row in stats.iterator()
+    ), batch_size=1000)
+
+    UserSiteActivity.objects.update(hidden=Exists(Hidden.objects.filter(
+        customuser=OuterRef('user'), site=OuterRef('site'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('c4all_comments', '0008_thread_comment_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSiteActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_comment_at', models.DateTimeField(editable=False, null=True)),
+                ('last_comment_at', models.DateTimeField(editable=False, null=True)),
+                ('comment_count', models.IntegerField(default=0, editable=False)),
+                ('hidden', models.BooleanField(default=False, editable=False)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_activity', to='c4all_comments.Site')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='site_activity', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='usersiteactivity',
+            unique_together=set([('user', 'site')]),
+        ),
+        migrations.RunPython(
+            populate_user_site_activity, migrations.RunPython.noop
+        ),
+        # admin users list is ordered by the last comment, optionally
+        # filtered by hidden flag
+        migrations.RunSQL(
+            'CREATE INDEX c4all_comments_usersiteactivity_last_comment_at '
+            'ON c4all_comments_usersiteactivity '
+            '(site_id, last_comment_at DESC NULLS LAST, id DESC)',
+            'DROP INDEX c4all_comments_usersiteactivity_last_comment_at'
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX c4all_comments_usersiteactivity_hidden '
+            'ON c4all_comments_usersiteactivity '
+            '(site_id, hidden, last_comment_at DESC NULLS LAST, id DESC)',
+            'DROP INDEX c4all_comments_usersiteactivity_hidden'
+        ),
+    ]
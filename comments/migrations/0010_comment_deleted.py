@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 16:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('c4all_comments', '0009_user_site_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='deleted',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        # soft deleted comments are found by purge_deleted_comments command
+        migrations.RunSQL(
+            'CREATE INDEX c4all_comments_comment_deleted '
+            'ON c4all_comments_comment (deleted) WHERE deleted IS NOT NULL',
+            'DROP INDEX c4all_comments_comment_deleted'
+        ),
+    ]
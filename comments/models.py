@@ -1,11 +1,47 @@
-from django.db import models
-from django.db.models import Q
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models import (
+    Case, Count, Exists, F, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import (
     BaseUserManager, AbstractBaseUser, PermissionsMixin
 )
 from django.contrib.postgres.fields import JSONField
+from django.core.cache import cache
 from django.utils import timezone
 from urlparse import urljoin
+import hashlib
+import time
+
+from utils.cache import is_cache_shared
+from utils.paginator import get_paginated_data
+
+from deletion import delete_objects, iter_id_chunks
+from pubsub import publish_event
+from votes import buffer_vote, merge_buffered_votes
+
+
+def update_counter(instance, field, delta, floor=None, **values):
+    """
+    Atomically adds delta to counter field of instance in DB (using F()
+    expression, so concurrent updates are not lost) and mirrors the change
+    on the instance itself. If floor is provided, counter is not updated
+    when it would drop below it. Other field values to be saved together
+    with the counter can be passed as keyword arguments. Returns True if
+    counter was updated.
+    """
+    qs = type(instance).objects.filter(pk=instance.pk)
+    if floor is not None:
+        qs = qs.filter(**{field + '__gte': floor - delta})
+
+    updated = qs.update(**dict(values, **{field: F(field) + delta}))
+    if updated:
+        setattr(instance, field, getattr(instance, field) + delta)
+        for name, value in values.items():
+            setattr(instance, name, value)
+
+    return bool(updated)
 
 
 class CustomUserManager(BaseUserManager):
@@ -38,7 +74,114 @@ class CustomUserManager(BaseUserManager):
         return user
 
     def bulk_delete(self, users, *args, **kwargs):
-        self.filter(id__in=users, *args, **kwargs).delete()
+        """
+        Deletes users matching given filters in chunks (see
+        comments.deletion). Comments of each chunk of users are deleted
+        first (updating stats of their threads), then votes of users and
+        the users with the rest of their rows in one transaction.
+        """
+        users = self.filter(id__in=users, *args, **kwargs)
+        for ids in iter_id_chunks(users):
+            Comment.objects.bulk_delete(
+                Comment.objects.filter(user__in=ids), soft=False)
+            with transaction.atomic():
+                self.remove_votes(ids)
+                delete_objects(self.model, ids)
+
+    def remove_votes(self, users):
+        """
+        Decrements vote counters of comments and threads voted by users
+        (given as ids) by the number of their votes and bumps versions of
+        threads with voted comments. Vote rows are left for deletion of the
+        users.
+        """
+        Thread.objects.bump_version(
+            Q(comments__liked_by__in=users) |
+            Q(comments__disliked_by__in=users))
+
+        for model, relation, counter in VOTE_COUNTER_FIELDS.values():
+            field = model._meta.get_field(relation)
+            source_name = field.m2m_field_name()
+            votes = field.remote_field.through.objects.filter(**{
+                source_name: OuterRef('pk'),
+                field.m2m_reverse_field_name() + '__in': users,
+            }).order_by().values(source_name).annotate(
+                count=Count('pk')).values('count')
+            model.objects.filter(**{relation + '__in': users}).update(
+                **dict(get_counter_update_values(model), **{
+                    counter: F(counter) - Subquery(
+                        votes, output_field=models.IntegerField())
+                }))
+
+    def bulk_set_hidden(self, users, sites, hidden):
+        """
+        Hides (or with hidden set to False reveals) users on sites (given as
+        ids or querysets) with a single insert into (or delete from)
+        CustomUser.hidden through table. Staff users are never hidden.
+        Comments of changed users on changed sites are marked as updated,
+        versions of their threads are bumped and cached hidden sites of
+        changed users are invalidated at once. Returns list of changed
+        (user id, site id) pairs.
+        """
+        users = self.filter(id__in=users)
+        if hidden:
+            users = users.filter(is_staff=False)
+        sites = Site.objects.filter(id__in=sites)
+        users_sql, users_params = users.order_by().values(
+            'id').query.sql_with_params()
+        sites_sql, sites_params = sites.order_by().values(
+            'id').query.sql_with_params()
+
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        field = self.model._meta.get_field('hidden')
+        names = {
+            'table': quote_name(field.remote_field.through._meta.db_table),
+            'user': quote_name(field.m2m_column_name()),
+            'site': quote_name(field.m2m_reverse_name()),
+            'users': users_sql,
+            'sites': sites_sql,
+        }
+        if hidden:
+            sql = (
+                'INSERT INTO {table} ({user}, {site}) '
+                'SELECT u.id, s.id FROM ({users}) u CROSS JOIN ({sites}) s '
+                'ON CONFLICT DO NOTHING RETURNING {user}, {site}'
+            )
+        else:
+            sql = (
+                'DELETE FROM {table} WHERE {user} IN ({users}) '
+                'AND {site} IN ({sites}) RETURNING {user}, {site}'
+            )
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql.format(**names), users_params + sites_params)
+            changed = cursor.fetchall()
+
+        if not changed:
+            return changed
+
+        user_ids = set(user_id for user_id, site_id in changed)
+        site_ids = set(site_id for user_id, site_id in changed)
+        Comment.objects.filter(
+            user__in=user_ids, thread__site__in=site_ids
+        ).update(updated=timezone.now())
+        Thread.objects.bump_version(
+            site__in=site_ids, comments__user__in=user_ids)
+        # the operation covers all pairs of given users and sites, so pairs
+        # of changed users and sites which didn't change already had the
+        # same state
+        UserSiteActivity.objects.filter(
+            user__in=user_ids, site__in=site_ids).update(hidden=hidden)
+        cache.delete_many(
+            [get_hidden_sites_cache_key(id) for id in user_ids])
+
+        return changed
+
+
+def get_hidden_sites_cache_key(user_id):
+    return 'user_hidden_sites:%s' % user_id
 
 
 class CustomUser(AbstractBaseUser, PermissionsMixin):
@@ -75,31 +218,6 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def get_avatar(self):
         return '%02d.png' % self.avatar_num
 
-    def get_user_domain_data(self):
-        liked_threads = list(
-            self.liked_threads.all().values_list('id', flat=True)
-        )
-        disliked_threads = list(
-            self.disliked_threads.all().values_list('id', flat=True)
-        )
-        posted_comments = list(
-            Comment.objects.filter(user=self).values_list('id', flat=True)
-        )
-        liked_comments = list(
-            self.liked_comments.all().values_list('id', flat=True)
-        )
-        disliked_comments = list(
-            self.disliked_comments.all().values_list('id', flat=True)
-        )
-
-        return {
-            'liked_threads': liked_threads,
-            'disliked_threads': disliked_threads,
-            'posted_comments': posted_comments,
-            'liked_comments': liked_comments,
-            'disliked_comments': disliked_comments
-        }
-
     def is_site_admin(self, domain_name):
         if self.is_superuser:
             return True
@@ -133,12 +251,35 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def get_users(self, user_id=None):
         q = Q(is_staff=False)
         if not self.is_superuser:
-            q = q & Q(comments__thread__site__in=self.get_sites())
+            q = q & Q(id__in=UserSiteActivity.objects.filter(
+                site__in=self.get_sites()).values('user'))
         if user_id:
             q = q & Q(id=user_id)
-        users = CustomUser.objects.filter(q).distinct()
+        users = CustomUser.objects.filter(q)
         return users
 
+    def is_hidden_on(self, site_id, cached=True):
+        """
+        Returns True if user is hidden on site with given id. Ids of sites on
+        which user is hidden are cached on the instance (so they are loaded at
+        most once per request) and in shared cache until they change (see
+        signals.invalidate_hidden_sites). Cache of other processes isn't
+        invalidated if it isn't shared, so permission checks of writes pass
+        cached=False to check DB directly.
+        """
+        if not cached:
+            return self.hidden.filter(id=site_id).exists()
+
+        if getattr(self, '_hidden_site_ids', None) is None:
+            key = get_hidden_sites_cache_key(self.id)
+            site_ids = cache.get(key)
+            if site_ids is None:
+                site_ids = list(self.hidden.values_list('id', flat=True))
+                cache.set(key, site_ids, settings.USER_HIDDEN_CACHE_TIMEOUT)
+            self._hidden_site_ids = set(site_ids)
+
+        return site_id in self._hidden_site_ids
+
     def hide(self, site):
         """
         Sets hidden flag to True. Only non staff users can be hidden using
@@ -147,16 +288,16 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         """
         if self.is_staff:
             return
-        self.hidden.add(site)
-        self.save()
+        CustomUser.objects.bulk_set_hidden([self.id], [site.id], True)
+        self._hidden_site_ids = None
 
     def unhide(self, site):
         """
         Sets hidden flag to False. Unhiding user enables login and posting
         comments.
         """
-        self.hidden.remove(site)
-        self.save()
+        CustomUser.objects.bulk_set_hidden([self.id], [site.id], False)
+        self._hidden_site_ids = None
 
     def delete(self):
         """
@@ -164,11 +305,102 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         """
         if self.is_staff:
             return
-        super(CustomUser, self).delete()
+        CustomUser.objects.bulk_delete([self.id])
+
+
+# fields of sites resolved by domain, see SiteManager.get_for_domain
+SITE_CACHED_FIELDS = ('id', 'domain', 'anonymous_allowed', 'rs_customer_id')
+
+# process-local cache of sites resolved by domain, maps domains to
+# (expiration time, values of SITE_CACHED_FIELDS)
+local_sites = {}
+
+
+def get_site_cache_timeout():
+    """
+    Returns timeout of sites in the default cache. If the cache isn't shared
+    by processes, it's capped to SITE_LOCAL_CACHE_TIMEOUT, because changes
+    of sites can't be invalidated in other processes.
+    """
+    if is_cache_shared():
+        return settings.SITE_CACHE_TIMEOUT
+    return min(settings.SITE_CACHE_TIMEOUT, settings.SITE_LOCAL_CACHE_TIMEOUT)
+
+
+def get_site_cache_key(domain):
+    return 'site:%s' % hashlib.md5(domain.encode('utf-8')).hexdigest()
+
+
+class SiteManager(models.Manager):
+
+    def get_for_domain(self, domain):
+        """
+        Returns site with given domain or raises Site.DoesNotExist. Sites
+        are cached in process memory for SITE_LOCAL_CACHE_TIMEOUT seconds and
+        in shared cache until they are changed (unknown domains are cached
+        too). Only SITE_CACHED_FIELDS are loaded, other fields are loaded
+        from DB when accessed.
+        """
+        if not domain:
+            raise self.model.DoesNotExist('domain not provided')
+
+        now = time.time()
+        expires, values = local_sites.get(domain, (0, None))
+
+        if expires < now:
+            key = get_site_cache_key(domain)
+            values = cache.get(key)
+            if values is None:
+                values = self.filter(domain=domain).values_list(
+                    *SITE_CACHED_FIELDS).first() or ()
+                cache.set(key, values, get_site_cache_timeout())
+            if values:
+                local_sites[domain] = (
+                    now + settings.SITE_LOCAL_CACHE_TIMEOUT, values)
+
+        if not values:
+            raise self.model.DoesNotExist(
+                'site with domain %s does not exist' % domain)
+
+        return self.model.from_db(self.db, SITE_CACHED_FIELDS, values)
+
+    def clear_cached(self, *domains):
+        """
+        Removes sites with given domains from cache of this process and
+        shared cache. Caches of other processes expire in
+        SITE_LOCAL_CACHE_TIMEOUT seconds (see get_site_cache_timeout).
+        """
+        domains = [domain for domain in domains if domain]
+        for domain in domains:
+            local_sites.pop(domain, None)
+        cache.delete_many([get_site_cache_key(domain) for domain in domains])
+
+    def bump_comments_version(self, *args, **kwargs):
+        """
+        Increments comments version of sites matching given filters. Site
+        comments version is a part of comment counts cache key, so it has to
+        be bumped whenever visible comments of site are added or removed.
+        """
+        self.filter(*args, **kwargs).update(
+            comments_version=F('comments_version') + 1)
+
+    def bulk_delete(self, sites, *args, **kwargs):
+        """
+        Deletes sites matching given filters with their threads in chunks
+        (see comments.deletion) and removes them from cache.
+        """
+        sites = self.filter(id__in=sites, *args, **kwargs)
+        for ids in iter_id_chunks(sites):
+            domains = list(
+                self.filter(id__in=ids).values_list('domain', flat=True))
+            Thread.objects.bulk_delete(Thread.objects.filter(site__in=ids))
+            with transaction.atomic():
+                delete_objects(self.model, ids)
+            self.clear_cached(*domains)
 
 
 class Site(models.Model):
-    domain = models.CharField(null=False, max_length=255)
+    domain = models.CharField(null=False, max_length=255, db_index=True)
     admins = models.ManyToManyField(
         CustomUser, blank=True, limit_choices_to={
             'is_superuser': False,
@@ -176,10 +408,166 @@ class Site(models.Model):
         })
     anonymous_allowed = models.BooleanField(default=False)
     rs_customer_id = models.CharField(max_length=255, null=True, blank=True)
+    comments_version = models.IntegerField(default=0, editable=False)
+
+    objects = SiteManager()
 
     def __unicode__(self):
         return self.domain
 
+    def delete(self):
+        """
+        Deletes site with its threads in chunks, see SiteManager.bulk_delete.
+        """
+        Site.objects.bulk_delete([self.id])
+
+
+class ThreadManager(models.Manager):
+
+    def bump_version(self, *args, **kwargs):
+        """
+        Increments version of threads matching given filters and sets their
+        modification time. Thread version is a part of rendered comments
+        cache key (and HTTP validators), so it has to be bumped (after the
+        change is made) whenever thread comments change.
+        """
+        self.filter(*args, **kwargs).update(
+            version=F('version') + 1, modified=timezone.now())
+
+    def mark_comments_deleted(self, *args, **kwargs):
+        """
+        Same as bump_version, but also records that thread comments were
+        deleted. Deletions can't be described by changed comments, so clients
+        following thread changes (see CommentManager.changed_since) have to
+        reload thread comments.
+        """
+        now = timezone.now()
+        self.filter(*args, **kwargs).update(
+            version=F('version') + 1, modified=now, comments_deleted=now,
+            **self.get_comment_stats())
+
+    def bulk_delete(self, threads, *args, **kwargs):
+        """
+        Deletes threads matching given filters in chunks (see
+        comments.deletion). Comments of each chunk of threads are deleted
+        in chunks first, so transactions stay short.
+        """
+        threads = self.filter(id__in=threads, *args, **kwargs)
+        for ids in iter_id_chunks(threads):
+            Comment.objects.bulk_delete(
+                Comment.objects.filter(thread__in=ids), soft=False)
+            with transaction.atomic():
+                delete_objects(self.model, ids)
+
+    def update_comment_stats(self, *args, **kwargs):
+        """
+        Same as bump_version, but also recomputes comment stats of threads
+        (comment_count, hidden_count and last_comment_at) from their
+        comments.
+        """
+        self.filter(*args, **kwargs).update(
+            version=F('version') + 1, modified=timezone.now(),
+            **self.get_comment_stats())
+
+    def add_comment(self, comment):
+        """
+        Same as bump_version for thread of a new comment, but also adds the
+        comment to thread comment stats (and bumps comments version of the
+        site if the comment is visible).
+        """
+        created = Value(comment.created, output_field=models.DateTimeField())
+        self.filter(id=comment.thread_id).update(
+            version=F('version') + 1,
+            modified=timezone.now(),
+            comment_count=F('comment_count') + 1,
+            hidden_count=F('hidden_count') + int(comment.hidden),
+            # Postgres GREATEST ignores NULL
+            last_comment_at=Greatest('last_comment_at', created),
+        )
+        if not comment.hidden:
+            Site.objects.bump_comments_version(id=comment.thread.site_id)
+
+    def get_comment_stats(self):
+        """
+        Returns subquery expressions computing comment stats fields of
+        threads from their comments, to be used in updates.
+        """
+        comments = Comment.objects.filter(
+            thread=OuterRef('pk')
+        ).order_by().values('thread')
+
+        def count(comments):
+            return Coalesce(Subquery(
+                comments.annotate(count=Count('pk')).values('count'),
+                output_field=models.IntegerField()
+            ), 0)
+
+        return {
+            'comment_count': count(comments),
+            'hidden_count': count(comments.filter(hidden=True)),
+            'last_comment_at': Subquery(
+                comments.annotate(last=Max('created')).values('last'),
+                output_field=models.DateTimeField()
+            ),
+        }
+
+    def get_or_create_for_url(self, site, url, titles):
+        """
+        Returns thread with given url on site (with deferred titles) and
+        flag telling if it was created with given titles. New thread is
+        inserted with INSERT ... ON CONFLICT DO NOTHING, so concurrent first
+        views of a page neither fail on unique (site, url) constraint nor
+        abort the transaction. Raises Site.DoesNotExist (and removes the site
+        from cache) if site was deleted meanwhile.
+        """
+        threads = self.defer('titles').filter(site=site, url=url)
+        try:
+            return threads.get(), False
+        except self.model.DoesNotExist:
+            pass
+
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        opts = self.model._meta
+        thread = self.model(site=site, url=url, titles=titles)
+        fields = [f for f in opts.local_concrete_fields if not f.primary_key]
+
+        site_opts = Site._meta
+        with connection.cursor() as cursor:
+            # thread isn't inserted if its site was deleted (while it's still
+            # cached)
+            cursor.execute(
+                'INSERT INTO %s (%s) SELECT %s '
+                'WHERE EXISTS (SELECT 1 FROM %s WHERE %s = %%s) '
+                'ON CONFLICT (%s, %s) DO NOTHING RETURNING %s' % (
+                    quote_name(opts.db_table),
+                    ', '.join(quote_name(f.column) for f in fields),
+                    ', '.join(['%s'] * len(fields)),
+                    quote_name(site_opts.db_table),
+                    quote_name(site_opts.pk.column),
+                    quote_name(opts.get_field('site').column),
+                    quote_name(opts.get_field('url').column),
+                    quote_name(opts.pk.column),
+                ),
+                [f.get_db_prep_save(f.pre_save(thread, True), connection)
+                 for f in fields] + [site.pk]
+            )
+            row = cursor.fetchone()
+
+        if row is None:
+            # thread was created by concurrent request or site doesn't exist
+            try:
+                return threads.get(), False
+            except self.model.DoesNotExist:
+                Site.objects.clear_cached(site.domain)
+                raise Site.DoesNotExist(
+                    'site with domain %s does not exist' % site.domain)
+
+        thread.pk = row[0]
+        thread._state.adding = False
+        thread._state.db = self.db
+        return thread, True
+
 
 class Thread(models.Model):
     class Meta:
@@ -191,6 +579,9 @@ class Thread(models.Model):
     allow_comments = models.BooleanField(default=True)
     liked_by_count = models.IntegerField(default=0)
     disliked_by_count = models.IntegerField(default=0)
+    # number of liked_by/disliked_by users, kept in sync by signals
+    liked_users_count = models.IntegerField(default=0)
+    disliked_users_count = models.IntegerField(default=0)
     liked_by = models.ManyToManyField(
         CustomUser,
         related_name='liked_threads',
@@ -201,65 +592,70 @@ class Thread(models.Model):
         related_name='disliked_threads',
         blank=True
     )
+    version = models.IntegerField(default=0)
+    # time of the last change of thread comments (see bump_version)
+    modified = models.DateTimeField(default=timezone.now)
+    # time of the last deletion of thread comments
+    comments_deleted = models.DateTimeField(null=True, editable=False)
+    # stats of thread comments shown in admin, kept in sync by comment
+    # changes (see ThreadManager.add_comment and update_comment_stats)
+    comment_count = models.IntegerField(default=0, editable=False)
+    hidden_count = models.IntegerField(default=0, editable=False)
+    last_comment_at = models.DateTimeField(null=True, editable=False)
     titles = JSONField(default={
         'selector_title': "",
         'page_title': "",
         'h1_title': ""
     })
 
+    objects = ThreadManager()
+
+    def delete(self):
+        """
+        Deletes thread with its comments in chunks, see
+        ThreadManager.bulk_delete.
+        """
+        Thread.objects.bulk_delete([self.id])
+
     def like(self, user):
         if user.is_anonymous():
-            self.liked_by_count += 1
+            if not buffer_vote(self, 'liked_by_count', 1):
+                update_counter(self, 'liked_by_count', 1)
         else:
             self.liked_by.add(user)
 
-        self.save()
-
     def undo_like(self, user):
         if self.likes_count < 1:
             return
         if user.is_anonymous():
-            self.liked_by_count -= 1
+            if not buffer_vote(self, 'liked_by_count', -1):
+                update_counter(self, 'liked_by_count', -1, floor=0)
         else:
             self.liked_by.remove(user)
 
-        self.save()
-
     def dislike(self, user):
         if user.is_anonymous():
-            self.disliked_by_count += 1
+            if not buffer_vote(self, 'disliked_by_count', 1):
+                update_counter(self, 'disliked_by_count', 1)
         else:
             self.disliked_by.add(user)
 
-        self.save()
-
     def undo_dislike(self, user):
         if self.dislikes_count < 1:
             return
         if user.is_anonymous():
-            self.disliked_by_count -= 1
+            if not buffer_vote(self, 'disliked_by_count', -1):
+                update_counter(self, 'disliked_by_count', -1, floor=0)
         else:
             self.disliked_by.remove(user)
 
-        self.save()
-
     @property
     def likes_count(self):
-        count = self.liked_by_count
-
-        if self.liked_by:
-            count += self.liked_by.count()
-
-        return count
+        return self.liked_by_count + self.liked_users_count
 
     @property
     def dislikes_count(self):
-        count = self.disliked_by_count
-
-        if self.disliked_by:
-            count += self.disliked_by.count()
-
-        return count
+        return self.disliked_by_count + self.disliked_users_count
 
     @property
     def title(self):
@@ -279,13 +675,166 @@ class Thread(models.Model):
 
 class CommentManager(models.Manager):
 
+    def get_queryset(self):
+        # soft deleted comments are left only for purge_deleted
+        return super(CommentManager, self).get_queryset().filter(
+            deleted__isnull=True)
+
     def bulk_delete(self, comments, *args, **kwargs):
-        self.filter(id__in=comments, *args, **kwargs).delete()
+        """
+        Deletes comments matching given filters in chunks (see
+        comments.deletion), each in its own transaction together with
+        updates of thread, site and user activity stats. If soft is set
+        (COMMENTS_SOFT_DELETE by default), comments are only marked as
+        deleted, which hides them at once, and removed by purge_deleted.
+        """
+        soft = kwargs.pop('soft', None)
+        if soft is None:
+            soft = settings.COMMENTS_SOFT_DELETE
+
+        comments = self.filter(id__in=comments, *args, **kwargs)
+        for ids in iter_id_chunks(comments):
+            with transaction.atomic():
+                self.delete_chunk(ids, soft)
+
+    def delete_chunk(self, ids, soft):
+        comments = self.filter(id__in=ids)
+        deleted = list(comments.order_by().values_list(
+            'thread_id', 'user_id').distinct())
+        if soft:
+            comments.update(deleted=timezone.now())
+        else:
+            delete_objects(self.model, ids)
+
+        thread_ids = set(thread_id for thread_id, user_id in deleted)
+        user_ids = set(user_id for thread_id, user_id in deleted if user_id)
+        Thread.objects.mark_comments_deleted(id__in=thread_ids)
+        Site.objects.bump_comments_version(threads__id__in=thread_ids)
+        if user_ids:
+            UserSiteActivity.objects.update_comment_stats(
+                user__in=user_ids, site__threads__id__in=thread_ids)
+
+    def purge_deleted(self):
+        """
+        Removes soft deleted comments from DB in chunks, returns number of
+        removed comments.
+        """
+        count = 0
+        comments = self.model._base_manager.filter(deleted__isnull=False)
+        for ids in iter_id_chunks(comments):
+            with transaction.atomic():
+                count += delete_objects(self.model, ids)
+        return count
+
+    def bulk_set_hidden(self, comments, hidden):
+        comments = self.filter(id__in=comments)
+        changed = list(comments.values_list('id', 'thread_id'))
+        thread_ids = [thread_id for id, thread_id in changed]
+        comments.update(hidden=hidden, updated=timezone.now())
+        Thread.objects.update_comment_stats(id__in=thread_ids)
+        Site.objects.bump_comments_version(threads__id__in=thread_ids)
+
+        for id, thread_id in changed:
+            publish_event(thread_id, 'state', {'id': id, 'hidden': hidden})
+
+    def visible_counts(self, site, thread_urls):
+        """
+        Returns dict mapping urls of site threads to numbers of their visible
+        (not hidden) comments using a single grouped query. Threads without
+        visible comments are left out.
+        """
+        counts = self.filter(
+            thread__site=site,
+            thread__url__in=thread_urls,
+            hidden=False
+        ).order_by().values_list('thread__url').annotate(count=Count('id'))
+
+        return dict(counts)
+
+    def for_widget(self, thread, site, all=False, site_admin=False):
+        """
+        Returns first page of thread comments to be rendered in the widget,
+        id of the first comment of the next page (or None) and thread
+        comment counts. Comments of users hidden on site are never returned,
+        hidden comments are returned only to site admin viewing all
+        comments. Unless all is True, pages have
+        WIDGET_COMMENTS_DEFAULT_NUMBER comments.
+
+        Counts are returned as dict with 'total' and 'visible' (not hidden)
+        number of comments, both computed in a single aggregate query.
+        """
+        thread_comments = self.filter(thread=thread).exclude(
+            user__hidden__in=[site])
+
+        counts = thread_comments.aggregate(
+            total=Count('id'),
+            visible=Sum(Case(
+                When(hidden=False, then=1),
+                default=0,
+                output_field=models.IntegerField()
+            ))
+        )
+        counts['visible'] = counts['visible'] or 0
+
+        comments = thread_comments.select_related('user')
+        if not (all and site_admin):
+            comments = comments.filter(hidden=False)
+        if all:
+            comments, next = list(comments.order_by('id')), None
+        else:
+            comments, next = get_paginated_data(
+                comments, None, settings.WIDGET_COMMENTS_DEFAULT_NUMBER,
+                order='id')
+        merge_buffered_votes(comments)
+
+        return comments, next, counts
+
+    def changed_since(self, thread, site, since):
+        """
+        Returns comments of thread changed since given time split in two
+        lists: new visible comments (to be rendered) and other changed
+        comments with user_hidden attribute telling if their user is hidden
+        on site.
+        """
+        changed = self.filter(thread=thread, updated__gte=since).annotate(
+            user_hidden=Exists(CustomUser.hidden.through.objects.filter(
+                customuser=OuterRef('user'), site=site))
+        ).select_related('user').order_by('id')
+
+        changed = list(changed)
+        merge_buffered_votes(changed)
+
+        new, updated = [], []
+        for comment in changed:
+            if comment.created < since:
+                updated.append(comment)
+            elif not (comment.hidden or comment.user_hidden):
+                new.append(comment)
+
+        return new, updated
+
+    def widget_page(self, thread, site, start):
+        """
+        Returns page of visible thread comments starting with comment with
+        given id and id of the first comment of the next page (or None).
+        Pages are paginated by comment id (keyset pagination), so fetching a
+        page costs the same no matter how far in the thread it is.
+        """
+        comments = self.filter(thread=thread, hidden=False).exclude(
+            user__hidden__in=[site]).select_related('user')
+
+        comments, next = get_paginated_data(
+            comments, start, settings.WIDGET_COMMENTS_DEFAULT_NUMBER,
+            order='id')
+        merge_buffered_votes(comments)
+
+        return comments, next
 
 
 class Comment(models.Model):
     class Meta:
         ordering = ["created"]
+        index_together = (('thread', 'updated'),)
 
     user = models.ForeignKey(CustomUser, related_name='comments', null=True)
     poster_name = models.CharField(max_length=100)
@@ -294,6 +843,9 @@ class Comment(models.Model):
     created = models.DateTimeField(editable=False, default=timezone.now)
     liked_by_count = models.IntegerField(default=0)
     disliked_by_count = models.IntegerField(default=0)
+    # number of liked_by/disliked_by users, kept in sync by signals
+    liked_users_count = models.IntegerField(default=0)
+    disliked_users_count = models.IntegerField(default=0)
     liked_by = models.ManyToManyField(
         CustomUser,
         related_name='liked_comments',
@@ -308,9 +860,29 @@ class Comment(models.Model):
     avatar_num = models.IntegerField(default=6)  # green diamond
     hidden = models.BooleanField(default=False)
     ip_address = models.GenericIPAddressField(null=True)
+    # time of the last change of comment visible in the widget (votes,
+    # hidden state), see CommentManager.changed_since
+    updated = models.DateTimeField(editable=False, default=timezone.now)
+    # time of soft deletion, see CommentManager.bulk_delete
+    deleted = models.DateTimeField(null=True, editable=False)
 
     objects = CommentManager()
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        self.updated = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = (
+                set(kwargs['update_fields']) | {'updated'})
+        # thread stats and user activity are kept in sync with comments
+        with transaction.atomic():
+            super(Comment, self).save(*args, **kwargs)
+            if adding:
+                Thread.objects.add_comment(self)
+                UserSiteActivity.objects.add_comment(self)
+            else:
+                Thread.objects.bump_version(id=self.thread_id)
+
     def get_avatar(self):
         if self.user is not None:
             return "%02d" % self.user.avatar_num
@@ -319,71 +891,231 @@ class Comment(models.Model):
 
     def like(self, user):
         if user.is_anonymous():
-            self.liked_by_count += 1
+            if buffer_vote(self, 'liked_by_count', 1):
+                # buffered votes are saved and published by flush_votes
+                return
+            update_counter(self, 'liked_by_count', 1,
+                           updated=timezone.now())
         else:
             self.liked_by.add(user)
 
-        self.save()
+        Thread.objects.bump_version(id=self.thread_id)
+        self.publish_state()
 
     def undo_like(self, user):
         if self.likes_count < 1:
             return
 
         if user.is_anonymous():
-            self.liked_by_count -= 1
+            if buffer_vote(self, 'liked_by_count', -1):
+                return
+            update_counter(self, 'liked_by_count', -1, floor=0,
+                           updated=timezone.now())
         else:
             self.liked_by.remove(user)
 
-        self.save()
+        Thread.objects.bump_version(id=self.thread_id)
+        self.publish_state()
 
     def dislike(self, user):
         if user.is_anonymous():
-            self.disliked_by_count += 1
+            if buffer_vote(self, 'disliked_by_count', 1):
+                return
+            update_counter(self, 'disliked_by_count', 1,
+                           updated=timezone.now())
         else:
             self.disliked_by.add(user)
 
-        self.save()
+        Thread.objects.bump_version(id=self.thread_id)
+        self.publish_state()
 
     def undo_dislike(self, user):
         if self.dislikes_count < 1:
             return
 
         if user.is_anonymous():
-            self.disliked_by_count -= 1
+            if buffer_vote(self, 'disliked_by_count', -1):
+                return
+            update_counter(self, 'disliked_by_count', -1, floor=0,
+                           updated=timezone.now())
         else:
             self.disliked_by.remove(user)
 
-        self.save()
+        Thread.objects.bump_version(id=self.thread_id)
+        self.publish_state()
 
     @property
     def likes_count(self):
-        count = self.liked_by_count
-
-        if self.liked_by:
-            count += self.liked_by.count()
-
-        return count
+        return self.liked_by_count + self.liked_users_count
 
     @property
     def dislikes_count(self):
-        count = self.disliked_by_count
-
-        if self.disliked_by:
-            count += self.disliked_by.count()
-
-        return count
+        return self.disliked_by_count + self.disliked_users_count
 
     def hide(self):
-        self.hidden = True
-        self.save()
+        self.set_hidden(True)
 
     def unhide(self):
-        self.hidden = False
-        self.save()
+        self.set_hidden(False)
+
+    def set_hidden(self, hidden):
+        """
+        Saves hidden flag of comment. Nothing is written if it is unchanged.
+        """
+        if self.hidden == hidden:
+            return
+
+        self.hidden = hidden
+        with transaction.atomic():
+            self.save(update_fields=['hidden'])
+            Thread.objects.filter(id=self.thread_id).update(
+                hidden_count=F('hidden_count') + (1 if hidden else -1))
+            # visible comment counts of the site changed
+            Site.objects.bump_comments_version(id=self.thread.site_id)
+        self.publish_state()
+
+    def publish_state(self):
+        """
+        Publishes current vote counts and hidden state of comment to thread
+        stream subscribers.
+        """
+        publish_event(self.thread_id, 'state', {
+            'id': self.id,
+            'likes': self.likes_count,
+            'dislikes': self.dislikes_count,
+            'hidden': self.hidden,
+        })
 
     def delete(self, user):
         """
         Deletes comment if user is staff/admin or admin for site.
         """
         if user.is_staff:
-            super(Comment, self).delete()
+            Comment.objects.bulk_delete([self.id])
+
+
+class UserSiteActivityManager(models.Manager):
+
+    def add_comment(self, comment):
+        """
+        Adds new comment to activity of its user on thread site. Activity row
+        is inserted with INSERT ... ON CONFLICT DO UPDATE, so concurrent first
+        comments of user on a site don't fail on unique (user, site)
+        constraint. Comments of anonymous users are ignored.
+        """
+        if comment.user_id is None:
+            return
+
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        opts = self.model._meta
+        thread_opts = Thread._meta
+        hidden_opts = CustomUser.hidden.through._meta
+        hidden_field = CustomUser._meta.get_field('hidden')
+
+        def column(opts, name):
+            return quote_name(opts.get_field(name).column)
+
+        created = opts.get_field('last_comment_at').get_db_prep_save(
+            comment.created, connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} ({user}, {site}, {first}, {last}, '
+                '{count}, {hidden}) '
+                'SELECT %s, t.{thread_site}, %s, %s, 1, EXISTS('
+                'SELECT 1 FROM {hidden_table} h WHERE h.{hidden_user} = %s '
+                'AND h.{hidden_site} = t.{thread_site}) '
+                'FROM {thread_table} t WHERE t.{thread_id} = %s '
+                'ON CONFLICT ({user}, {site}) DO UPDATE SET '
+                '{count} = {table}.{count} + 1, '
+                # Postgres LEAST/GREATEST ignore NULL
+                '{first} = LEAST({table}.{first}, EXCLUDED.{first}), '
+                '{last} = GREATEST({table}.{last}, EXCLUDED.{last})'.format(
+                    table=quote_name(opts.db_table),
+                    user=column(opts, 'user'),
+                    site=column(opts, 'site'),
+                    first=column(opts, 'first_comment_at'),
+                    last=column(opts, 'last_comment_at'),
+                    count=column(opts, 'comment_count'),
+                    hidden=column(opts, 'hidden'),
+                    hidden_table=quote_name(hidden_opts.db_table),
+                    hidden_user=quote_name(hidden_field.m2m_column_name()),
+                    hidden_site=quote_name(
+                        hidden_field.m2m_reverse_name()),
+                    thread_table=quote_name(thread_opts.db_table),
+                    thread_site=column(thread_opts, 'site'),
+                    thread_id=quote_name(thread_opts.pk.column),
+                ),
+                [comment.user_id, created, created, comment.user_id,
+                 comment.thread_id]
+            )
+
+    def update_comment_stats(self, *args, **kwargs):
+        """
+        Recomputes comment stats (comment_count, first_comment_at and
+        last_comment_at) of activity rows matching given filters from
+        comments. Rows left without comments are deleted.
+        """
+        rows = self.filter(*args, **kwargs)
+        comments = Comment.objects.filter(
+            user=OuterRef('user'), thread__site=OuterRef('site')
+        ).order_by().values('user')
+
+        def aggregate(function, output_field):
+            return Subquery(
+                comments.annotate(value=function).values('value'),
+                output_field=output_field
+            )
+
+        rows.update(
+            comment_count=Coalesce(
+                aggregate(Count('pk'), models.IntegerField()), 0),
+            first_comment_at=aggregate(
+                Min('created'), models.DateTimeField()),
+            last_comment_at=aggregate(
+                Max('created'), models.DateTimeField()),
+        )
+        self.filter(*args, **kwargs).filter(comment_count=0).delete()
+
+
+class UserSiteActivity(models.Model):
+    """
+    Commenting activity of a user on a site, so site users can be listed,
+    sorted and counted without joining their comments. Rows exist for users
+    with comments on site, comment stats are kept in sync by comment
+    model and manager and hidden flag (mirroring CustomUser.hidden) by
+    signals.update_activity_hidden.
+    """
+    class Meta:
+        unique_together = (('user', 'site'),)
+
+    user = models.ForeignKey(CustomUser, related_name='site_activity')
+    site = models.ForeignKey(Site, related_name='user_activity')
+    first_comment_at = models.DateTimeField(null=True, editable=False)
+    last_comment_at = models.DateTimeField(null=True, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
+    hidden = models.BooleanField(default=False, editable=False)
+
+    objects = UserSiteActivityManager()
+
+
+# maps vote M2M relations to the field counting their rows
+VOTE_COUNTER_FIELDS = {
+    Comment.liked_by.through: (Comment, 'liked_by', 'liked_users_count'),
+    Comment.disliked_by.through: (
+        Comment, 'disliked_by', 'disliked_users_count'),
+    Thread.liked_by.through: (Thread, 'liked_by', 'liked_users_count'),
+    Thread.disliked_by.through: (
+        Thread, 'disliked_by', 'disliked_users_count'),
+}
+
+
+def get_counter_update_values(model):
+    """
+    Returns values of fields which have to be updated together with vote
+    counters of model.
+    """
+    if model is Comment:
+        return {'updated': timezone.now()}
+    return {}
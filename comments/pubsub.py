@@ -0,0 +1,172 @@
+"""
+Publish/subscribe layer used to push thread events (new comments, votes
+and moderation) to widgets listening on comment streams. Backend is set
+by COMMENTS_PUBSUB_BACKEND setting.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from Queue import Queue, Empty
+import json
+import select
+import threading
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+
+class Subscription(object):
+    """
+    Subscription to messages published on a channel. Messages are queued
+    until they are read with get method. Subscription has to be closed when
+    it's not used anymore.
+    """
+
+    def __init__(self, pubsub, channel):
+        self.pubsub = pubsub
+        self.channel = channel
+        self.queue = Queue()
+        pubsub.add_subscriber(channel, self.queue)
+
+    def get(self, timeout):
+        """
+        Returns next message or None if no message is published in timeout
+        seconds.
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.pubsub.remove_subscriber(self.channel, self.queue)
+
+
+class LocalPubSub(object):
+    """
+    In-process backend. Messages are delivered only to subscribers in the
+    process which published them, so it's suitable only for development and
+    single process deployments.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def add_subscriber(self, channel, queue):
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(queue)
+
+    def remove_subscriber(self, channel, queue):
+        with self.lock:
+            queues = self.subscribers.get(channel, set())
+            queues.discard(queue)
+            if not queues:
+                self.subscribers.pop(channel, None)
+
+    def deliver(self, channel, message):
+        with self.lock:
+            queues = list(self.subscribers.get(channel, ()))
+
+        for queue in queues:
+            queue.put(message)
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+    def subscribe(self, channel):
+        return Subscription(self, channel)
+
+
+class PostgresPubSub(LocalPubSub):
+    """
+    PostgreSQL LISTEN/NOTIFY backend. Messages are published with NOTIFY,
+    so they are delivered to all processes using the database. Every
+    process keeps a single listening connection, whose messages are passed
+    to local subscribers by a background thread, no matter how many streams
+    the process serves.
+    """
+    notify_channel = 'c4all_comments'
+    poll_timeout = 1
+
+    def __init__(self):
+        super(PostgresPubSub, self).__init__()
+        self.listener = None
+        self.stopped = threading.Event()
+
+    def publish(self, channel, message):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_notify(%s, %s)',
+                [self.notify_channel, json.dumps([channel, message])]
+            )
+
+    def subscribe(self, channel):
+        subscription = super(PostgresPubSub, self).subscribe(channel)
+
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.stopped.clear()
+                ready = threading.Event()
+                self.listener = threading.Thread(
+                    target=self.listen, args=(ready,))
+                self.listener.daemon = True
+                self.listener.start()
+                ready.wait(self.poll_timeout)
+
+        return subscription
+
+    def listen(self, ready):
+        conn = psycopg2.connect(**connection.get_connection_params())
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute('LISTEN %s' % self.notify_channel)
+            ready.set()
+
+            while not self.stopped.is_set():
+                if not select.select([conn], [], [], self.poll_timeout)[0]:
+                    continue
+
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    channel, message = json.loads(notify.payload)
+                    self.deliver(channel, message)
+        finally:
+            conn.close()
+
+    def close(self):
+        """
+        Stops listening thread and closes its connection.
+        """
+        self.stopped.set()
+        if self.listener is not None:
+            self.listener.join()
+
+
+_pubsub = None
+
+
+def get_pubsub():
+    global _pubsub
+
+    if _pubsub is None:
+        _pubsub = import_string(settings.COMMENTS_PUBSUB_BACKEND)()
+
+    return _pubsub
+
+
+def get_thread_channel(thread_id):
+    return 'thread:%s' % thread_id
+
+
+def publish_event(thread_id, event, data):
+    """
+    Publishes event of thread with given id when current transaction is
+    committed, so subscribers never see uncommitted changes.
+    """
+    message = {'event': event, 'data': data}
+
+    transaction.on_commit(lambda: get_pubsub().publish(
+        get_thread_channel(thread_id), message))
@@ -0,0 +1,137 @@
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.core.cache import cache
+from django.dispatch import receiver
+
+from models import (
+    VOTE_COUNTER_FIELDS, CustomUser, Site, UserSiteActivity,
+    get_counter_update_values, get_hidden_sites_cache_key
+)
+
+
+def update_vote_counters(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps liked_users_count/disliked_users_count in sync with vote M2M
+    relations. Works for changes made from both sides of the relation
+    (e.g. comment.liked_by.add(user) and user.liked_comments.add(comment)).
+    """
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+
+    model, relation, counter = VOTE_COUNTER_FIELDS[sender]
+    field = model._meta.get_field(relation)
+    source_name = field.m2m_field_name()
+    target_name = field.m2m_reverse_field_name()
+
+    if action == 'post_add':
+        # pk_set contains only newly added objects here
+        changed = pk_set
+        delta = 1
+    else:
+        # removal signals are sent before rows are deleted, so existing
+        # rows are counted to skip objects which were not related
+        if reverse:
+            rows = sender.objects.filter(**{target_name: instance.pk})
+            lookup = source_name
+        else:
+            rows = sender.objects.filter(**{source_name: instance.pk})
+            lookup = target_name
+        if action == 'pre_remove':
+            rows = rows.filter(**{lookup + '__in': pk_set})
+        changed = rows.values_list(lookup, flat=True)
+        delta = -1
+
+    if not changed:
+        return
+
+    values = get_counter_update_values(model)
+    if reverse:
+        model.objects.filter(pk__in=list(changed)).update(
+            **dict(values, **{counter: F(counter) + delta}))
+    else:
+        delta *= len(changed)
+        model.objects.filter(pk=instance.pk).update(
+            **dict(values, **{counter: F(counter) + delta}))
+        setattr(instance, counter, getattr(instance, counter) + delta)
+
+
+for through in VOTE_COUNTER_FIELDS:
+    m2m_changed.connect(
+        update_vote_counters,
+        sender=through,
+        dispatch_uid='update_vote_counters_%s' % through._meta.db_table
+    )
+
+
+@receiver(pre_delete, sender=CustomUser)
+def remove_user_votes(sender, instance, **kwargs):
+    """
+    Vote M2M rows of deleted user are removed without m2m_changed signals,
+    so counters have to be decremented here (users deleted by
+    CustomUserManager.bulk_delete don't send this signal).
+    """
+    CustomUser.objects.remove_votes([instance.pk])
+
+
+@receiver(pre_save, sender=Site)
+def remember_site_domain(sender, instance, **kwargs):
+    """
+    Site can be cached under its old domain, so the domain stored in DB is
+    remembered before site is saved.
+    """
+    instance._stored_domain = None
+    if instance.pk is not None:
+        instance._stored_domain = Site.objects.filter(
+            pk=instance.pk).values_list('domain', flat=True).first()
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def invalidate_site_cache(sender, instance, **kwargs):
+    Site.objects.clear_cached(
+        instance.domain, getattr(instance, '_stored_domain', None))
+
+
+@receiver(m2m_changed, sender=CustomUser.hidden.through)
+def invalidate_hidden_sites(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    """
+    Removes cached ids of sites on which users are hidden (see
+    CustomUser.is_hidden_on) when users are hidden or unhidden.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if reverse:
+        if pk_set is None:
+            pk_set = instance.hidden_users.values_list('id', flat=True)
+        user_ids = list(pk_set)
+    else:
+        instance._hidden_site_ids = None
+        user_ids = [instance.pk]
+
+    cache.delete_many([get_hidden_sites_cache_key(id) for id in user_ids])
+
+
+@receiver(m2m_changed, sender=CustomUser.hidden.through)
+def update_activity_hidden(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """
+    Keeps hidden flag of user site activity in sync with CustomUser.hidden
+    when users are hidden or unhidden from either side of the relation.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if reverse:
+        rows = UserSiteActivity.objects.filter(site=instance)
+        lookup = 'user__in'
+    else:
+        rows = UserSiteActivity.objects.filter(user=instance)
+        lookup = 'site__in'
+    if action != 'pre_clear':
+        rows = rows.filter(**{lookup: pk_set})
+
+    rows.update(hidden=action == 'post_add')
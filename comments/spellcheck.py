@@ -0,0 +1,315 @@
+"""
+Spell checking of comment text with enchant dictionaries. Dictionaries are
+loaded once per process and shared by threads (enchant dictionaries aren't
+thread safe, so they are used under a lock) and suggestions for misspelled
+words are kept in LRU cache of SPELLCHECK_CACHE_SIZE words.
+
+Checks requested by views are run in a pool of SPELLCHECK_POOL_SIZE
+processes with SPELLCHECK_TIMEOUT seconds timeout. Every request worker
+process starts its own pool, so there are up to number of workers times
+SPELLCHECK_POOL_SIZE spellcheck processes. Pool metrics (queue depth,
+latency, timeouts, failures) are counted in the default cache, which has to
+be shared by all processes to see metrics of all pools, see get_metrics.
+"""
+from collections import OrderedDict
+import logging
+import multiprocessing
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from votes import incr
+
+try:
+    import enchant
+    from enchant.checker import SpellChecker
+except ImportError:
+    enchant = None
+
+QUEUED_KEY = 'spellcheck:queued'
+TASKS_KEY = 'spellcheck:tasks'
+LATENCY_KEY = 'spellcheck:latency'
+TIMEOUTS_KEY = 'spellcheck:timeouts'
+REJECTED_KEY = 'spellcheck:rejected'
+FAILURES_KEY = 'spellcheck:failures'
+METRIC_KEYS = (QUEUED_KEY, TASKS_KEY, LATENCY_KEY, TIMEOUTS_KEY,
+               REJECTED_KEY, FAILURES_KEY)
+
+logger = logging.getLogger(__name__)
+
+
+def decr(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        pass
+
+
+class LRUCache(object):
+    """
+    Thread safe dict of limited size which discards the least recently used
+    items.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return default
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class Dictionary(object):
+    """
+    Enchant dictionary of a language shared by threads.
+    """
+
+    def __init__(self, language):
+        self.dictionary = enchant.Dict(language)
+        self.lock = threading.Lock()
+        self.suggestions = LRUCache(settings.SPELLCHECK_CACHE_SIZE)
+
+    def incorrect_words(self, text):
+        """
+        Returns list of incorrectly spelled words in text (in order of
+        appearance).
+        """
+        with self.lock:
+            checker = SpellChecker(self.dictionary, text)
+            return [error.word for error in checker]
+
+    def suggest(self, word):
+        """
+        Returns suggested corrections of word, or empty list if word is
+        spelled correctly.
+        """
+        suggestions = self.suggestions.get(word)
+        if suggestions is None:
+            with self.lock:
+                if self.dictionary.check(word):
+                    suggestions = []
+                else:
+                    suggestions = self.dictionary.suggest(word)
+            self.suggestions.set(word, suggestions)
+        return suggestions
+
+
+dictionaries = {}
+dictionaries_lock = threading.Lock()
+
+
+def get_dictionary(language=None):
+    """
+    Returns shared dictionary of given language (LANGUAGE_CODE by default).
+    """
+    language = language or settings.LANGUAGE_CODE
+    if language not in dictionaries:
+        with dictionaries_lock:
+            if language not in dictionaries:
+                dictionaries[language] = Dictionary(language)
+    return dictionaries[language]
+
+
+def run_task(func, args):
+    """
+    Runs task in pool process and returns (succeeded, result) tuple. Errors
+    are logged and their result is None like result of unfinished tasks, so
+    they can't break pool bookkeeping.
+    """
+    try:
+        return True, func(*args)
+    except Exception:
+        logger.exception("Spellcheck task %s failed", func.__name__)
+        return False, None
+
+
+def find_incorrect_words(language, text):
+    return get_dictionary(language).incorrect_words(text)
+
+
+def find_suggestions(language, word):
+    return get_dictionary(language).suggest(word)
+
+
+class CompletedTask(object):
+    """
+    Result of task run without pool, behaves like AsyncResult.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, timeout=None):
+        return self.value
+
+
+class SpellcheckPool(object):
+    """
+    Pool of processes running spellcheck tasks, so CPU heavy suggestion
+    generation doesn't block request workers. At most queue_size tasks of a
+    process can wait in the pool, more tasks are rejected. Without processes
+    tasks are run directly.
+    """
+
+    def __init__(self, processes, queue_size):
+        self.pool = multiprocessing.Pool(processes) if processes else None
+        self.queue_size = queue_size
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args):
+        """
+        Queues func call and returns its AsyncResult, or None if the queue
+        is full.
+        """
+        with self.lock:
+            if self.pending >= self.queue_size:
+                incr(REJECTED_KEY)
+                return None
+            self.pending += 1
+        incr(QUEUED_KEY)
+        started = time.time()
+
+        def done(result):
+            with self.lock:
+                self.pending -= 1
+            decr(QUEUED_KEY)
+            incr(TASKS_KEY)
+            incr(LATENCY_KEY, int((time.time() - started) * 1000))
+            succeeded, value = result
+            if not succeeded:
+                incr(FAILURES_KEY)
+
+        if self.pool is None:
+            result = run_task(func, args)
+            done(result)
+            return CompletedTask(result)
+
+        return self.pool.apply_async(run_task, (func, args), callback=done)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns spellcheck pool of the process, it's started on first use so it
+    isn't shared by forked request workers (each of them starts its own).
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = SpellcheckPool(
+                settings.SPELLCHECK_POOL_SIZE, settings.SPELLCHECK_QUEUE_SIZE)
+    return pool
+
+
+def get_deadline(timeout=None):
+    if timeout is None:
+        timeout = settings.SPELLCHECK_TIMEOUT
+    return time.time() + timeout
+
+
+def wait(task, deadline):
+    """
+    Returns result of task or None if it's rejected, fails or doesn't
+    finish until deadline.
+    """
+    if task is None:
+        return None
+    try:
+        succeeded, value = task.get(max(deadline - time.time(), 0))
+        return value
+    except multiprocessing.TimeoutError:
+        incr(TIMEOUTS_KEY)
+        return None
+
+
+def incorrect_words(text, timeout=None):
+    """
+    Returns list of incorrectly spelled words in text, or None if they
+    couldn't be found in timeout (SPELLCHECK_TIMEOUT seconds by default).
+    """
+    task = get_pool().submit(
+        find_incorrect_words, settings.LANGUAGE_CODE, text)
+    return wait(task, get_deadline(timeout))
+
+
+def suggest(word, timeout=None):
+    """
+    Returns suggested corrections of word, or None if they couldn't be
+    found in timeout (SPELLCHECK_TIMEOUT seconds by default).
+    """
+    task = get_pool().submit(find_suggestions, settings.LANGUAGE_CODE, word)
+    return wait(task, get_deadline(timeout))
+
+
+def check(text, timeout=None):
+    """
+    Returns list of incorrectly spelled words in text (each word once) with
+    their suggested corrections and flag which is set if the check finished
+    in timeout (SPELLCHECK_TIMEOUT seconds by default). Otherwise partial
+    results are returned, suggestions not found in time are None.
+    """
+    deadline = get_deadline(timeout)
+    words = wait(
+        get_pool().submit(find_incorrect_words, settings.LANGUAGE_CODE, text),
+        deadline
+    )
+    if words is None:
+        return [], False
+
+    words = OrderedDict.fromkeys(words).keys()
+    tasks = [
+        get_pool().submit(find_suggestions, settings.LANGUAGE_CODE, word)
+        for word in words
+    ]
+    results = [
+        {'word': word, 'suggestions': wait(task, deadline)}
+        for word, task in zip(words, tasks)
+    ]
+    complete = all(result['suggestions'] is not None for result in results)
+
+    return results, complete
+
+
+def get_metrics():
+    """
+    Returns pool metrics of all processes: number of tasks waiting in
+    pools, number of finished, rejected, timed out and failed tasks and
+    mean latency of finished tasks in milliseconds. Metrics of other
+    processes are included only if the default cache is shared.
+    """
+    values = cache.get_many(METRIC_KEYS)
+    metrics = dict(
+        (key.split(':')[1], values.get(key) or 0) for key in METRIC_KEYS)
+    latency = metrics.pop('latency')
+    metrics['mean_latency'] = latency / metrics['tasks'] \
+        if metrics['tasks'] else 0
+    return metrics
@@ -1,5 +1,4 @@
 from django import template
-from django.conf import settings
 
 import random
 
@@ -14,18 +13,6 @@ def randomize_avatar(value):
     return "%s.png" % avatar_num
 
 
-@register.filter(name='visible_comments_count')
-def visible_comments_count(value):
-    return value.filter(hidden=False).count()
-
-
-@register.filter(name='comment_number_filter')
-def comment_number_filter(value, all):
-    return value if all else value.filter(hidden=False)[:settings.WIDGET_COMMENTS_DEFAULT_NUMBER]
-
-
 @register.filter(name='hidden')
 def hidden(user, site_id):
-    if user.hidden.filter(id=site_id):
-        return True
-    return False
+    return user.is_hidden_on(site_id)
@@ -2,3 +2,12 @@ from comment import *
 from thread import *
 from site import *
 from custom_user import *
+from widget import *
+from commands import *
+from cache import *
+from pubsub import *
+from votes import *
+from user_state import *
+from session import *
+from spellcheck import *
+from deletion import *
@@ -1,11 +1,20 @@
+from django.conf import settings
 from django.test import TestCase
 
+from importlib import import_module
 import re
 import json
 
+from comments.models import local_sites
+
 
 class BaseTestCase(TestCase):
 
+    def _pre_setup(self):
+        super(BaseTestCase, self)._pre_setup()
+        # sites created by previous tests are rolled back without signals
+        local_sites.clear()
+
     def get_data_from_response(self, resp):
         result = re.search('{.*}', resp)
 
@@ -13,3 +22,17 @@ class BaseTestCase(TestCase):
             self.fail('could not get data from response')
 
         return json.loads(result.group(0))
+
+    def get_session(self):
+        """
+        Returns session of test client. Unlike client.session it includes
+        sessions of anonymous users, which are not kept in SESSION_ENGINE.
+        """
+        cookies = self.client.cookies
+        if settings.SESSION_COOKIE_NAME in cookies and \
+                cookies[settings.SESSION_COOKIE_NAME].value:
+            return self.client.session
+
+        engine = import_module(settings.ANONYMOUS_SESSION_ENGINE)
+        cookie = cookies.get(settings.ANONYMOUS_SESSION_COOKIE_NAME)
+        return engine.SessionStore(cookie.value if cookie else None)
@@ -0,0 +1,250 @@
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+
+from base import BaseTestCase
+
+import json
+
+from comments.models import Comment, CustomUser, Site, Thread
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class ThreadVersionTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.user = CustomUser.objects.create_user(
+            email='donald@duck.com',
+            password='pass'
+        )
+        self.comment = Comment.objects.create(
+            thread=self.thread, user=self.user, text='quack!')
+
+    def get_version(self):
+        return Thread.objects.get(id=self.thread.id).version
+
+    def test_posting_comment_bumps_thread_version(self):
+        version = self.get_version()
+        Comment.objects.create(thread=self.thread, text='quack quack!')
+        self.assertEqual(self.get_version(), version + 1)
+
+    def test_liking_comment_bumps_thread_version(self):
+        version = self.get_version()
+        self.comment.like(self.user)
+        self.assertEqual(self.get_version(), version + 1)
+
+    def test_hiding_user_bumps_version_of_threads_with_user_comments(self):
+        other_thread = Thread.objects.create(site=self.site, url='url2')
+
+        version = self.get_version()
+        self.user.hide(self.site)
+
+        self.assertEqual(self.get_version(), version + 1)
+        self.assertEqual(Thread.objects.get(id=other_thread.id).version, 0)
+
+    def test_bulk_set_hidden_bumps_thread_version(self):
+        version = self.get_version()
+        Comment.objects.bulk_set_hidden([self.comment.id], True)
+
+        self.assertEqual(self.get_version(), version + 1)
+        self.assertTrue(Comment.objects.get(id=self.comment.id).hidden)
+
+    def test_bulk_delete_bumps_thread_version(self):
+        version = self.get_version()
+        Comment.objects.bulk_delete([self.comment.id])
+
+        self.assertEqual(self.get_version(), version + 1)
+        self.assertFalse(Comment.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CommentsCacheTestCase(BaseTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.comment = Comment.objects.create(
+            thread=self.thread, poster_name='Donald Duck', text='quack!')
+
+        self.endpoint_url = reverse('comments:get_comments')
+
+    def get_comments(self):
+        r = self.client.get(self.endpoint_url, data={
+            'thread': self.thread.id,
+            'domain': self.site.domain,
+        })
+        return json.loads(r.content)
+
+    def test_get_comments_reuses_cached_html_while_thread_is_unchanged(self):
+        self.get_comments()
+
+        # changes made without bumping thread version are not visible
+        Comment.objects.filter(id=self.comment.id).update(text='changed')
+        self.assertTrue('quack!' in self.get_comments()['html'])
+
+        Thread.objects.bump_version(id=self.thread.id)
+        html = self.get_comments()['html']
+        self.assertTrue('changed' in html)
+        self.assertFalse('quack!' in html)
+
+    def test_new_comment_invalidates_cached_html(self):
+        self.get_comments()
+        Comment.objects.create(
+            thread=self.thread, poster_name='Daffy Duck', text='woo-hoo!')
+
+        self.assertTrue('woo-hoo!' in self.get_comments()['html'])
+
+    def test_get_comments_returns_session_overlay(self):
+        self.get_comments()
+
+        r = self.client.post(reverse(
+            'comments:like_comment',
+            kwargs={'comment_id': self.comment.id}
+        ), data={'domain': self.site.domain})
+        data = self.get_data_from_response(r.content)
+        resp_data = json.loads(data['resp_data'])
+        self.assertEqual(
+            resp_data['overlay']['liked_comments'], [self.comment.id])
+
+        overlay = self.get_comments()['overlay']
+        self.assertEqual(overlay['liked_comments'], [self.comment.id])
+        self.assertEqual(overlay['disliked_comments'], [])
+        self.assertEqual(overlay['posted_comments'], [])
+        self.assertEqual(overlay['last_posted_comment_id'], None)
+
+
+class ConditionalResponseTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.comment = Comment.objects.create(
+            thread=self.thread, poster_name='Donald Duck', text='quack!')
+
+        self.comment_count_params = {
+            'domain': self.site.domain,
+            'thread_url': self.thread.url,
+        }
+        self.widget_params = {
+            'domain': self.site.domain,
+            'thread': self.thread.id,
+        }
+
+    def test_comment_count_returns_validators_and_public_cache_control(self):
+        r = self.client.get(
+            reverse('comments:comment_count'), self.comment_count_params)
+
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.has_header('ETag'))
+        self.assertTrue(r.has_header('Last-Modified'))
+        self.assertTrue('public' in r['Cache-Control'])
+        self.assertTrue('max-age' in r['Cache-Control'])
+
+    def test_comment_count_returns_304_if_thread_is_unchanged(self):
+        url = reverse('comments:comment_count')
+        r = self.client.get(url, self.comment_count_params)
+
+        r = self.client.get(
+            url, self.comment_count_params, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.content, '')
+
+        Comment.objects.create(thread=self.thread, text='quack quack!')
+
+        r = self.client.get(
+            url, self.comment_count_params, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(json.loads(r.content)['comment_count'], 2)
+
+    def test_comment_count_if_modified_since(self):
+        url = reverse('comments:comment_count')
+        r = self.client.get(url, self.comment_count_params)
+
+        r = self.client.get(
+            url, self.comment_count_params,
+            HTTP_IF_MODIFIED_SINCE=r['Last-Modified'])
+        self.assertEqual(r.status_code, 304)
+
+    def test_jsonp_callback_is_part_of_etag(self):
+        url = reverse('comments:comment_count')
+        r = self.client.get(url, self.comment_count_params)
+
+        params = dict(self.comment_count_params, callback='quack')
+        r = self.client.get(url, params, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.content.startswith('quack('))
+
+        r = self.client.get(url, params, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+
+    def test_get_comments_returns_304_without_rendering(self):
+        url = reverse('comments:get_comments')
+        r = self.client.get(url, self.widget_params)
+        self.assertEqual(r.status_code, 200)
+
+        with self.assertNumQueries(1):
+            r = self.client.get(
+                url, self.widget_params, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+
+    def test_get_comments_etag_changes_with_session_votes(self):
+        url = reverse('comments:get_comments')
+        etag = self.client.get(url, self.widget_params)['ETag']
+
+        self.client.post(reverse(
+            'comments:like_comment',
+            kwargs={'comment_id': self.comment.id}
+        ), data={'domain': self.site.domain})
+
+        r = self.client.get(url, self.widget_params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+
+    def test_get_header_etag_changes_with_thread_votes(self):
+        url = reverse('comments:get_header')
+        etag = self.client.get(url, self.widget_params)['ETag']
+
+        user = CustomUser.objects.create_user('a@b.com', 'pass')
+        self.thread.like(user)
+
+        r = self.client.get(url, self.widget_params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+
+    def test_get_footer_returns_304_if_site_is_unchanged(self):
+        url = reverse('comments:get_footer')
+        r = self.client.get(url, self.widget_params)
+
+        r = self.client.get(
+            url, self.widget_params, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+
+    def test_logged_in_user_responses_are_private(self):
+        CustomUser.objects.create_user('a@b.com', 'pass')
+        self.client.login(email='a@b.com', password='pass')
+
+        r = self.client.get(
+            reverse('comments:get_comments'), self.widget_params)
+
+        self.assertEqual(r.status_code, 200)
+        self.assertFalse(r.has_header('ETag'))
+        self.assertTrue('private' in r['Cache-Control'])
+
+    def test_error_responses_are_not_cacheable(self):
+        r = self.client.get(reverse('comments:comment_count'), {
+            'domain': self.site.domain,
+            'thread_url': 'nonexistent',
+        })
+
+        self.assertEqual(r.status_code, 400)
+        self.assertFalse(r.has_header('ETag'))
+        self.assertTrue('no-cache' in r['Cache-Control'])
@@ -0,0 +1,31 @@
+from django.core.management import call_command
+from django.utils.six import StringIO
+
+from base import BaseTestCase
+
+from comments.models import Comment, CustomUser, Site, Thread
+
+
+class RebuildVoteCountersCommandTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="a@b.com", password="pass")
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.comment = Comment.objects.create(thread=self.thread)
+
+    def test_rebuild_vote_counters_restores_counters_from_relations(self):
+        self.comment.liked_by.add(self.user)
+        self.thread.disliked_by.add(self.user)
+        Comment.objects.update(liked_users_count=5, disliked_users_count=3)
+        Thread.objects.update(liked_users_count=2, disliked_users_count=0)
+
+        call_command('rebuild_vote_counters', stdout=StringIO())
+
+        comment = Comment.objects.get(id=self.comment.id)
+        self.assertEqual(comment.liked_users_count, 1)
+        self.assertEqual(comment.disliked_users_count, 0)
+        thread = Thread.objects.get(id=self.thread.id)
+        self.assertEqual(thread.liked_users_count, 0)
+        self.assertEqual(thread.disliked_users_count, 1)
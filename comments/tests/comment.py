@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.db import IntegrityError
-from django.test import Client
+from django.test import Client, override_settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import ObjectDoesNotExist
@@ -29,6 +30,73 @@ class CommentManagerTestCase(BaseTestCase):
 
         self.assertEqual(Comment.objects.count(), 0)
 
+    def test_for_widget_returns_visible_comments_and_counts(self):
+        hidden_user = CustomUser.objects.create(
+            email="c@d.com", password="pass")
+        hidden_user.hidden.add(self.site)
+        visible = Comment.objects.create(user=self.user, thread=self.thread)
+        Comment.objects.create(thread=self.thread, hidden=True)
+        Comment.objects.create(user=hidden_user, thread=self.thread)
+
+        with self.assertNumQueries(2):
+            comments, next, counts = Comment.objects.for_widget(
+                self.thread, self.site)
+
+        self.assertEqual(comments, [visible])
+        self.assertEqual(next, None)
+        self.assertEqual(counts, {'total': 2, 'visible': 1})
+
+    def test_for_widget_returns_hidden_comments_to_site_admin(self):
+        Comment.objects.create(thread=self.thread)
+        Comment.objects.create(thread=self.thread, hidden=True)
+
+        comments, next, counts = Comment.objects.for_widget(
+            self.thread, self.site, all=True)
+        self.assertEqual(len(comments), 1)
+
+        comments, next, counts = Comment.objects.for_widget(
+            self.thread, self.site, all=True, site_admin=True)
+        self.assertEqual(len(comments), 2)
+
+    def test_for_widget_limits_comments_if_not_all(self):
+        Comment.objects.bulk_create([
+            Comment(user=self.user, thread=self.thread)
+            for i in range(settings.WIDGET_COMMENTS_DEFAULT_NUMBER + 1)
+        ])
+
+        comments, next, counts = Comment.objects.for_widget(
+            self.thread, self.site)
+        self.assertEqual(
+            len(comments), settings.WIDGET_COMMENTS_DEFAULT_NUMBER)
+        self.assertEqual(next, Comment.objects.order_by('id').last().id)
+
+        comments, next, counts = Comment.objects.for_widget(
+            self.thread, self.site, all=True)
+        self.assertEqual(
+            len(comments), settings.WIDGET_COMMENTS_DEFAULT_NUMBER + 1)
+
+    def test_widget_page_returns_comments_starting_with_start(self):
+        Comment.objects.bulk_create([
+            Comment(user=self.user, thread=self.thread)
+            for i in range(settings.WIDGET_COMMENTS_DEFAULT_NUMBER * 2 + 1)
+        ])
+        ids = list(Comment.objects.order_by('id').values_list('id', flat=True))
+        start = ids[settings.WIDGET_COMMENTS_DEFAULT_NUMBER]
+
+        with self.assertNumQueries(1):
+            comments, next = Comment.objects.widget_page(
+                self.thread, self.site, start)
+
+        self.assertEqual(
+            [c.id for c in comments],
+            ids[settings.WIDGET_COMMENTS_DEFAULT_NUMBER:-1])
+        self.assertEqual(next, ids[-1])
+
+        comments, next = Comment.objects.widget_page(
+            self.thread, self.site, next)
+        self.assertEqual([c.id for c in comments], ids[-1:])
+        self.assertEqual(next, None)
+
 
 class CommentTestCase(BaseTestCase):
 
@@ -59,6 +127,39 @@ class CommentTestCase(BaseTestCase):
         self.assertEqual(comment.user, self.user_foo)
         self.assertEqual(comment.thread, self.thread)
 
+    def test_hide_saves_only_hidden_flag(self):
+        comment = Comment.objects.create(thread=self.thread, text='quack!')
+        Comment.objects.filter(id=comment.id).update(text='changed')
+
+        comment.hide()
+
+        comment = Comment.objects.get(id=comment.id)
+        self.assertTrue(comment.hidden)
+        self.assertEqual(comment.text, 'changed')
+
+    def get_comments_version(self):
+        return Site.objects.get(id=self.site.id).comments_version
+
+    def test_visible_comments_bump_site_comments_version(self):
+        version = self.get_comments_version()
+
+        comment = Comment.objects.create(thread=self.thread)
+        self.assertEqual(self.get_comments_version(), version + 1)
+
+        comment.text = 'quack!'
+        comment.save()
+        Comment.objects.create(thread=self.thread, hidden=True)
+        self.assertEqual(self.get_comments_version(), version + 1)
+
+        comment.hide()
+        self.assertEqual(self.get_comments_version(), version + 2)
+
+    def test_hide_hidden_comment_writes_nothing(self):
+        comment = Comment.objects.create(thread=self.thread, hidden=True)
+
+        with self.assertNumQueries(0):
+            comment.hide()
+
     def test_likes_count_property(self):
         comment = Comment.objects.create(thread=self.thread)
         comment.liked_by_count += 1
@@ -145,6 +246,51 @@ class CommentTestCase(BaseTestCase):
         comment.undo_dislike(anon)
         self.assertEqual(comment.dislikes_count, 0)
 
+    def test_vote_counters_follow_reverse_relation_changes(self):
+        comment = Comment.objects.create(thread=self.thread)
+        user = CustomUser.objects.create_user(email="a@b.com", password="pass")
+
+        user.liked_comments.add(comment)
+        user.liked_comments.add(comment)
+        comment = Comment.objects.get(id=comment.id)
+        self.assertEqual(comment.liked_users_count, 1)
+
+        user.liked_comments.clear()
+        comment = Comment.objects.get(id=comment.id)
+        self.assertEqual(comment.liked_users_count, 0)
+
+    def test_remove_not_voting_user_doesnt_change_vote_counters(self):
+        comment = Comment.objects.create(thread=self.thread)
+        user = CustomUser.objects.create_user(email="a@b.com", password="pass")
+        user2 = CustomUser.objects.create_user(
+            email="c@d.com", password="pass")
+
+        comment.dislike(user)
+        comment.disliked_by.remove(user2)
+
+        comment = Comment.objects.get(id=comment.id)
+        self.assertEqual(comment.disliked_users_count, 1)
+
+    def test_deleting_user_decrements_vote_counters(self):
+        comment = Comment.objects.create(thread=self.thread)
+        user = CustomUser.objects.create_user(email="a@b.com", password="pass")
+        comment.like(user)
+
+        user.delete()
+
+        comment = Comment.objects.get(id=comment.id)
+        self.assertEqual(comment.likes_count, 0)
+
+    def test_likes_count_doesnt_query_db(self):
+        comment = Comment.objects.create(thread=self.thread)
+        user = CustomUser.objects.create_user(email="a@b.com", password="pass")
+        comment.like(user)
+        comment = Comment.objects.get(id=comment.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(comment.likes_count, 1)
+            self.assertEqual(comment.dislikes_count, 0)
+
     def test_non_staff_user_cannot_delete_comment_from_db(self):
         comment = Comment.objects.create(thread=self.thread)
 
@@ -384,6 +530,105 @@ class GetCommentsCountTestCase(BaseTestCase):
         resp = json.loads(r.content)
         self.assertEqual(2, resp['comment_count'])
 
+
+class CommentCountsEndpointTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.test_site = Site.objects.create(
+            domain='testdomain.com',
+        )
+        self.test_thread_1 = Thread.objects.create(
+            site=self.test_site,
+            url='test_url_1'
+        )
+        self.test_thread_2 = Thread.objects.create(
+            site=self.test_site,
+            url='test_url_2'
+        )
+        Comment.objects.create(
+            poster_name='Donald Duck',
+            thread=self.test_thread_1,
+            text='quack!'
+        )
+        Comment.objects.create(
+            poster_name='Daffy Duck',
+            thread=self.test_thread_1,
+            text='woo-hoo!'
+        )
+        self.test_comment = Comment.objects.create(
+            poster_name='Donald Duck',
+            thread=self.test_thread_2,
+            text='quack quack!'
+        )
+        Comment.objects.create(
+            poster_name='Slow Loris',
+            thread=self.test_thread_2,
+            text='Real life Slowpoke!',
+            hidden=True
+        )
+
+        self.endpoint_url = reverse('comments:comment_counts')
+        self.params = {
+            'domain': self.test_site.domain,
+            'thread_url': ['test_url_1', 'test_url_2', 'nonexistent'],
+        }
+
+    def test_comment_counts_returns_visible_counts(self):
+        r = self.client.get(self.endpoint_url, data=self.params)
+
+        self.assertEqual(r.status_code, 200)
+        resp = json.loads(r.content)
+        self.assertEqual(resp['comment_counts'], {
+            'test_url_1': 2,
+            'test_url_2': 1,
+            'nonexistent': 0,
+        })
+
+    def test_comment_counts_number_of_queries_doesnt_depend_on_threads(self):
+        # resolves and caches site
+        self.client.get(self.endpoint_url, data=self.params)
+
+        # site comments version (validators and view) and counts queries
+        with self.assertNumQueries(3):
+            self.client.get(self.endpoint_url, data=self.params)
+
+    def test_comment_counts_unknown_domain_fails(self):
+        r = self.client.get(self.endpoint_url, data={
+            'domain': 'unknown.com',
+            'thread_url': 'test_url_1',
+        })
+
+        self.assertEqual(r.status_code, 400)
+
+    def test_comment_counts_too_many_threads_fails(self):
+        r = self.client.get(self.endpoint_url, data={
+            'domain': self.test_site.domain,
+            'thread_url': [
+                'url_%d' % i
+                for i in range(settings.COMMENT_COUNTS_MAX_THREADS + 1)
+            ],
+        })
+
+        self.assertEqual(r.status_code, 400)
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    })
+    def test_comment_counts_cache_is_invalidated_on_visibility_change(self):
+        self.client.get(self.endpoint_url, data=self.params)
+
+        with self.assertNumQueries(2):
+            self.client.get(self.endpoint_url, data=self.params)
+
+        self.test_comment.hide()
+
+        r = self.client.get(self.endpoint_url, data=self.params)
+        resp = json.loads(r.content)
+        self.assertEqual(resp['comment_counts']['test_url_2'], 0)
+
+
 class GetCommentsEndpointTestCase(BaseTestCase):
 
     def setUp(self):
@@ -425,6 +670,65 @@ class GetCommentsEndpointTestCase(BaseTestCase):
         html_container_name = resp['html_container_name']
         self.assertEqual(html_container_name, 'comments_container')
 
+    def test_get_comments_number_of_queries_doesnt_depend_on_thread_size(self):
+        user = CustomUser.objects.create_user("a@b.com", "pass")
+        params = {
+            'thread': self.test_thread.id,
+            'domain': self.test_thread.site.domain,
+        }
+        # resolves and caches site
+        self.client.get(self.endpoint_url, data=params)
+
+        with self.assertNumQueries(4):
+            self.client.get(self.endpoint_url, data=params)
+
+        for i in range(20):
+            comment = Comment.objects.create(
+                user=user,
+                poster_name='Donald Duck',
+                thread=self.test_thread,
+                text='test text'
+            )
+            comment.like(user)
+
+        with self.assertNumQueries(4):
+            r = self.client.get(self.endpoint_url, data=params)
+
+        self.assertEqual(r.status_code, 200)
+
+    def test_get_comments_with_start_returns_next_page(self):
+        Comment.objects.bulk_create([
+            Comment(
+                poster_name='Donald Duck',
+                thread=self.test_thread,
+                text='page text %d' % i
+            )
+            for i in range(settings.WIDGET_COMMENTS_DEFAULT_NUMBER)
+        ])
+        r = self.client.get(self.endpoint_url, data={
+            'thread': self.test_thread.id,
+            'domain': self.test_thread.site.domain,
+        })
+        html = json.loads(r.content)['html']
+        self.assertTrue('btn-load-more-comments' in html)
+        self.assertFalse('page text %d' % (
+            settings.WIDGET_COMMENTS_DEFAULT_NUMBER - 1) in html)
+
+        ids = Comment.objects.order_by('id').values_list('id', flat=True)
+        start = ids[settings.WIDGET_COMMENTS_DEFAULT_NUMBER]
+        r = self.client.get(self.endpoint_url, data={
+            'thread': self.test_thread.id,
+            'domain': self.test_thread.site.domain,
+            'start': start,
+        })
+
+        self.assertEqual(r.status_code, 200)
+        resp = json.loads(r.content)
+        self.assertEqual(resp['next'], None)
+        self.assertTrue('data-comment-id="%s"' % start in resp['html'])
+        self.assertFalse('test text 1' in resp['html'])
+        self.assertTrue('overlay' in resp)
+
     def test_get_comments_thread_not_provided_fails(self):
         r = self.client.get(self.endpoint_url, data={
             'domain': self.test_thread.site.domain,
@@ -448,6 +752,105 @@ class GetCommentsEndpointTestCase(BaseTestCase):
         self.assertEqual(r.status_code, 400)
 
 
+@override_settings(COMMENT_CHANGES_OVERLAP=0)
+class CommentChangesEndpointTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.test_site = Site.objects.create(
+            domain='testdomain.com',
+        )
+        self.test_thread = Thread.objects.create(
+            site=self.test_site,
+            url='test_url'
+        )
+        self.test_comment = Comment.objects.create(
+            poster_name='Donald Duck',
+            thread=self.test_thread,
+            text='quack!'
+        )
+
+        self.endpoint_url = reverse('comments:comment_changes')
+        self.params = {
+            'thread': self.test_thread.id,
+            'domain': self.test_site.domain,
+        }
+
+    def get_cursor(self):
+        r = self.client.get(reverse('comments:get_comments'), self.params)
+        return json.loads(r.content)['cursor']
+
+    def get_changes(self, cursor):
+        r = self.client.get(
+            self.endpoint_url, dict(self.params, since=cursor))
+        self.assertEqual(r.status_code, 200)
+        return json.loads(r.content)
+
+    def test_comment_changes_returns_nothing_if_thread_is_unchanged(self):
+        resp = self.get_changes(self.get_cursor())
+
+        self.assertFalse(resp['reload'])
+        self.assertEqual(resp['html'], '')
+        self.assertEqual(resp['changes'], [])
+        self.assertTrue(resp['cursor'])
+
+    def test_comment_changes_returns_new_comments_html(self):
+        cursor = self.get_cursor()
+        Comment.objects.create(
+            poster_name='Daffy Duck',
+            thread=self.test_thread,
+            text='woo-hoo!'
+        )
+
+        resp = self.get_changes(cursor)
+
+        self.assertTrue('woo-hoo!' in resp['html'])
+        self.assertFalse('quack!' in resp['html'])
+        self.assertEqual(resp['changes'], [])
+
+    def test_comment_changes_returns_vote_counts_and_hidden_state(self):
+        user = CustomUser.objects.create_user('a@b.com', 'pass')
+        cursor = self.get_cursor()
+
+        self.test_comment.like(AnonymousUser())
+        self.test_comment.like(user)
+        resp = self.get_changes(cursor)
+        self.assertEqual(resp['changes'], [{
+            'id': self.test_comment.id,
+            'likes': 2,
+            'dislikes': 0,
+            'hidden': False,
+        }])
+
+        cursor = resp['cursor']
+        self.test_comment.hide()
+        resp = self.get_changes(cursor)
+        self.assertEqual(resp['changes'][0]['hidden'], True)
+
+    def test_comment_changes_reports_comments_of_hidden_user_as_hidden(self):
+        user = CustomUser.objects.create_user('a@b.com', 'pass')
+        comment = Comment.objects.create(
+            user=user, thread=self.test_thread, text='woo-hoo!')
+        cursor = self.get_cursor()
+
+        user.hide(self.test_site)
+
+        resp = self.get_changes(cursor)
+        self.assertEqual(len(resp['changes']), 1)
+        self.assertEqual(resp['changes'][0]['id'], comment.id)
+        self.assertEqual(resp['changes'][0]['hidden'], True)
+
+    def test_comment_changes_returns_reload_after_deletion(self):
+        cursor = self.get_cursor()
+        Comment.objects.bulk_delete([self.test_comment.id])
+
+        resp = self.get_changes(cursor)
+        self.assertTrue(resp['reload'])
+
+    def test_comment_changes_without_cursor_fails(self):
+        r = self.client.get(self.endpoint_url, self.params)
+        self.assertEqual(r.status_code, 400)
+
+
 class LikeCommentEndpointTestCase(BaseTestCase):
 
     def setUp(self):
@@ -485,6 +888,26 @@ class LikeCommentEndpointTestCase(BaseTestCase):
         comment = Comment.objects.get(id=self.test_comment.id)
         self.assertEqual(comment.liked_by_count, 1)
 
+    def test_like_comment_compact_returns_comment_state(self):
+        r = self.client.post(reverse(
+            'comments:like_comment',
+            kwargs={'comment_id': self.test_comment.id}
+        ), data={'domain': self.test_site.domain, 'compact': 1})
+
+        data = self.get_data_from_response(r.content)
+        self.assertEqual(data['status_code'], 200)
+
+        resp_data = json.loads(data['resp_data'])
+        self.assertFalse('content' in resp_data)
+        self.assertEqual(resp_data['comment'], {
+            'id': self.test_comment.id,
+            'likes': 1,
+            'dislikes': 0,
+            'hidden': False,
+            'liked': True,
+            'disliked': False,
+        })
+
     def test_like_nonexisting_comment_fails(self):
         r = self.client.post(reverse(
             'comments:like_comment',
@@ -808,6 +1231,21 @@ class HideCommentEndpointTestCase(BaseTestCase):
         comment = Comment.objects.get(id=self.test_comment.id)
         self.assertTrue(comment.hidden)
 
+    def test_hide_comment_compact_returns_comment_state(self):
+        self.client.login(email="admin@b.org", password='pass')
+
+        r = self.client.post(reverse(
+            'comments:hide_comment',
+            kwargs={'comment_id': self.test_comment.id}
+        ), data={'compact': 1})
+
+        data = self.get_data_from_response(r.content)
+        self.assertEqual(data['status_code'], 200)
+
+        resp_data = json.loads(data['resp_data'])
+        self.assertEqual(resp_data['comment']['id'], self.test_comment.id)
+        self.assertTrue(resp_data['comment']['hidden'])
+
     def test_hide_comment_not_admin_fails(self):
         self.client.login(email="a@b.org", password='pass')
 
@@ -1,10 +1,14 @@
 from django.db import IntegrityError
-from django.test import Client
+from django.core.cache import cache
+from django.test import Client, override_settings
 from django.core.urlresolvers import reverse
 
 from base import BaseTestCase
+from cache import LOCMEM_CACHES
 
-from comments.models import CustomUser, Site, Thread, Comment
+from comments.models import (
+    CustomUser, Site, Thread, Comment, UserSiteActivity
+)
 
 
 class CustomUserManagerTestCase(BaseTestCase):
@@ -23,25 +27,6 @@ class CustomUserManagerTestCase(BaseTestCase):
         with self.assertRaises(IntegrityError):
             CustomUser.objects.create_user(email, 'pass')
 
-    def test_get_user_domain_data(self):
-        email = 'a@b.com'
-        u = CustomUser.objects.create_user(email, 'pass')
-
-        site = Site.objects.create(domain='www.google.com')
-        thread = Thread.objects.create(site=site, url='url')
-        thread.disliked_by.add(u)
-
-        comment = Comment.objects.create(thread=thread, user=u, text='aaa')
-        comment.liked_by.add(u)
-
-        ret = u.get_user_domain_data()
-
-        self.assertEqual(list(ret['posted_comments']), [comment.id])
-        self.assertEqual(list(ret['liked_threads']), [])
-        self.assertEqual(list(ret['disliked_threads']), [thread.id])
-        self.assertEqual(list(ret['liked_comments']), [comment.id])
-        self.assertEqual(list(ret['disliked_comments']), [])
-
     def test_bulk_delete_successfully_deletes_users(self):
         CustomUser.objects.bulk_create([
             CustomUser(email='a@b.com', password='pass'),
@@ -64,6 +49,47 @@ class CustomUserManagerTestCase(BaseTestCase):
 
         self.assertEqual(CustomUser.objects.count(), 1)
 
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_bulk_set_hidden_hides_and_reveals_users_on_sites(self):
+        cache.clear()
+        user = CustomUser.objects.create_user('a@b.com', 'pass')
+        staff = CustomUser.objects.create_user('c@b.com', 'pass')
+        staff.is_staff = True
+        staff.save()
+        sites = [Site.objects.create(domain='www.google.com'),
+                 Site.objects.create(domain='www.duck.com')]
+        thread = Thread.objects.create(site=sites[0], url='url')
+        comment = Comment.objects.create(thread=thread, user=user)
+        self.assertFalse(user.is_hidden_on(sites[0].id))
+
+        site_ids = [site.id for site in sites]
+        changed = CustomUser.objects.bulk_set_hidden(
+            [user.id, staff.id], site_ids, True)
+
+        self.assertEqual(
+            sorted(changed), [(user.id, site.id) for site in sites])
+        self.assertTrue(
+            CustomUser.objects.get(id=user.id).is_hidden_on(sites[0].id))
+        self.assertFalse(staff.hidden.exists())
+        self.assertTrue(UserSiteActivity.objects.get(user=user).hidden)
+        self.assertTrue(
+            Comment.objects.get(id=comment.id).updated > comment.updated)
+        self.assertEqual(Thread.objects.get(id=thread.id).version, 2)
+
+        # hiding already hidden users changes nothing
+        self.assertEqual(CustomUser.objects.bulk_set_hidden(
+            [user.id], site_ids, True), [])
+
+        changed = CustomUser.objects.bulk_set_hidden(
+            [user.id], [sites[0].id], False)
+
+        self.assertEqual(changed, [(user.id, sites[0].id)])
+        self.assertEqual(
+            list(user.hidden.values_list('id', flat=True)), [sites[1].id])
+        self.assertFalse(
+            CustomUser.objects.get(id=user.id).is_hidden_on(sites[0].id))
+        self.assertFalse(UserSiteActivity.objects.get(user=user).hidden)
+
 
 class CustomUserTestCase(BaseTestCase):
 
@@ -114,6 +140,62 @@ class CustomUserTestCase(BaseTestCase):
         user.unhide(site)
         self.assertFalse(user.hidden.filter(id=site.id))
 
+    def test_is_hidden_on_is_loaded_once_per_instance(self):
+        user = CustomUser.objects.create_user(
+            email="donald@duck.com",
+            password="pass",
+        )
+        site = Site.objects.create(domain='www.google.com')
+        other_site = Site.objects.create(domain='www.example.com')
+        user.hidden.add(site)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(user.is_hidden_on(site.id))
+            self.assertFalse(user.is_hidden_on(other_site.id))
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_is_hidden_on_cache_is_invalidated_by_hide_and_unhide(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(
+            email="donald@duck.com",
+            password="pass",
+        )
+        site = Site.objects.create(domain='www.google.com')
+        self.assertFalse(user.is_hidden_on(site.id))
+
+        # other requests use shared cache
+        other = CustomUser.objects.get(id=user.id)
+        with self.assertNumQueries(0):
+            self.assertFalse(other.is_hidden_on(site.id))
+
+        user.hide(site)
+        self.assertTrue(user.is_hidden_on(site.id))
+        self.assertTrue(
+            CustomUser.objects.get(id=user.id).is_hidden_on(site.id))
+
+        # users hidden from the site side of the relation
+        site.hidden_users.remove(user)
+        self.assertFalse(
+            CustomUser.objects.get(id=user.id).is_hidden_on(site.id))
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_uncached_is_hidden_on_checks_db(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(
+            email="donald@duck.com",
+            password="pass",
+        )
+        site = Site.objects.create(domain='www.google.com')
+        self.assertFalse(user.is_hidden_on(site.id))
+
+        # user hidden by other process which can't invalidate this cache
+        CustomUser.hidden.through.objects.create(
+            customuser=user, site=site)
+
+        user = CustomUser.objects.get(id=user.id)
+        self.assertFalse(user.is_hidden_on(site.id))
+        self.assertTrue(user.is_hidden_on(site.id, cached=False))
+
     def test_unhide_admin_is_success(self):
         """
         Tests if admin's hidden flag state is changed by unhide method (though
@@ -198,6 +280,69 @@ class CustomUserTestCase(BaseTestCase):
         self.assertEqual(Comment.objects.count(), 0)
 
 
+class UserSiteActivityTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.user = CustomUser.objects.create_user(
+            email='donald@duck.com',
+            password='pass'
+        )
+
+    def get_activity(self, site=None):
+        return UserSiteActivity.objects.get(
+            user=self.user, site=site or self.site)
+
+    def test_comments_are_added_to_activity(self):
+        other_thread = Thread.objects.create(site=self.site, url='other')
+        first = Comment.objects.create(thread=self.thread, user=self.user)
+        last = Comment.objects.create(thread=other_thread, user=self.user)
+        Comment.objects.create(thread=self.thread, text='anonymous')
+
+        activity = self.get_activity()
+        self.assertEqual(activity.comment_count, 2)
+        self.assertEqual(activity.first_comment_at, first.created)
+        self.assertEqual(activity.last_comment_at, last.created)
+        self.assertEqual(UserSiteActivity.objects.count(), 1)
+
+    def test_deleting_comments_updates_activity(self):
+        first = Comment.objects.create(thread=self.thread, user=self.user)
+        last = Comment.objects.create(thread=self.thread, user=self.user)
+
+        last.delete(CustomUser(is_staff=True))
+        activity = self.get_activity()
+        self.assertEqual(activity.comment_count, 1)
+        self.assertEqual(activity.last_comment_at, first.created)
+
+        Comment.objects.bulk_delete([first.id])
+        self.assertFalse(UserSiteActivity.objects.exists())
+
+    def test_hiding_users_updates_activity(self):
+        other_site = Site.objects.create(domain='www.duck.com')
+        other_thread = Thread.objects.create(site=other_site, url='url')
+        Comment.objects.create(thread=self.thread, user=self.user)
+        Comment.objects.create(thread=other_thread, user=self.user)
+
+        self.user.hide(self.site)
+        self.assertTrue(self.get_activity().hidden)
+        self.assertFalse(self.get_activity(other_site).hidden)
+
+        other_site.hidden_users.add(self.user)
+        self.assertTrue(self.get_activity(other_site).hidden)
+
+        self.user.hidden.clear()
+        self.assertFalse(self.get_activity().hidden)
+        self.assertFalse(self.get_activity(other_site).hidden)
+
+    def test_comments_of_hidden_user_are_added_as_hidden(self):
+        self.user.hidden.add(self.site)
+
+        Comment.objects.create(thread=self.thread, user=self.user)
+
+        self.assertTrue(self.get_activity().hidden)
+
+
 class RegisterEndpointTestCase(BaseTestCase):
 
     def setUp(self):
@@ -0,0 +1,115 @@
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils.six import StringIO
+
+from base import BaseTestCase
+from cache import LOCMEM_CACHES
+
+from comments.deletion import iter_id_chunks
+from comments.models import (
+    Comment, CustomUser, Site, Thread, UserSiteActivity
+)
+
+
+@override_settings(DELETION_CHUNK_SIZE=2)
+class DeletionTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.user = CustomUser.objects.create_user(
+            email='donald@duck.com',
+            password='pass'
+        )
+        self.other = CustomUser.objects.create_user(
+            email='daffy@duck.com',
+            password='pass'
+        )
+        self.comments = [
+            Comment.objects.create(thread=self.thread, user=self.user)
+            for i in range(3)
+        ]
+        self.other_comment = Comment.objects.create(
+            thread=self.thread, user=self.other)
+
+    def test_iter_id_chunks_returns_ids_in_chunks(self):
+        ids = [comment.id for comment in self.comments]
+
+        chunks = list(iter_id_chunks(
+            Comment.objects.filter(user=self.user)))
+
+        self.assertEqual(chunks, [ids[:2], ids[2:]])
+
+    def test_bulk_delete_users_deletes_their_rows_and_votes(self):
+        self.other_comment.liked_by.add(self.user)
+        self.thread.disliked_by.add(self.user)
+        self.comments[0].liked_by.add(self.other)
+        self.user.hidden.add(self.site)
+
+        CustomUser.objects.bulk_delete([self.user.id])
+
+        self.assertFalse(CustomUser.objects.filter(id=self.user.id).exists())
+        self.assertEqual(
+            list(Comment.objects.values_list('id', flat=True)),
+            [self.other_comment.id])
+        self.assertEqual(
+            Comment.objects.get(id=self.other_comment.id).liked_users_count,
+            0)
+        thread = Thread.objects.get(id=self.thread.id)
+        self.assertEqual(thread.disliked_users_count, 0)
+        self.assertEqual(thread.comment_count, 1)
+        self.assertFalse(self.site.hidden_users.exists())
+        self.assertEqual(
+            list(UserSiteActivity.objects.values_list('user', flat=True)),
+            [self.other.id])
+
+    @override_settings(COMMENTS_SOFT_DELETE=True)
+    def test_soft_deleted_comments_are_hidden_until_purged(self):
+        self.comments[0].liked_by.add(self.other)
+
+        Comment.objects.bulk_delete(Comment.objects.filter(user=self.user))
+
+        self.assertEqual(
+            list(Comment.objects.values_list('id', flat=True)),
+            [self.other_comment.id])
+        self.assertEqual(
+            Comment._base_manager.filter(deleted__isnull=False).count(), 3)
+        self.assertEqual(
+            Thread.objects.get(id=self.thread.id).comment_count, 1)
+        self.assertFalse(UserSiteActivity.objects.filter(
+            user=self.user).exists())
+
+        out = StringIO()
+        call_command('purge_deleted_comments', stdout=out)
+
+        self.assertEqual(Comment._base_manager.count(), 1)
+        self.assertFalse(Comment.liked_by.through.objects.exists())
+        self.assertEqual(out.getvalue().strip(), "Purged 3 deleted comments")
+
+    def test_thread_delete_deletes_comments_and_votes(self):
+        self.comments[0].liked_by.add(self.other)
+        self.thread.liked_by.add(self.other)
+
+        self.thread.delete()
+
+        self.assertFalse(Thread.objects.exists())
+        self.assertFalse(Comment._base_manager.exists())
+        self.assertFalse(Comment.liked_by.through.objects.exists())
+        self.assertFalse(Thread.liked_by.through.objects.exists())
+        self.assertFalse(UserSiteActivity.objects.exists())
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_site_delete_deletes_threads_and_clears_cache(self):
+        cache.clear()
+        Site.objects.get_for_domain(self.site.domain)
+        self.site.admins.add(self.other)
+
+        self.site.delete()
+
+        self.assertFalse(Site.objects.exists())
+        self.assertFalse(Thread.objects.exists())
+        self.assertFalse(Comment._base_manager.exists())
+        self.assertFalse(Site.admins.through.objects.exists())
+        with self.assertRaises(Site.DoesNotExist):
+            Site.objects.get_for_domain(self.site.domain)
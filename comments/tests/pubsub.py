@@ -0,0 +1,156 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.urlresolvers import reverse
+from django.test import TransactionTestCase, override_settings
+
+from base import BaseTestCase
+
+import json
+
+from comments.models import Comment, Site, Thread
+from comments.pubsub import (
+    LocalPubSub, PostgresPubSub, get_pubsub, get_thread_channel, publish_event
+)
+
+
+class LocalPubSubTestCase(BaseTestCase):
+
+    def test_message_is_delivered_to_channel_subscribers(self):
+        pubsub = LocalPubSub()
+        first = pubsub.subscribe('quack')
+        second = pubsub.subscribe('quack')
+        other = pubsub.subscribe('woo-hoo')
+
+        pubsub.publish('quack', {'id': 1})
+
+        self.assertEqual(first.get(0), {'id': 1})
+        self.assertEqual(second.get(0), {'id': 1})
+        self.assertEqual(other.get(0), None)
+
+    def test_closed_subscription_is_removed(self):
+        pubsub = LocalPubSub()
+        subscription = pubsub.subscribe('quack')
+        subscription.close()
+
+        self.assertEqual(pubsub.subscribers, {})
+
+    def test_event_is_not_published_before_commit(self):
+        subscription = get_pubsub().subscribe(get_thread_channel(1))
+        publish_event(1, 'comment', {'id': 1})
+
+        # test case transaction is never committed
+        self.assertEqual(subscription.get(0), None)
+        subscription.close()
+
+
+class PublishEventTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.comment = Comment.objects.create(
+            thread=self.thread, poster_name='Donald Duck', text='quack!')
+
+        self.subscription = get_pubsub().subscribe(
+            get_thread_channel(self.thread.id))
+
+    def tearDown(self):
+        self.subscription.close()
+
+    def test_liking_comment_publishes_comment_state(self):
+        self.comment.like(AnonymousUser())
+
+        self.assertEqual(self.subscription.get(0), {
+            'event': 'state',
+            'data': {
+                'id': self.comment.id,
+                'likes': 1,
+                'dislikes': 0,
+                'hidden': False,
+            }
+        })
+
+    def test_hiding_comments_publishes_hidden_state(self):
+        Comment.objects.bulk_set_hidden([self.comment.id], True)
+
+        self.assertEqual(self.subscription.get(0), {
+            'event': 'state',
+            'data': {'id': self.comment.id, 'hidden': True}
+        })
+
+    def test_posting_comment_publishes_comment_event(self):
+        self.client.post(reverse('comments:comment'), data={
+            'thread': self.thread.id,
+            'domain': self.site.domain,
+            'poster_name': 'Daffy Duck',
+            'text': 'woo-hoo!',
+        })
+
+        comment = Comment.objects.latest('id')
+        self.assertEqual(self.subscription.get(0), {
+            'event': 'comment',
+            'data': {'id': comment.id}
+        })
+
+    def test_postgres_backend_delivers_notifications(self):
+        pubsub = PostgresPubSub()
+        subscription = pubsub.subscribe('quack')
+
+        pubsub.publish('quack', {'id': 1})
+
+        self.assertEqual(subscription.get(5), {'id': 1})
+        subscription.close()
+        pubsub.close()
+
+
+@override_settings(COMMENTS_STREAM_ENABLED=True)
+class CommentStreamTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.endpoint_url = reverse('comments:comment_stream')
+
+    @override_settings(COMMENTS_STREAM_TIMEOUT=0.2,
+                       COMMENTS_STREAM_KEEPALIVE=0.1)
+    def test_stream_returns_published_events(self):
+        r = self.client.get(self.endpoint_url, data={
+            'thread': self.thread.id,
+            'domain': self.site.domain,
+        })
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r['Content-Type'], 'text/event-stream')
+        self.assertEqual(r['Cache-Control'], 'no-cache')
+
+        content = iter(r.streaming_content)
+        self.assertTrue(next(content).startswith('retry:'))
+
+        get_pubsub().publish(get_thread_channel(self.thread.id), {
+            'event': 'comment',
+            'data': {'id': 1},
+        })
+        events = list(content)
+        self.assertEqual(
+            events[0], 'event: comment\ndata: %s\n\n' % json.dumps({'id': 1}))
+        self.assertTrue(': keepalive\n\n' in events)
+
+        # subscription is closed with the stream
+        self.assertFalse(get_pubsub().subscribers)
+
+    def test_stream_of_nonexistent_thread(self):
+        r = self.client.get(self.endpoint_url, data={
+            'thread': self.thread.id,
+            'domain': 'www.example.com',
+        })
+
+        self.assertEqual(r.status_code, 400)
+
+    @override_settings(COMMENTS_STREAM_ENABLED=False)
+    def test_disabled_stream(self):
+        r = self.client.get(self.endpoint_url, data={
+            'thread': self.thread.id,
+            'domain': self.site.domain,
+        })
+
+        self.assertEqual(r.status_code, 404)
+        self.assertFalse(get_pubsub().subscribers)
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from base import BaseTestCase
+
+from datetime import timedelta
+
+from comments.models import CustomUser, Site, Thread
+from comments.user_state import SESSION_KEY
+
+
+class AnonymousSessionTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.user = CustomUser.objects.create_user(
+            email='donald@duck.com',
+            password='pass'
+        )
+
+    def get_thread_info(self):
+        return self.client.get(reverse('comments:thread_info'), data={
+            'domain': self.site.domain,
+            'thread': self.thread.url,
+        })
+
+    def like_thread(self):
+        self.client.post(reverse(
+            'comments:like_thread', kwargs={'thread_id': self.thread.id}
+        ))
+
+    def login(self):
+        return self.client.post(reverse('comments:login_user'), data={
+            'site_id': self.site.id,
+            'email': 'donald@duck.com',
+            'password': 'pass',
+        })
+
+    def test_anonymous_session_is_not_saved_in_db(self):
+        r = self.get_thread_info()
+
+        self.assertTrue(settings.ANONYMOUS_SESSION_COOKIE_NAME in r.cookies)
+        self.assertFalse(settings.SESSION_COOKIE_NAME in r.cookies)
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertTrue(self.get_session()['user_avatar_num'])
+
+    def test_session_is_moved_to_db_on_login(self):
+        self.like_thread()
+
+        r = self.login()
+
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(
+            r.cookies[settings.ANONYMOUS_SESSION_COOKIE_NAME].value, '')
+        session = self.get_session()
+        self.assertEqual(session['_auth_user_id'], str(self.user.id))
+        self.assertEqual(session[SESSION_KEY], [
+            [self.thread.id, {'liked_threads': [self.thread.id]}]
+        ])
+
+    def test_session_is_moved_out_of_db_on_logout(self):
+        self.login()
+
+        r = self.client.post(reverse('comments:logout_user'))
+
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertEqual(r.cookies[settings.SESSION_COOKIE_NAME].value, '')
+
+        self.like_thread()
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertEqual(self.get_session()[SESSION_KEY], [
+            [self.thread.id, {'liked_threads': [self.thread.id]}]
+        ])
+
+
+class ClearExpiredSessionsCommandTestCase(BaseTestCase):
+
+    def create_session(self, key, expire_date):
+        Session.objects.create(
+            session_key=key, session_data='', expire_date=expire_date)
+
+    def test_expired_sessions_are_deleted_in_batches(self):
+        now = timezone.now()
+        for i in range(5):
+            self.create_session('expired%d' % i, now - timedelta(days=1))
+        self.create_session('valid', now + timedelta(days=1))
+
+        out = StringIO()
+        call_command('clear_expired_sessions', batch_size=2, stdout=out)
+
+        self.assertEqual(
+            list(Session.objects.values_list('session_key', flat=True)),
+            ['valid']
+        )
+        self.assertEqual(out.getvalue().strip(), "Deleted 5 expired sessions")
@@ -1,9 +1,82 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from base import BaseTestCase
+from cache import LOCMEM_CACHES
 
 from comments.forms import SiteForm
+from comments.models import Site, get_site_cache_timeout, local_sites
+
+
+class SiteTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(
+            domain='www.google.com', rs_customer_id='1234')
+
+    def test_get_for_domain_caches_site(self):
+        site = Site.objects.get_for_domain('www.google.com')
+        self.assertEqual(site.id, self.site.id)
+        self.assertEqual(site.rs_customer_id, '1234')
+
+        with self.assertNumQueries(0):
+            site = Site.objects.get_for_domain('www.google.com')
+            self.assertFalse(site.anonymous_allowed)
+
+    def test_get_for_domain_unknown_domain_fails(self):
+        with self.assertRaises(Site.DoesNotExist):
+            Site.objects.get_for_domain('www.example.com')
+
+        with self.assertRaises(Site.DoesNotExist):
+            Site.objects.get_for_domain(None)
+
+    def test_saving_site_invalidates_cached_site(self):
+        Site.objects.get_for_domain('www.google.com')
+
+        self.site.anonymous_allowed = True
+        self.site.save()
+
+        self.assertTrue(
+            Site.objects.get_for_domain('www.google.com').anonymous_allowed)
+
+    def test_changing_domain_invalidates_old_domain(self):
+        Site.objects.get_for_domain('www.google.com')
+
+        self.site.domain = 'www.example.com'
+        self.site.save()
+
+        with self.assertRaises(Site.DoesNotExist):
+            Site.objects.get_for_domain('www.google.com')
+        self.assertEqual(
+            Site.objects.get_for_domain('www.example.com').id, self.site.id)
+
+    def test_deleting_site_invalidates_cached_site(self):
+        Site.objects.get_for_domain('www.google.com')
+
+        self.site.delete()
+
+        with self.assertRaises(Site.DoesNotExist):
+            Site.objects.get_for_domain('www.google.com')
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_get_for_domain_uses_shared_cache(self):
+        cache.clear()
+        Site.objects.get_for_domain('www.google.com')
+        local_sites.clear()
+
+        with self.assertNumQueries(0):
+            site = Site.objects.get_for_domain('www.google.com')
+        self.assertEqual(site.id, self.site.id)
+
+    @override_settings(CACHES=LOCMEM_CACHES, SITE_CACHE_TIMEOUT=3600,
+                       SITE_LOCAL_CACHE_TIMEOUT=10)
+    def test_site_cache_timeout_is_capped_for_process_local_cache(self):
+        self.assertEqual(get_site_cache_timeout(), 10)
 
-class SiteTestCase(TestCase):
-    pass
+        with self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        }}):
+            self.assertEqual(get_site_cache_timeout(), 3600)
 
 class SiteFormTestCase(TestCase):
 
@@ -0,0 +1,129 @@
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from django.utils.six import StringIO
+
+from base import BaseTestCase
+from cache import LOCMEM_CACHES
+
+from unittest import skipIf
+import shutil
+import tempfile
+import time
+
+from comments.spellcheck import (
+    LRUCache, SpellcheckPool, check, enchant, get_dictionary, get_metrics, wait
+)
+
+
+class LRUCacheTestCase(BaseTestCase):
+
+    def test_least_recently_used_items_are_discarded(self):
+        cache = LRUCache(2)
+        cache.set('quack', 1)
+        cache.set('woo-hoo', 2)
+        cache.get('quack')
+        cache.set('yabba', 3)
+
+        self.assertEqual(cache.get('quack'), 1)
+        self.assertEqual(cache.get('woo-hoo'), None)
+        self.assertEqual(cache.get('yabba'), 3)
+
+
+@skipIf(enchant is None, 'enchant is not installed')
+@override_settings(LANGUAGE_CODE='en_US')
+class DictionaryTestCase(BaseTestCase):
+
+    def test_dictionary_is_loaded_once(self):
+        self.assertTrue(get_dictionary() is get_dictionary())
+
+    def test_check_returns_incorrect_words_with_suggestions(self):
+        data, complete = check('Helo world, Helo')
+
+        self.assertTrue(complete)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['word'], 'Helo')
+        self.assertTrue('Hello' in data[0]['suggestions'])
+
+    def test_suggestions_are_cached(self):
+        dictionary = get_dictionary()
+        suggestions = dictionary.suggest('helo')
+
+        self.assertTrue(dictionary.suggestions.get('helo') is suggestions)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SpellcheckPoolTestCase(BaseTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_task_which_doesnt_finish_in_time_returns_none(self):
+        pool = SpellcheckPool(1, 10)
+        try:
+            task = pool.submit(time.sleep, 1)
+            self.assertEqual(wait(task, time.time() + 0.1), None)
+
+            task = pool.submit(abs, -1)
+            self.assertEqual(wait(task, time.time() + 5), 1)
+        finally:
+            pool.close()
+
+        self.assertEqual(get_metrics()['timeouts'], 1)
+
+    def test_tasks_over_queue_size_are_rejected(self):
+        pool = SpellcheckPool(1, 1)
+        try:
+            self.assertFalse(pool.submit(time.sleep, 0.5) is None)
+            self.assertEqual(pool.submit(abs, -1), None)
+        finally:
+            pool.close()
+
+        self.assertEqual(get_metrics()['rejected'], 1)
+
+    def test_metrics_count_finished_and_failed_tasks(self):
+        pool = SpellcheckPool(0, 10)
+        self.assertEqual(wait(pool.submit(abs, -1), time.time()), 1)
+        self.assertEqual(wait(pool.submit(int, 'quack'), time.time()), None)
+
+        metrics = get_metrics()
+        self.assertEqual(metrics['tasks'], 2)
+        self.assertEqual(metrics['failures'], 1)
+        self.assertEqual(metrics['timeouts'], 0)
+        self.assertEqual(metrics['queued'], 0)
+        self.assertEqual(pool.pending, 0)
+
+    def test_metrics_command_requires_shared_cache(self):
+        with self.assertRaises(CommandError):
+            call_command('spellcheck_metrics', stdout=StringIO())
+
+    def test_metrics_command_shows_metrics(self):
+        location = tempfile.mkdtemp()
+        try:
+            with self.settings(CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                pool = SpellcheckPool(0, 10)
+                wait(pool.submit(abs, -1), time.time())
+
+                out = StringIO()
+                call_command('spellcheck_metrics', stdout=out)
+        finally:
+            shutil.rmtree(location)
+
+        self.assertTrue("Finished tasks: 1" in out.getvalue())
+        self.assertTrue("Failed tasks: 0" in out.getvalue())
+
+
+class SpellcheckViewTestCase(BaseTestCase):
+
+    @override_settings(SPELLCHECK_ENABLED=False)
+    def test_spellcheck_text_if_spellcheck_disabled_fails(self):
+        r = self.client.post(
+            reverse('comments:spellcheck_text'), data={'text': 'helo'})
+
+        data = self.get_data_from_response(r.content)
+        self.assertEqual(data['status_code'], 400)
@@ -1,10 +1,16 @@
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.test import override_settings
 from django.contrib.auth.models import AnonymousUser
 
 from base import BaseTestCase
+from cache import LOCMEM_CACHES
 
-from comments.models import Thread, CustomUser, Site
+from comments.models import (
+    Comment, Thread, CustomUser, Site, UserSiteActivity
+)
 
 
 class ThreadTestCase(BaseTestCase):
@@ -24,6 +30,30 @@ class ThreadTestCase(BaseTestCase):
         thread = threads[0]
         self.assertEqual(thread.site, self.site)
 
+    def test_get_or_create_for_url_creates_thread(self):
+        titles = {'selector_title': '', 'page_title': 'Duck', 'h1_title': ''}
+
+        thread, created = Thread.objects.get_or_create_for_url(
+            self.site, 'url', titles)
+
+        self.assertTrue(created)
+        thread = Thread.objects.get(id=thread.id)
+        self.assertEqual(thread.url, 'url')
+        self.assertEqual(thread.titles, titles)
+        self.assertTrue(thread.allow_comments)
+        self.assertEqual(thread.version, 0)
+
+    def test_get_or_create_for_url_returns_existing_thread(self):
+        existing = Thread.objects.create(site=self.site, url='url')
+
+        with self.assertNumQueries(1):
+            thread, created = Thread.objects.get_or_create_for_url(
+                self.site, 'url', {})
+
+        self.assertFalse(created)
+        self.assertEqual(thread.id, existing.id)
+        self.assertEqual(Thread.objects.count(), 1)
+
     def test_likes_count_property(self):
         thread = Thread.objects.create(site=self.site)
         thread.liked_by_count += 1
@@ -165,6 +195,80 @@ class ThreadTestCase(BaseTestCase):
         self.assertEqual(thread.title, "donald/duck")
 
 
+class ThreadCommentStatsTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create()
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.user = CustomUser.objects.create_user(
+            email='donald@duck.com',
+            password='pass'
+        )
+
+    def assertStats(self, comment_count, hidden_count, last_comment_at):
+        thread = Thread.objects.get(id=self.thread.id)
+        self.assertEqual(
+            (thread.comment_count, thread.hidden_count,
+             thread.last_comment_at),
+            (comment_count, hidden_count, last_comment_at)
+        )
+
+    def test_new_comments_are_added_to_stats(self):
+        Comment.objects.create(thread=self.thread, text='quack!')
+        second = Comment.objects.create(
+            thread=self.thread, text='woo-hoo!', hidden=True)
+
+        self.assertStats(2, 1, second.created)
+
+    def test_failed_stats_update_rolls_back_comment(self):
+        def fail(comment):
+            raise ValueError
+
+        activity = UserSiteActivity.objects
+        activity.add_comment = fail
+        try:
+            with self.assertRaises(ValueError):
+                Comment.objects.create(thread=self.thread, user=self.user)
+        finally:
+            del activity.add_comment
+
+        self.assertFalse(Comment.objects.exists())
+        self.assertStats(0, 0, None)
+
+    def test_hiding_comments_updates_stats(self):
+        comment = Comment.objects.create(thread=self.thread, text='quack!')
+
+        comment.hide()
+        self.assertStats(1, 1, comment.created)
+        comment.hide()
+        self.assertStats(1, 1, comment.created)
+        comment.unhide()
+        self.assertStats(1, 0, comment.created)
+
+        Comment.objects.bulk_set_hidden([comment.id], True)
+        self.assertStats(1, 1, comment.created)
+
+    def test_deleting_comments_updates_stats(self):
+        first = Comment.objects.create(thread=self.thread, text='quack!')
+        second = Comment.objects.create(
+            thread=self.thread, user=self.user, text='woo-hoo!')
+
+        second.delete(CustomUser(is_staff=True))
+        self.assertStats(1, 0, first.created)
+
+        Comment.objects.bulk_delete([first.id])
+        self.assertStats(0, 0, None)
+
+    def test_deleting_users_updates_stats(self):
+        comment = Comment.objects.create(thread=self.thread, text='quack!')
+        Comment.objects.create(
+            thread=self.thread, user=self.user, text='woo-hoo!')
+
+        CustomUser.objects.bulk_delete([self.user.id])
+
+        self.assertStats(1, 0, comment.created)
+
+
 class LikeThreadEndpointTestCase(BaseTestCase):
 
     def setUp(self):
@@ -485,6 +589,44 @@ class GetThreadInfoTestCase(BaseTestCase):
 
         self.assertEqual(r.status_code, 200)
 
+    def test_get_thread_info_saves_only_changed_titles(self):
+        url = reverse('comments:thread_info')
+        data = {
+            "domain": self.test_site.domain,
+            "thread": self.test_thread.url,
+            "page_title": "Donald Duck",
+        }
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, data=data)
+        self.assertTrue(any(
+            query['sql'].startswith('UPDATE "c4all_comments_thread"')
+            for query in queries))
+        self.assertEqual(
+            Thread.objects.get(id=self.test_thread.id).title, "Donald Duck")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, data=data)
+        self.assertFalse(any(
+            query['sql'].startswith('UPDATE "c4all_comments_thread"')
+            for query in queries))
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_get_thread_info_caches_titles_fingerprint(self):
+        cache.clear()
+        url = reverse('comments:thread_info')
+        data = {
+            "domain": self.test_site.domain,
+            "thread": self.test_thread.url,
+            "page_title": "Donald Duck",
+        }
+        self.client.get(url, data=data)
+
+        # thread without titles (anonymous session isn't kept in DB)
+        with self.assertNumQueries(1):
+            r = self.client.get(url, data=data)
+        self.assertEqual(r.status_code, 200)
+
     def test_get_thread_info_if_site_not_registered_fails(self):
         r = self.client.get(
             reverse('comments:thread_info'),
@@ -0,0 +1,119 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.urlresolvers import reverse
+from django.test import RequestFactory, override_settings
+
+from base import BaseTestCase
+
+from comments.models import Comment, CustomUser, Site, Thread
+from comments.user_state import SESSION_KEY, UserThreadState, limit_ids
+
+
+class UserThreadStateTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.other_thread = Thread.objects.create(site=self.site, url='other')
+        self.user = CustomUser.objects.create_user(
+            email='donald@duck.com',
+            password='pass'
+        )
+
+    def get_request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        request.session = {}
+        return request
+
+    def like_thread(self, thread):
+        self.client.post(
+            reverse('comments:like_thread', kwargs={'thread_id': thread.id})
+        )
+
+    def test_state_of_logged_in_user_is_loaded_for_thread(self):
+        comment = Comment.objects.create(
+            thread=self.thread, user=self.user, text='quack!')
+        other_comment = Comment.objects.create(
+            thread=self.other_thread, user=self.user, text='woo-hoo!')
+        comment.like(self.user)
+        other_comment.dislike(self.user)
+
+        state = UserThreadState(self.get_request(self.user), self.thread.id)
+
+        with self.assertNumQueries(3):
+            overlay = state.get_overlay()
+        self.assertEqual(overlay['posted_comments'], [comment.id])
+        self.assertEqual(overlay['liked_comments'], [comment.id])
+        self.assertEqual(overlay['disliked_comments'], [])
+
+    def test_state_of_logged_in_user_is_not_saved_in_session(self):
+        request = self.get_request(self.user)
+
+        UserThreadState(request, self.thread.id).add('liked_threads', 1)
+
+        self.assertEqual(request.session, {})
+
+    def test_anonymous_state_is_kept_in_session_per_thread(self):
+        self.like_thread(self.thread)
+
+        self.assertEqual(self.get_session()[SESSION_KEY], [
+            [self.thread.id, {'liked_threads': [self.thread.id]}]
+        ])
+
+        self.client.post(reverse(
+            'comments:dislike_thread', kwargs={'thread_id': self.thread.id}
+        ))
+        self.assertEqual(self.get_session()[SESSION_KEY], [
+            [self.thread.id, {'disliked_threads': [self.thread.id]}]
+        ])
+
+    @override_settings(SESSION_THREADS_LIMIT=2)
+    def test_anonymous_state_is_kept_for_limited_number_of_threads(self):
+        third_thread = Thread.objects.create(site=self.site, url='third')
+        for thread in (self.thread, self.other_thread, third_thread):
+            self.like_thread(thread)
+
+        self.assertEqual(
+            [entry[0] for entry in self.get_session()[SESSION_KEY]],
+            [self.other_thread.id, third_thread.id]
+        )
+
+    @override_settings(SESSION_STATE_IDS_LIMIT=2)
+    def test_anonymous_state_is_kept_for_limited_number_of_ids(self):
+        self.like_thread(self.other_thread)
+        self.like_thread(self.thread)
+        self.assertEqual(len(self.get_session()[SESSION_KEY]), 2)
+
+        request = self.get_request(AnonymousUser())
+        request.session = self.get_session()
+        UserThreadState(request, self.thread.id).add('posted_comments', 1)
+
+        self.assertEqual(request.session[SESSION_KEY], [
+            [self.thread.id, {
+                'liked_threads': [self.thread.id],
+                'posted_comments': [1],
+            }]
+        ])
+
+    def test_oldest_ids_of_thread_over_limit_are_dropped(self):
+        entries = limit_ids([
+            [1, {'liked_comments': [1, 2, 3], 'posted_comments': [4, 5]}],
+        ], 2)
+
+        self.assertEqual(entries, [
+            [1, {'liked_comments': [3], 'posted_comments': [5]}],
+        ])
+
+    def test_login_doesnt_copy_user_data_to_session(self):
+        comment = Comment.objects.create(
+            thread=self.thread, user=self.user, text='quack!')
+        comment.like(self.user)
+
+        self.client.post(reverse('comments:login_user'), data={
+            'site_id': self.site.id,
+            'email': 'donald@duck.com',
+            'password': 'pass',
+        })
+
+        self.assertFalse('liked_comments' in self.get_session())
+        self.assertFalse('posted_comments' in self.get_session())
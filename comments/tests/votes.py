@@ -0,0 +1,187 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from django.utils.six import StringIO
+
+from base import BaseTestCase
+from cache import LOCMEM_CACHES
+
+import json
+import time
+
+from comments import votes
+from comments.checks import check_vote_buffer_cache
+from comments.models import Comment, Site, Thread
+from comments.votes import (
+    CHECKPOINT_KEY, SLOT_GRACE_PERIOD, buffer_vote, flush_votes,
+    get_counter_key, get_registered_key, get_slot_key, merge_buffered_votes
+)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VOTE_BUFFER_ENABLED=True)
+class VoteBufferTestCase(BaseTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.site = Site.objects.create(domain='www.google.com')
+        self.thread = Thread.objects.create(site=self.site, url='url')
+        self.comment = Comment.objects.create(
+            thread=self.thread, poster_name='Donald Duck', text='quack!')
+        self.user = AnonymousUser()
+
+    def get_comment(self):
+        return Comment.objects.get(id=self.comment.id)
+
+    def test_anonymous_votes_are_buffered_until_flush(self):
+        self.comment.like(self.user)
+        Comment.objects.get(id=self.comment.id).like(self.user)
+        self.thread.dislike(self.user)
+
+        self.assertEqual(self.comment.likes_count, 1)
+        self.assertEqual(self.get_comment().liked_by_count, 0)
+        self.assertEqual(
+            Thread.objects.get(id=self.thread.id).disliked_by_count, 0)
+
+        self.assertEqual(flush_votes(), 2)
+        self.assertEqual(self.get_comment().liked_by_count, 2)
+        self.assertEqual(
+            Thread.objects.get(id=self.thread.id).disliked_by_count, 1)
+
+        # buffer is empty after flush
+        self.assertEqual(flush_votes(), 0)
+        self.assertEqual(self.get_comment().liked_by_count, 2)
+
+    def test_buffered_votes_are_merged_into_loaded_counts(self):
+        self.comment.like(self.user)
+        self.comment.like(self.user)
+        self.comment.dislike(self.user)
+
+        comment = self.get_comment()
+        merge_buffered_votes([comment])
+        self.assertEqual(comment.likes_count, 2)
+        self.assertEqual(comment.dislikes_count, 1)
+
+        comments, next, counts = Comment.objects.for_widget(
+            self.thread, self.site)
+        self.assertEqual(comments[0].likes_count, 2)
+
+    def test_opposite_votes_cancel_out(self):
+        self.comment.like(self.user)
+        self.comment.undo_like(self.user)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(flush_votes(), 0)
+
+    def test_flushed_counters_dont_drop_below_zero(self):
+        buffer_vote(self.comment, 'liked_by_count', -1)
+        flush_votes()
+
+        self.assertEqual(self.get_comment().liked_by_count, 0)
+
+    def test_flush_bumps_version_of_voted_comment_threads(self):
+        version = Thread.objects.get(id=self.thread.id).version
+        updated = self.get_comment().updated
+
+        self.comment.like(self.user)
+        self.assertEqual(
+            Thread.objects.get(id=self.thread.id).version, version)
+
+        flush_votes()
+        self.assertEqual(
+            Thread.objects.get(id=self.thread.id).version, version + 1)
+        self.assertTrue(self.get_comment().updated > updated)
+
+    def test_votes_are_not_flushed_by_voting(self):
+        with self.assertNumQueries(0):
+            buffer_vote(self.comment, 'liked_by_count', 1)
+
+        self.assertEqual(self.get_comment().liked_by_count, 0)
+
+    def test_missing_slot_is_skipped_after_grace_period(self):
+        other = Comment.objects.create(
+            thread=self.thread, poster_name='Daisy Duck', text='quack?')
+        third = Comment.objects.create(
+            thread=self.thread, poster_name='Huey Duck', text='quack!!')
+        self.comment.like(self.user)
+        other.like(self.user)
+        third.like(self.user)
+        # slot of the second vote is evicted from cache
+        cache.delete(get_slot_key(2))
+
+        self.assertEqual(flush_votes(), 1)
+        self.assertEqual(self.get_comment().liked_by_count, 1)
+        # slot may still be set by the process which claimed it
+        self.assertEqual(flush_votes(), 0)
+        self.assertEqual(Comment.objects.get(id=third.id).liked_by_count, 0)
+
+        last, checkpoint = cache.get(CHECKPOINT_KEY)
+        cache.set(CHECKPOINT_KEY, (last, time.time() - SLOT_GRACE_PERIOD))
+
+        self.assertEqual(flush_votes(), 1)
+        self.assertEqual(Comment.objects.get(id=third.id).liked_by_count, 1)
+        self.assertEqual(Comment.objects.get(id=other.id).liked_by_count, 0)
+
+        # counter of the lost slot is registered again by the next vote
+        # after grace period
+        cache.delete(get_registered_key(
+            get_counter_key(other, 'liked_by_count', 'add')))
+        other.like(self.user)
+        self.assertEqual(flush_votes(), 1)
+        self.assertEqual(Comment.objects.get(id=other.id).liked_by_count, 2)
+
+    def test_like_comment_returns_buffered_votes(self):
+        self.comment.like(self.user)
+
+        r = self.client.post(reverse(
+            'comments:like_comment',
+            kwargs={'comment_id': self.comment.id}
+        ), data={'domain': self.site.domain, 'compact': 1})
+        data = self.get_data_from_response(r.content)
+        resp_data = json.loads(data['resp_data'])
+
+        self.assertEqual(resp_data['comment']['likes'], 2)
+        self.assertEqual(self.get_comment().liked_by_count, 0)
+
+    def test_flush_votes_command(self):
+        self.comment.like(self.user)
+
+        call_command('flush_votes', once=True, stdout=StringIO())
+
+        self.assertEqual(self.get_comment().liked_by_count, 1)
+
+    @override_settings(VOTE_BUFFER_ENABLED=False)
+    def test_votes_are_saved_directly_if_buffer_is_disabled(self):
+        self.comment.like(self.user)
+
+        self.assertEqual(self.get_comment().liked_by_count, 1)
+
+    def test_votes_stay_buffered_if_saving_fails(self):
+        def fail(deltas):
+            raise ValueError
+
+        self.comment.like(self.user)
+        save_deltas = votes.save_deltas
+        votes.save_deltas = fail
+        try:
+            with self.assertRaises(ValueError):
+                flush_votes()
+        finally:
+            votes.save_deltas = save_deltas
+
+        self.assertEqual(self.get_comment().liked_by_count, 0)
+        self.assertEqual(flush_votes(), 1)
+        self.assertEqual(self.get_comment().liked_by_count, 1)
+
+    def test_check_accepts_shared_cache(self):
+        with self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        }}):
+            self.assertEqual(check_vote_buffer_cache(None), [])
+
+    def test_check_rejects_process_local_cache(self):
+        errors = check_vote_buffer_cache(None)
+
+        self.assertEqual([error.id for error in errors], ['c4all.E001'])
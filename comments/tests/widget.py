@@ -0,0 +1,122 @@
+from django.core.urlresolvers import reverse
+
+from base import BaseTestCase
+
+import json
+
+from comments.deletion import delete_objects
+from comments.models import Comment, CustomUser, Site, Thread, local_sites
+
+
+class GetWidgetEndpointTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.test_site = Site.objects.create(
+            domain='testdomain.com',
+        )
+        self.test_thread = Thread.objects.create(
+            site=self.test_site,
+            url='test_url'
+        )
+        Comment.objects.create(
+            poster_name='Donald Duck',
+            thread=self.test_thread,
+            text='test text 1'
+        )
+
+        self.endpoint_url = reverse('comments:widget')
+
+    def test_get_widget_returns_thread_info_and_html(self):
+        r = self.client.get(self.endpoint_url, data={
+            'domain': self.test_site.domain,
+            'thread': self.test_thread.url,
+        })
+
+        self.assertEqual(r.status_code, 200)
+        resp = json.loads(r.content)
+        self.assertEqual(resp['thread_id'], self.test_thread.id)
+        self.assertTrue(resp['comments_enabled'])
+        self.assertTrue('spellcheck_enabled' in resp)
+        self.assertTrue('spellcheck_localization' in resp)
+        self.assertFalse(resp['stream_enabled'])
+        self.assertEqual(resp['poll_interval'], 30)
+
+        html = resp['html']
+        self.assertTrue('test text 1' in html['comments_container'])
+        self.assertNotEqual(html['comments_header'], "")
+        self.assertNotEqual(html['comments_footer'], "")
+
+    def test_get_widget_creates_thread_if_it_does_not_exist(self):
+        r = self.client.get(self.endpoint_url, data={
+            'domain': self.test_site.domain,
+            'thread': 'donald/duck',
+            'page_title': 'Donald Duck',
+        })
+
+        self.assertEqual(r.status_code, 200)
+        resp = json.loads(r.content)
+        thread = Thread.objects.get(site=self.test_site, url='donald/duck')
+        self.assertEqual(resp['thread_id'], thread.id)
+        self.assertEqual(thread.title, 'Donald Duck')
+
+    def test_get_widget_comments_disabled_returns_no_html(self):
+        self.test_thread.allow_comments = False
+        self.test_thread.save()
+
+        r = self.client.get(self.endpoint_url, data={
+            'domain': self.test_site.domain,
+            'thread': self.test_thread.url,
+        })
+
+        self.assertEqual(r.status_code, 200)
+        resp = json.loads(r.content)
+        self.assertFalse(resp['comments_enabled'])
+        self.assertEqual(resp['html'], {})
+
+    def test_get_widget_hidden_user_gets_no_comments(self):
+        user = CustomUser.objects.create_user("a@b.com", "pass")
+        user.hidden.add(self.test_site)
+        self.client.login(email="a@b.com", password="pass")
+
+        r = self.client.get(self.endpoint_url, data={
+            'domain': self.test_site.domain,
+            'thread': self.test_thread.url,
+        })
+
+        self.assertEqual(r.status_code, 200)
+        html = json.loads(r.content)['html']
+        self.assertFalse('comments_container' in html)
+        self.assertTrue('comments_footer' in html)
+
+    def test_get_widget_jsonp_response(self):
+        r = self.client.get(self.endpoint_url, data={
+            'domain': self.test_site.domain,
+            'thread': self.test_thread.url,
+            'callback': 'donald',
+        })
+
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.content.startswith('donald('))
+
+    def test_get_widget_if_site_not_registered_fails(self):
+        r = self.client.get(self.endpoint_url, data={
+            'domain': 'unregistereddomain.com',
+            'thread': 'donald/duck',
+        })
+
+        self.assertEqual(r.status_code, 400)
+
+    def test_get_widget_of_deleted_cached_site_is_not_found(self):
+        Site.objects.get_for_domain(self.test_site.domain)
+        # deleted by other process, so it's still cached in this one
+        Comment.objects.all().delete()
+        Thread.objects.all().delete()
+        delete_objects(Site, [self.test_site.id])
+
+        r = self.client.get(self.endpoint_url, data={
+            'domain': self.test_site.domain,
+            'thread': 'donald/duck',
+        })
+
+        self.assertEqual(r.status_code, 404)
+        self.assertFalse(self.test_site.domain in local_sites)
@@ -16,14 +16,19 @@ urlpatterns = [
     url(r'^comment/(?P<comment_id>\d+)/hide', hide_comment, name='hide_comment'),
     url(r'^comment/(?P<comment_id>\d+)/unhide', unhide_comment, name='unhide_comment'),
     url(r'^comments$', get_comments, name='get_comments'),
+    url(r'^comments/changes$', comment_changes, name='comment_changes'),
+    url(r'^comments/stream$', comment_stream, name='comment_stream'),
     url(r'^thread_info$', thread_info, name='thread_info'),
+    url(r'^widget$', widget, name='widget'),
     url(r'^thread/(?P<thread_id>\d+)/like$', like_thread, name='like_thread'),
     url(r'^thread/(?P<thread_id>\d+)/dislike$', dislike_thread, name='dislike_thread'),
     url(r'^header', get_header, name='get_header'),
     url(r'^footer', get_footer, name='get_footer'),
     url(r'^spellcheck/incorrect_words$', incorrect_words, name='incorrect_words'),
     url(r'^spellcheck/suggestions$', spellcheck_suggestions, name='spellcheck_suggestions'),
+    url(r'^spellcheck/check$', spellcheck_text, name='spellcheck_text'),
     url(r'^comment_count$', comment_count, name='comment_count'),
+    url(r'^comment_counts$', comment_counts, name='comment_counts'),
 
     # test url
     url(r'^testpage$', login_required(TemplateView.as_view(template_name='usertest-example.html')), name="testpage"),
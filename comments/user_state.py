@@ -0,0 +1,139 @@
+"""
+Votes and comments of the current user in a thread, used to mark them in the
+widget. State of logged in users is loaded from DB on demand (only for the
+current thread), state of anonymous users is kept in session for at most
+SESSION_THREADS_LIMIT most recently voted (or commented) threads and
+SESSION_STATE_IDS_LIMIT ids in total, so sessions don't grow with user
+activity.
+"""
+from django.conf import settings
+
+from models import Comment
+
+
+STATE_KEYS = (
+    'liked_comments',
+    'disliked_comments',
+    'posted_comments',
+    'liked_threads',
+    'disliked_threads',
+)
+
+# session key of anonymous users' state, list of [thread id, state] pairs
+# ordered from the least recently changed
+SESSION_KEY = 'threads_state'
+
+
+def count_ids(entry):
+    return sum(len(ids) for ids in entry[1].values())
+
+
+def limit_ids(entries, limit):
+    """
+    Drops state of the least recently changed threads until entries have at
+    most limit ids. If the most recent thread alone has more ids, the oldest
+    (lowest) ids of each of its sets are dropped.
+    """
+    count = sum(count_ids(entry) for entry in entries)
+    while len(entries) > 1 and count > limit:
+        count -= count_ids(entries.pop(0))
+
+    if count > limit:
+        thread_id, state = entries[0]
+        size = max(limit // len(state), 1)
+        entries[0] = [thread_id, dict(
+            (key, ids[-size:]) for key, ids in state.items())]
+
+    return entries
+
+
+class UserThreadState(object):
+    """
+    Sets of ids of comments liked, disliked and posted by user in thread and
+    of the thread itself if user liked/disliked it. Changes are saved to
+    session only for anonymous users, votes and comments of logged in users
+    are saved in DB by models.
+    """
+
+    def __init__(self, request, thread_id):
+        self.request = request
+        self.thread_id = thread_id
+        self.user = request.user
+        self.sets = {}
+
+        if self.user.is_anonymous():
+            entry = self.get_session_entry()
+            state = entry[1] if entry else {}
+            for key in STATE_KEYS:
+                self.sets[key] = set(state.get(key, ()))
+
+    def get_session_entry(self):
+        for entry in self.request.session.get(SESSION_KEY, []):
+            if entry[0] == self.thread_id:
+                return entry
+        return None
+
+    def load(self, key):
+        user = self.user
+        if key == 'posted_comments':
+            ids = Comment.objects.filter(user=user, thread_id=self.thread_id)
+        elif key.endswith('_comments'):
+            ids = getattr(user, key).filter(thread_id=self.thread_id)
+        else:
+            ids = getattr(user, key).filter(id=self.thread_id)
+
+        return set(ids.values_list('id', flat=True))
+
+    def get(self, key):
+        if key not in self.sets:
+            self.sets[key] = self.load(key)
+        return self.sets[key]
+
+    def add(self, key, value):
+        # sets of logged in users which weren't loaded yet will be loaded
+        # with the change from DB
+        if key in self.sets:
+            self.sets[key].add(value)
+        self.save()
+
+    def remove(self, key, value):
+        if key in self.sets:
+            self.sets[key].discard(value)
+        self.save()
+
+    def save(self):
+        if not self.user.is_anonymous():
+            return
+
+        state = dict(
+            (key, sorted(values))
+            for key, values in self.sets.items() if values
+        )
+        entries = [
+            entry for entry in self.request.session.get(SESSION_KEY, [])
+            if entry[0] != self.thread_id
+        ]
+        if state:
+            entries.append([self.thread_id, state])
+
+        self.request.session[SESSION_KEY] = limit_ids(
+            entries[-settings.SESSION_THREADS_LIMIT:],
+            settings.SESSION_STATE_IDS_LIMIT)
+
+    def get_overlay(self):
+        """
+        Returns state of rendered comments (user's own comments and votes)
+        which the widget applies on top of comments HTML.
+        """
+        posted_comments = self.get('posted_comments')
+        last_posted_comment_id = self.request.session.get(
+            'last_posted_comment_id')
+        if last_posted_comment_id not in posted_comments:
+            last_posted_comment_id = None
+
+        return {
+            'posted_comments': sorted(posted_comments),
+            'last_posted_comment_id': last_posted_comment_id,
+            'liked_comments': sorted(self.get('liked_comments')),
+            'disliked_comments': sorted(self.get('disliked_comments')),
+        }
@@ -0,0 +1,16 @@
+from django.conf import settings
+
+# cache backends which keep their data in memory of each process (or don't
+# keep it at all)
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def is_cache_shared(alias='default'):
+    """
+    Returns True if cache with given alias is shared by all processes (e.g.
+    memcached or redis), so values set by one process are seen by others.
+    """
+    return settings.CACHES[alias]['BACKEND'] not in LOCAL_CACHE_BACKENDS
@@ -1,12 +1,17 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.http import (HttpResponseBadRequest, HttpResponseNotFound,
     HttpResponseForbidden)
 from django.contrib.auth import authenticate, login, logout
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render
-from django.utils.translation import ugettext as _
+from django.utils import timezone
+from django.utils.translation import ugettext as _, get_language
 from django.conf import settings
+from django.core.cache import cache
 
+from calendar import timegm
+from datetime import datetime, timedelta
+import hashlib
 import json
 import random
 
@@ -16,35 +21,366 @@ from django.views.decorators.http import require_GET
 from utils.spellcheck_localization import SPELLCHECK_LOCALIZATION
 
 from forms import (
+    CommentChangesForm,
     CustomUserCreationForm,
     GetRequestValidationForm,
     PostCommentForm,
     RegularUserLoginForm,
 )
 from models import Site, Thread, Comment
-from decorators import json_response, cross_domain_post_response, host_check
+from pubsub import get_pubsub, get_thread_channel
+from votes import merge_buffered_votes
+from user_state import UserThreadState
+import spellcheck
+from decorators import (
+    json_response, cross_domain_post_response, host_check,
+    conditional_response
+)
 
-try:
-    import enchant
-    from enchant.checker import SpellChecker
-except ImportError:
+if spellcheck.enchant is None:
     settings.SPELLCHECK_ENABLED = False
 
 
-def add_to_session_list(request, key, value):
-    session_data = request.session.setdefault(key, [])
-    session_data.append(value)
-    request.session[key] = session_data
-    return request.session[key]
+def get_thread_for_url(site, thread_url, titles):
+    """
+    Returns thread with given url on site (creating it if needed) and
+    updates its titles if they changed. Fingerprint of the last seen titles
+    is cached, so titles are neither loaded nor compared on most requests.
+    """
+    thread, created = Thread.objects.get_or_create_for_url(
+        site, thread_url, titles)
+
+    key = 'thread_titles:%d' % thread.id
+    fingerprint = hashlib.md5(json.dumps(titles, sort_keys=True)).hexdigest()
+    if created or cache.get(key) != fingerprint:
+        if thread.titles != titles:
+            thread.titles = titles
+            thread.save(update_fields=['titles'])
+        cache.set(key, fingerprint, settings.COMMENTS_CACHE_TIMEOUT)
+
+    return thread
+
+
+# session keys replaced by UserThreadState
+LEGACY_SESSION_KEYS = (
+    'liked_threads',
+    'disliked_threads',
+    'posted_comments',
+    'liked_comments',
+    'disliked_comments',
+)
+
+
+def init_widget_session(request):
+    """
+    Resets widget state kept in session on page load and assigns random
+    avatar to anonymous user if one is not already assigned.
+    """
+    if request.session.get('all_comments'):
+        del request.session['all_comments']
+
+    # votes used to be kept in session lists growing with user activity
+    for key in LEGACY_SESSION_KEYS:
+        request.session.pop(key, None)
+
+    # add random avatar to session if anonymous
+    avatar_num = request.session.get("user_avatar_num", None)
+
+    if not avatar_num and request.user.is_anonymous():
+        avatar_num = random.randint(
+            settings.AVATAR_NUM_MIN,
+            settings.AVATAR_NUM_MAX
+        )
+        request.session['user_avatar_num'] = avatar_num
+
+
+def get_thread_info_data(thread):
+    return {
+        "thread_id": thread.id,
+        "comments_enabled": thread.allow_comments,
+        "spellcheck_enabled": settings.SPELLCHECK_ENABLED,
+        "spellcheck_localization": SPELLCHECK_LOCALIZATION,
+        "stream_enabled": settings.COMMENTS_STREAM_ENABLED,
+        "poll_interval": settings.COMMENTS_POLL_INTERVAL
+    }
+
+
+def get_header_context(thread, state):
+    return {
+        'thread': thread,
+        'thread_liked': thread.id in state.get('liked_threads'),
+        'thread_disliked': thread.id in state.get('disliked_threads'),
+    }
+
+
+def render_header_html(request, thread):
+    merge_buffered_votes([thread])
+    state = UserThreadState(request, thread.id)
+    resp = render(request, "header.html", get_header_context(thread, state))
+    return resp.content
+
+
+def render_comments_html(request, site, thread, all_comments, site_admin,
+                         use_cache=False):
+    """
+    Renders thread comments. Rendered HTML doesn't depend on session (see
+    get_comments_overlay), so if use_cache is set, HTML rendered for users
+    who are not site admins is cached by thread version, language and
+    all_comments flag and shared between them.
+    """
+    all_comments = bool(all_comments)
+
+    cache_key = None
+    if use_cache and not site_admin:
+        cache_key = 'comments_html:%s:%s:%s:%d' % (
+            thread.id, thread.version, get_language(), all_comments)
+        html = cache.get(cache_key)
+        if html is not None:
+            return html
+
+    comments, next, counts = Comment.objects.for_widget(
+        thread, site, all=all_comments, site_admin=site_admin)
+    resp = render(
+        request,
+        "comments.html",
+        {
+            'comments': comments,
+            'next': next,
+            'comments_count': counts['total'],
+            'visible_comments_count': counts['visible'],
+            'rs_customer_id': site.rs_customer_id,
+            'all_comments': all_comments,
+            'site_admin': site_admin
+        }
+    )
+
+    if cache_key:
+        cache.set(cache_key, resp.content, settings.COMMENTS_CACHE_TIMEOUT)
+
+    return resp.content
 
 
-def remove_from_session_list(request, key, value):
-    session_data = request.session.setdefault(key, [])
-    if value in session_data:
-        session_data.remove(value)
-        request.session[key] = session_data
+def render_comments_page_html(request, site, thread, start):
+    """
+    Renders page of thread comments starting with comment with id start
+    (see CommentManager.widget_page). Returns rendered HTML and id of the
+    first comment of the next page. Like render_comments_html, pages are
+    cached by thread version.
+    """
+    cache_key = 'comments_page_html:%s:%s:%s:%s' % (
+        thread.id, thread.version, get_language(), start)
+    page = cache.get(cache_key)
+    if page is not None:
+        return page
 
-    return session_data
+    comments, next = Comment.objects.widget_page(thread, site, start)
+    resp = render(
+        request,
+        "comment_list_items.html",
+        {
+            'comments': comments,
+            'next': next,
+            'rs_customer_id': site.rs_customer_id,
+        }
+    )
+
+    page = (resp.content, next)
+    cache.set(cache_key, page, settings.COMMENTS_CACHE_TIMEOUT)
+
+    return page
+
+
+def get_comment_state(comment, state):
+    """
+    Returns compact description of comment state, so the widget can update
+    just the comment node instead of replacing all thread comments.
+    """
+    return {
+        'id': comment.id,
+        'likes': comment.likes_count,
+        'dislikes': comment.dislikes_count,
+        'hidden': comment.hidden,
+        'liked': comment.id in state.get('liked_comments'),
+        'disliked': comment.id in state.get('disliked_comments'),
+    }
+
+
+def comment_feedback_response(request, comment, site_admin, state=None):
+    """
+    Returns response of comment feedback endpoints (votes, hiding). If
+    compact parameter is set, only the state of the comment is returned,
+    otherwise all thread comments are rendered again.
+    """
+    if state is None:
+        state = UserThreadState(request, comment.thread_id)
+
+    if request.POST.get('compact'):
+        data = {'comment': get_comment_state(comment, state)}
+    else:
+        html = render_comments_html(
+            request,
+            comment.thread.site,
+            comment.thread,
+            request.session.get('all_comments', False),
+            site_admin
+        )
+        data = {
+            'placement': 'comments_container',
+            'content': html,
+            'overlay': state.get_overlay()
+        }
+
+    return HttpResponse(json.dumps(data))
+
+
+def get_changes_cursor():
+    """
+    Returns cursor for comment_changes endpoint, which is the current time
+    (in microseconds since epoch) moved COMMENT_CHANGES_OVERLAP seconds back,
+    so changes committed by concurrent requests are not missed. Changes are
+    idempotent, so receiving some of them twice doesn't matter.
+    """
+    since = timezone.now() - timedelta(
+        seconds=settings.COMMENT_CHANGES_OVERLAP)
+    return timegm(since.utctimetuple()) * 10 ** 6 + since.microsecond
+
+
+def get_cursor_time(cursor):
+    return datetime(1970, 1, 1, tzinfo=timezone.utc) + \
+        timedelta(microseconds=cursor)
+
+
+def get_comments_overlay(request, thread_id):
+    """
+    Returns state of rendered comments of thread (user's own comments and
+    votes) which the widget applies on top of comments HTML.
+    """
+    return UserThreadState(request, thread_id).get_overlay()
+
+
+def render_footer_html(request, site):
+    resp = render(
+        request,
+        "footer.html", {
+            'user': request.user,
+            'site': site,
+            'avatars': range(1, 29),
+            'user_avatar_num': request.session.get('user_avatar_num', 6),
+            'rs_customer_id': site.rs_customer_id,
+        }
+    )
+    return resp.content
+
+
+def get_thread_urls_key(thread_urls):
+    thread_urls = sorted(set(thread_urls))
+    return hashlib.md5(u'\n'.join(thread_urls).encode('utf-8')).hexdigest()
+
+
+def get_widget_thread_values(request, *fields):
+    """
+    Returns given field values of thread requested by anonymous user through
+    one of widget GET endpoints (see GetRequestValidationForm) or None if
+    request is not valid, thread doesn't exist or user is logged in.
+    """
+    if not request.user.is_anonymous():
+        return None
+
+    form = GetRequestValidationForm(request.GET)
+    if not form.is_valid():
+        return None
+
+    try:
+        site = Site.objects.get_for_domain(form.cleaned_data['domain'])
+    except Site.DoesNotExist:
+        return None
+
+    return site.threads.filter(
+        id=form.cleaned_data['thread']
+    ).values(*fields).first()
+
+
+def comment_count_validators(request):
+    try:
+        site = Site.objects.get_for_domain(request.GET.get('domain'))
+    except Site.DoesNotExist:
+        return None
+
+    thread = site.threads.filter(
+        url=request.GET.get('thread_url')
+    ).values('id', 'version', 'modified').first()
+    if thread is None:
+        return None
+
+    return '%(id)s:%(version)s' % thread, thread['modified']
+
+
+def comment_counts_validators(request):
+    try:
+        site = Site.objects.get_for_domain(request.GET.get('domain'))
+    except Site.DoesNotExist:
+        return None
+
+    etag = '%s:%s:%s' % (
+        site.id,
+        site.comments_version,
+        get_thread_urls_key(request.GET.getlist('thread_url'))
+    )
+    return etag, None
+
+
+def comments_validators(request):
+    # requesting all comments changes session, so such requests are
+    # always handled by the view
+    if request.GET.get('all', False):
+        return None
+
+    thread = get_widget_thread_values(request, 'id', 'version', 'modified')
+    if thread is None:
+        return None
+
+    etag = '%s:%s:%s:%s:%s' % (
+        thread['id'],
+        thread['version'],
+        get_language(),
+        request.GET.get('start', ''),
+        json.dumps(get_comments_overlay(request, thread['id']), sort_keys=True)
+    )
+    return etag, thread['modified']
+
+
+def header_validators(request):
+    thread = get_widget_thread_values(
+        request, 'id', 'liked_by_count', 'liked_users_count',
+        'disliked_by_count', 'disliked_users_count')
+    if thread is None:
+        return None
+
+    state = UserThreadState(request, thread['id'])
+    etag = '%s:%s:%s:%s:%d:%d' % (
+        thread['id'],
+        thread['liked_by_count'] + thread['liked_users_count'],
+        thread['disliked_by_count'] + thread['disliked_users_count'],
+        get_language(),
+        thread['id'] in state.get('liked_threads'),
+        thread['id'] in state.get('disliked_threads')
+    )
+    return etag, None
+
+
+def footer_validators(request):
+    thread = get_widget_thread_values(
+        request, 'site_id', 'site__anonymous_allowed', 'site__rs_customer_id')
+    if thread is None:
+        return None
+
+    etag = '%s:%s:%s:%s' % (
+        thread['site_id'],
+        thread['site__anonymous_allowed'],
+        thread['site__rs_customer_id'],
+        get_language()
+    )
+    return etag, None
 
 
 @require_POST
@@ -87,10 +423,12 @@ def set_avatar_image(request):
             _('invalid avatar_num number: ') + str(avatar_num)
         )
 
-    if request.user.is_authenticated():
+    if request.user.is_authenticated() and \
+            request.user.avatar_num != avatar_num:
         u = request.user
         u.avatar_num = avatar_num
-        u.save()
+        u.save(update_fields=['avatar_num'])
+        Thread.objects.bump_version(comments__user=u)
 
     request.session['user_avatar_num'] = avatar_num
 
@@ -108,8 +446,6 @@ def login_user(request):
         )
     user = form.get_user()
     login(request, user)
-    data = user.get_user_domain_data()
-    request.session.update(data)
 
     return HttpResponse(unicode(user))
 
@@ -123,15 +459,16 @@ def comment(request):
         data = {'placement': 'comments_container', 'content': form.errors}
         return HttpResponseBadRequest(json.dumps(data))
     else:
-        site = Site.objects.get(domain=form.cleaned_data['domain'])
+        site = form.site
         if not request.user.is_anonymous():
-            if request.user.hidden.filter(id=site.id):
+            if request.user.is_hidden_on(site.id, cached=False):
                 return HttpResponseBadRequest(
                     _("User doesn't have permissions to post to this site."))
         new_comment = form.save()
 
-    posted = add_to_session_list(request, 'posted_comments', new_comment.id)
-    comments = form.cleaned_data['thread'].comments.all()
+    state = UserThreadState(request, new_comment.thread_id)
+    state.add('posted_comments', new_comment.id)
+    request.session['last_posted_comment_id'] = new_comment.id
 
     if request.user.is_anonymous():
         site_admin = False
@@ -140,21 +477,12 @@ def comment(request):
 
     request.session['all_comments'] = True
 
-    resp = render(
-        request,
-        'comments.html',
-        {
-            'comments': comments,
-            'posted_comments': posted,
-            'last_posted_comment_id': posted[-1] if posted else None,
-            'rs_customer_id': site.rs_customer_id,
-            'all_comments': request.session.get('all_comments', False),
-            'site_admin': site_admin
-        }
-    )
+    html = render_comments_html(
+        request, site, form.cleaned_data['thread'], True, site_admin)
     data = {
         'placement': 'comments_container',
-        'content': resp.content,
+        'content': html,
+        'overlay': state.get_overlay(),
         'comment_id': new_comment.id
     }
 
@@ -172,50 +500,34 @@ def like_comment(request, comment_id):
         data = {'placement': 'comments_container', 'content': str(e)}
         return HttpResponseNotFound(json.dumps(data))
 
+    merge_buffered_votes([comment])
+
     if request.user.is_anonymous():
         site_admin = False
     else:
         site_admin = bool(request.user.get_comments(comment_id))
 
     if site_admin:
-        if request.user.hidden.filter(id=comment.thread.site.id):
+        if request.user.is_hidden_on(comment.thread.site_id, cached=False):
             return HttpResponseBadRequest(
                 _('user is disabled on site with id %s') % comment.thread.site.id
             )
 
-    liked_comments = request.session.get('liked_comments', [])
-    disliked_comments = request.session.get('disliked_comments', [])
+    state = UserThreadState(request, comment.thread_id)
+    liked_comments = state.get('liked_comments')
+    disliked_comments = state.get('disliked_comments')
 
     if comment.id in disliked_comments:
         comment.undo_dislike(request.user)
-        remove_from_session_list(request, 'disliked_comments', comment.id)
+        state.remove('disliked_comments', comment.id)
         comment.like(request.user)
-        add_to_session_list(request, 'liked_comments', comment.id)
+        state.add('liked_comments', comment.id)
 
     elif comment.id not in liked_comments:
         comment.like(request.user)
-        add_to_session_list(request, 'liked_comments', comment.id)
-
-    comments = Comment.objects.filter(thread=comment.thread)
-    posted_comments = request.session.get('posted_comments', [])
-
-    site = comment.thread.site
-
-    resp = render(
-        request,
-        'comments.html',
-        {
-            'comments': comments,
-            'posted_comments': posted_comments,
-            'last_posted_comment_id': posted_comments[-1] if posted_comments else None,
-            'rs_customer_id': site.rs_customer_id,
-            'all_comments': request.session.get('all_comments', False),
-            'site_admin': site_admin,
-        }
-    )
-    data = {'placement': 'comments_container', 'content': resp.content}
+        state.add('liked_comments', comment.id)
 
-    return HttpResponse(json.dumps(data))
+    return comment_feedback_response(request, comment, site_admin, state)
 
 
 @require_POST
@@ -229,50 +541,34 @@ def dislike_comment(request, comment_id):
         data = {'placement': 'comments_container', 'content': str(e)}
         return HttpResponseNotFound(json.dumps(data))
 
+    merge_buffered_votes([comment])
+
     if request.user.is_anonymous():
         site_admin = False
     else:
         site_admin = bool(request.user.get_comments(comment_id))
 
     if site_admin:
-        if request.user.hidden.filter(id=comment.thread.site.id):
+        if request.user.is_hidden_on(comment.thread.site_id, cached=False):
             return HttpResponseBadRequest(
                 _('user is disabled on site with id %s') % comment.thread.site.id
             )
 
-    liked_comments = request.session.get('liked_comments', [])
-    disliked_comments = request.session.get('disliked_comments', [])
+    state = UserThreadState(request, comment.thread_id)
+    liked_comments = state.get('liked_comments')
+    disliked_comments = state.get('disliked_comments')
 
     if comment.id in liked_comments:
         comment.undo_like(request.user)
-        remove_from_session_list(request, 'liked_comments', comment.id)
+        state.remove('liked_comments', comment.id)
         comment.dislike(request.user)
-        add_to_session_list(request, 'disliked_comments', comment.id)
+        state.add('disliked_comments', comment.id)
 
     elif comment.id not in disliked_comments:
         comment.dislike(request.user)
-        add_to_session_list(request, 'disliked_comments', comment.id)
-
-    comments = Comment.objects.filter(thread=comment.thread)
-    posted_comments = request.session.get('posted_comments', [])
-
-    site = comment.thread.site
-
-    resp = render(
-        request,
-        'comments.html',
-        {
-            'comments': comments,
-            'posted_comments': posted_comments,
-            'last_posted_comment_id': posted_comments[-1] if posted_comments else None,
-            'rs_customer_id': site.rs_customer_id,
-            'all_comments': request.session.get('all_comments', False),
-            'site_admin': site_admin,
-        }
-    )
-    data = {'placement': 'comments_container', 'content': resp.content}
+        state.add('disliked_comments', comment.id)
 
-    return HttpResponse(json.dumps(data))
+    return comment_feedback_response(request, comment, site_admin, state)
 
 
 @require_POST
@@ -298,26 +594,7 @@ def hide_comment(request, comment_id):
 
     comment.hide()
 
-    comments = Comment.objects.filter(thread=comment.thread)
-    posted_comments = request.session.get('posted_comments', [])
-
-    site = comment.thread.site
-
-    resp = render(
-        request,
-        'comments.html',
-        {
-            'comments': comments,
-            'posted_comments': posted_comments,
-            'last_posted_comment_id': posted_comments[-1] if posted_comments else None,
-            'rs_customer_id': site.rs_customer_id,
-            'all_comments': request.session.get('all_comments', False),
-            'site_admin': site_admin,
-        }
-    )
-    data = {'placement': 'comments_container', 'content': resp.content}
-
-    return HttpResponse(json.dumps(data))
+    return comment_feedback_response(request, comment, site_admin)
 
 
 @require_POST
@@ -343,26 +620,7 @@ def unhide_comment(request, comment_id):
 
     comment.unhide()
 
-    comments = Comment.objects.filter(thread=comment.thread)
-    posted_comments = request.session.get('posted_comments', [])
-
-    site = comment.thread.site
-
-    resp = render(
-        request,
-        'comments.html',
-        {
-            'comments': comments,
-            'posted_comments': posted_comments,
-            'last_posted_comment_id': posted_comments[-1] if posted_comments else None,
-            'rs_customer_id': site.rs_customer_id,
-            'all_comments': request.session.get('all_comments', False),
-            'site_admin': site_admin,
-        }
-    )
-    data = {'placement': 'comments_container', 'content': resp.content}
-
-    return HttpResponse(json.dumps(data))
+    return comment_feedback_response(request, comment, site_admin)
 
 
 @require_POST
@@ -378,29 +636,32 @@ def like_thread(request, thread_id):
         }
         return HttpResponseNotFound(json.dumps(data))
 
+    merge_buffered_votes([thread])
+
     if not request.user.is_anonymous():
-        if request.user.hidden.filter(id=thread.site.id):
+        if request.user.is_hidden_on(thread.site_id, cached=False):
             return HttpResponseBadRequest(
                 _('user is disabled on site with id %s') % thread.site.id
             )
 
-    liked_threads = request.session.get('liked_threads', [])
-    disliked_threads = request.session.get('disliked_threads', [])
+    state = UserThreadState(request, thread.id)
+    liked_threads = state.get('liked_threads')
+    disliked_threads = state.get('disliked_threads')
 
     # if user disliked thread already, remove his dislike and add like
     if thread.id in disliked_threads:
         thread.undo_dislike(request.user)
-        remove_from_session_list(request, 'disliked_threads', thread.id)
+        state.remove('disliked_threads', thread.id)
         thread.like(request.user)
-        add_to_session_list(request, 'liked_threads', thread.id)
+        state.add('liked_threads', thread.id)
 
     elif thread.id not in liked_threads:
         # if user haven't had interaction with thread, like the thread
         thread.like(request.user)
         # save liked information to the session
-        add_to_session_list(request, 'liked_threads', thread.id)
+        state.add('liked_threads', thread.id)
 
-    resp = render(request, 'header.html', {'thread': thread})
+    resp = render(request, 'header.html', get_header_context(thread, state))
     data = {'placement': 'comments_header', 'content': resp.content}
 
     return HttpResponse(json.dumps(data))
@@ -419,28 +680,31 @@ def dislike_thread(request, thread_id):
         }
         return HttpResponseNotFound(json.dumps(data))
 
+    merge_buffered_votes([thread])
+
     if not request.user.is_anonymous():
-        if request.user.hidden.filter(id=thread.site.id):
+        if request.user.is_hidden_on(thread.site_id, cached=False):
             return HttpResponseBadRequest(
                 _('user is disabled on site with id %s') % thread.site.id
             )
-    liked_threads = request.session.get('liked_threads', [])
-    disliked_threads = request.session.get('disliked_threads', [])
+    state = UserThreadState(request, thread.id)
+    liked_threads = state.get('liked_threads')
+    disliked_threads = state.get('disliked_threads')
 
     # if user disliked thread already, remove his dislike and add like
     if thread.id in liked_threads:
         thread.undo_like(request.user)
-        remove_from_session_list(request, 'liked_threads', thread.id)
+        state.remove('liked_threads', thread.id)
         thread.dislike(request.user)
-        add_to_session_list(request, 'disliked_threads', thread.id)
+        state.add('disliked_threads', thread.id)
 
     elif thread.id not in disliked_threads:
         # if user haven't had interaction with thread, like the thread
         thread.dislike(request.user)
         # save liked information to the session
-        add_to_session_list(request, 'disliked_threads', thread.id)
+        state.add('disliked_threads', thread.id)
 
-    resp = render(request, 'header.html', {'thread': thread})
+    resp = render(request, 'header.html', get_header_context(thread, state))
     data = {'placement': 'comments_header', 'content': resp.content}
 
     return HttpResponse(json.dumps(data))
@@ -448,13 +712,14 @@ def dislike_thread(request, thread_id):
 
 @require_GET
 @csrf_exempt
+@conditional_response(comment_count_validators)
 @json_response
 def comment_count(request):
     domain = request.GET.get('domain', None)
     thread_url = request.GET.get('thread_url', None)
 
     try:
-        site = Site.objects.get(domain=domain)
+        site = Site.objects.get_for_domain(domain)
     except Site.DoesNotExist:
         return HttpResponseBadRequest(
             _('site with domain %s not found') % domain
@@ -474,6 +739,47 @@ def comment_count(request):
 
 @require_GET
 @csrf_exempt
+@conditional_response(comment_counts_validators)
+@json_response
+def comment_counts(request):
+    """
+    Batch variant of comment_count endpoint. Returns numbers of visible
+    comments of all threads given by (repeated) thread_url parameter, 0 for
+    threads which don't exist. Counts are cached per site until visibility
+    of site comments changes.
+    """
+    domain = request.GET.get('domain', None)
+    thread_urls = request.GET.getlist('thread_url')
+
+    if len(thread_urls) > settings.COMMENT_COUNTS_MAX_THREADS:
+        return HttpResponseBadRequest(
+            _('at most %s thread urls can be provided') %
+            settings.COMMENT_COUNTS_MAX_THREADS
+        )
+
+    try:
+        site = Site.objects.get_for_domain(domain)
+    except Site.DoesNotExist:
+        return HttpResponseBadRequest(
+            _('site with domain %s not found') % domain
+        )
+
+    cache_key = 'comment_counts:%s:%s:%s' % (
+        site.id, site.comments_version, get_thread_urls_key(thread_urls))
+    counts = cache.get(cache_key)
+    if counts is None:
+        counts = Comment.objects.visible_counts(site, thread_urls)
+        cache.set(cache_key, counts, settings.COMMENTS_CACHE_TIMEOUT)
+
+    return {
+        "comment_counts": dict(
+            (url, counts.get(url, 0)) for url in thread_urls)
+    }
+
+
+@require_GET
+@csrf_exempt
+@conditional_response(comments_validators)
 @json_response
 def get_comments(request):
     form = GetRequestValidationForm(request.GET)
@@ -486,9 +792,9 @@ def get_comments(request):
     thread_id = form.cleaned_data['thread']
 
     try:
-        site = Site.objects.get(domain=domain_name)
+        site = Site.objects.get_for_domain(domain_name)
         if not request.user.is_anonymous():
-            if request.user.hidden.filter(id=site.id):
+            if request.user.is_hidden_on(site.id):
                 return HttpResponseBadRequest(
                     _('user is disabled on site with id %s') % site.id
                 )
@@ -504,7 +810,17 @@ def get_comments(request):
 
     thread, created = site.threads.get_or_create(id=thread_id)
 
-    posted_comments = request.session.get('posted_comments', [])
+    start = form.cleaned_data['start']
+    if start is not None:
+        html, next = render_comments_page_html(request, site, thread, start)
+
+        return {
+            "html": html,
+            "next": next,
+            "overlay": get_comments_overlay(request, thread.id)
+        }
+
+    cursor = get_changes_cursor()
     all_comments = request.GET.get('all', False)
     if all_comments:
         request.session['all_comments'] = True
@@ -514,21 +830,142 @@ def get_comments(request):
     else:
         site_admin = request.user.is_site_admin(domain_name)
 
-    comments = thread.comments.exclude(user__hidden__in=[site]).distinct()
-    resp = render(
-        request,
-        "comments.html",
-        {
-            'comments': comments,
-            'posted_comments': posted_comments,
-            'last_posted_comment_id': posted_comments[-1] if posted_comments else None,
-            'rs_customer_id': site.rs_customer_id,
-            'all_comments': all_comments,
-            'site_admin': site_admin
-        }
+    html = render_comments_html(
+        request, site, thread, all_comments, site_admin, use_cache=True)
+
+    return {
+        "html": html,
+        "html_container_name": "comments_container",
+        "overlay": get_comments_overlay(request, thread.id),
+        "cursor": cursor
+    }
+
+
+@require_GET
+@csrf_exempt
+@json_response
+def comment_changes(request):
+    """
+    Returns changes of thread comments since cursor given by since parameter
+    (as returned by this endpoint, get_comments or widget) so the widget can
+    update rendered comments in place: HTML of new comments, vote counts and
+    hidden state of other changed comments and a new cursor. If comments were
+    deleted since the cursor, only reload flag is returned.
+    """
+    form = CommentChangesForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(
+            _('could not get comment changes, errors: %s') % form.errors
+        )
+
+    try:
+        site = Site.objects.get_for_domain(form.cleaned_data['domain'])
+        thread = site.threads.get(id=form.cleaned_data['thread'])
+    except (Site.DoesNotExist, Thread.DoesNotExist):
+        return HttpResponseBadRequest(
+            _('thread with id %s not found') % form.cleaned_data['thread']
+        )
+
+    if not request.user.is_anonymous():
+        if request.user.is_hidden_on(site.id):
+            return HttpResponseBadRequest(
+                _('user is disabled on site with id %s') % site.id
+            )
+
+    cursor = get_changes_cursor()
+    since = get_cursor_time(form.cleaned_data['since'])
+
+    if thread.comments_deleted and thread.comments_deleted >= since:
+        return {"reload": True, "cursor": cursor}
+
+    new, updated = Comment.objects.changed_since(thread, site, since)
+
+    html = ""
+    if new:
+        html = render(
+            request,
+            "comment_list_items.html",
+            {
+                'comments': new,
+                'rs_customer_id': site.rs_customer_id,
+            }
+        ).content
+
+    return {
+        "reload": False,
+        "cursor": cursor,
+        "html": html,
+        "changes": [
+            {
+                "id": comment.id,
+                "likes": comment.likes_count,
+                "dislikes": comment.dislikes_count,
+                "hidden": comment.hidden or comment.user_hidden,
+            }
+            for comment in updated
+        ],
+        "overlay": get_comments_overlay(request, thread.id)
+    }
+
+
+def comment_event_stream(thread_id):
+    """
+    Yields Server-Sent Events published for thread with given id, keepalive
+    comments when nothing is published for COMMENTS_STREAM_KEEPALIVE seconds
+    and ends after COMMENTS_STREAM_TIMEOUT seconds (clients reconnect).
+    """
+    subscription = get_pubsub().subscribe(get_thread_channel(thread_id))
+    try:
+        yield "retry: %d\n\n" % (settings.COMMENTS_STREAM_RETRY * 1000)
+
+        end = timezone.now() + timedelta(
+            seconds=settings.COMMENTS_STREAM_TIMEOUT)
+        while timezone.now() < end:
+            message = subscription.get(settings.COMMENTS_STREAM_KEEPALIVE)
+            if message is None:
+                yield ": keepalive\n\n"
+            else:
+                yield "event: %s\ndata: %s\n\n" % (
+                    message['event'], json.dumps(message['data']))
+    finally:
+        subscription.close()
+
+
+@require_GET
+def comment_stream(request):
+    """
+    Streams events of thread comments (new comments, vote counts and hidden
+    state changes) as Server-Sent Events, so the widget doesn't have to poll
+    for them. Streams have to be enabled by COMMENTS_STREAM_ENABLED.
+    """
+    if not settings.COMMENTS_STREAM_ENABLED:
+        return HttpResponseNotFound(_('comment streams are disabled'))
+
+    form = GetRequestValidationForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(
+            _('could not open comment stream, errors: %s') % form.errors
+        )
+
+    thread_id = form.cleaned_data['thread']
+    try:
+        site = Site.objects.get_for_domain(form.cleaned_data['domain'])
+        site.threads.only('id').get(id=thread_id)
+    except (Site.DoesNotExist, Thread.DoesNotExist):
+        return HttpResponseBadRequest(
+            _('thread with id %s not found') % thread_id
+        )
+
+    response = StreamingHttpResponse(
+        comment_event_stream(thread_id),
+        content_type='text/event-stream'
     )
+    response['Cache-Control'] = 'no-cache'
+    response['Access-Control-Allow-Origin'] = '*'
+    # disables response buffering in nginx
+    response['X-Accel-Buffering'] = 'no'
 
-    return {"html": resp.content, "html_container_name": "comments_container"}
+    return response
 
 
 @require_GET
@@ -543,38 +980,25 @@ def thread_info(request):
     }
 
     try:
-        site = Site.objects.get(domain=domain)
+        site = Site.objects.get_for_domain(domain)
     except Site.DoesNotExist:
         return HttpResponseBadRequest(
             'site with domain %s not found' % domain
         )
 
-    thread, created = site.threads.get_or_create(url=thread_url)
-    thread.titles = titles
-    thread.save()
-
-    if request.session.get('all_comments'):
-        del request.session['all_comments']
-
-    # add random avatar to session if anonymous
-    avatar_num = request.session.get("user_avatar_num", None)
-
-    if not avatar_num and request.user.is_anonymous():
-        avatar_num = random.randint(
-            settings.AVATAR_NUM_MIN,
-            settings.AVATAR_NUM_MAX
+    try:
+        thread = get_thread_for_url(site, thread_url, titles)
+    except Site.DoesNotExist:
+        return HttpResponseNotFound(
+            'site with domain %s not found' % domain
         )
-        request.session['user_avatar_num'] = avatar_num
+    init_widget_session(request)
 
-    return {
-        "thread_id": thread.id,
-        "comments_enabled": thread.allow_comments,
-        "spellcheck_enabled": settings.SPELLCHECK_ENABLED,
-        "spellcheck_localization": SPELLCHECK_LOCALIZATION
-    }
+    return get_thread_info_data(thread)
 
 
 @require_GET
+@conditional_response(header_validators)
 @json_response
 def get_header(request):
     form = GetRequestValidationForm(request.GET)
@@ -587,7 +1011,7 @@ def get_header(request):
     thread_id = form.cleaned_data['thread']
 
     try:
-        site = Site.objects.get(domain=domain_name)
+        site = Site.objects.get_for_domain(domain_name)
     except Site.DoesNotExist:
         return HttpResponseBadRequest(
             _('domain with name %s does not exist') % domain_name
@@ -595,12 +1019,13 @@ def get_header(request):
 
     thread, created = site.threads.get_or_create(id=thread_id)
 
-    resp = render(request, "header.html", {'thread': thread})
+    html = render_header_html(request, thread)
 
-    return {"html": resp.content, "html_container_name": "comments_header"}
+    return {"html": html, "html_container_name": "comments_header"}
 
 
 @require_GET
+@conditional_response(footer_validators)
 @json_response
 def get_footer(request):
     form = GetRequestValidationForm(request.GET)
@@ -613,7 +1038,7 @@ def get_footer(request):
     thread_id = form.cleaned_data['thread']
 
     try:
-        site = Site.objects.get(domain=domain_name)
+        site = Site.objects.get_for_domain(domain_name)
     except Site.DoesNotExist:
         return HttpResponseBadRequest(
             _('domain with name %s does not exist') % domain_name
@@ -621,18 +1046,63 @@ def get_footer(request):
 
     thread, created = site.threads.get_or_create(id=thread_id)
 
-    resp = render(
-        request,
-        "footer.html", {
-            'user': request.user,
-            'site': site,
-            'avatars': range(1, 29),
-            'user_avatar_num': request.session.get('user_avatar_num', 6),
-            'rs_customer_id': site.rs_customer_id,
-        }
-    )
+    html = render_footer_html(request, site)
 
-    return {"html": resp.content, "html_container_name": "comments_footer"}
+    return {"html": html, "html_container_name": "comments_footer"}
+
+
+@require_GET
+@json_response
+def widget(request):
+    """
+    Returns everything the widget needs on page load in a single response:
+    thread info (same as thread_info endpoint) and rendered header, comments
+    and footer HTML fragments keyed by their container names.
+    """
+    domain = request.GET.get('domain', None)
+    thread_url = request.GET.get('thread', None)
+    titles = {
+        'selector_title': request.GET.get('selector_title', ""),
+        'page_title': request.GET.get('page_title', ""),
+        'h1_title': request.GET.get('h1_title', "")
+    }
+
+    try:
+        site = Site.objects.get_for_domain(domain)
+    except Site.DoesNotExist:
+        return HttpResponseBadRequest(
+            _('site with domain %s not found') % domain
+        )
+
+    try:
+        thread = get_thread_for_url(site, thread_url, titles)
+    except Site.DoesNotExist:
+        # site was deleted, but it was still cached
+        return HttpResponseNotFound(
+            _('site with domain %s not found') % domain
+        )
+    init_widget_session(request)
+
+    data = get_thread_info_data(thread)
+    data['html'] = {}
+    data['cursor'] = get_changes_cursor()
+
+    if not thread.allow_comments:
+        return data
+
+    data['html']['comments_header'] = render_header_html(request, thread)
+    data['html']['comments_footer'] = render_footer_html(request, site)
+
+    user_hidden = not request.user.is_anonymous() and \
+        request.user.is_hidden_on(site.id)
+    if not user_hidden:
+        site_admin = not request.user.is_anonymous() and \
+            request.user.is_site_admin(site.domain)
+        data['html']['comments_container'] = render_comments_html(
+            request, site, thread, False, site_admin, use_cache=True)
+        data['overlay'] = get_comments_overlay(request, thread.id)
+
+    return data
 
 
 @require_POST
@@ -640,7 +1110,8 @@ def get_footer(request):
 @cross_domain_post_response
 def incorrect_words(request):
     """
-    Checks text and returns list of incorrectly spelled words.
+    Checks text and returns list of incorrectly spelled words. If the check
+    doesn't finish in SPELLCHECK_TIMEOUT seconds, partial flag is set.
     """
     if not settings.SPELLCHECK_ENABLED:
         return HttpResponseBadRequest(
@@ -654,10 +1125,9 @@ def incorrect_words(request):
             _('text not provided')
         )
 
-    chkr = SpellChecker(settings.LANGUAGE_CODE)
-    chkr.set_text(text)
-    errors = [err.word for err in chkr]
-    data = {'data': [errors]}
+    errors = spellcheck.incorrect_words(text)
+    # spellcheck didn't finish in time
+    data = {'data': [errors or []], 'partial': errors is None}
 
     return HttpResponse(json.dumps(data))
 
@@ -681,7 +1151,35 @@ def spellcheck_suggestions(request):
             _('word not provided')
         )
 
-    d = enchant.Dict(settings.LANGUAGE_CODE)
-    suggestions = d.suggest(word) if not d.check(word) else []
+    suggestions = spellcheck.suggest(word)
+    data = {'data': suggestions or [], 'partial': suggestions is None}
 
-    return HttpResponse(json.dumps({'data': suggestions}))
+    return HttpResponse(json.dumps(data))
+
+
+@require_POST
+@csrf_exempt
+@cross_domain_post_response
+def spellcheck_text(request):
+    """
+    Checks text and returns incorrectly spelled words with their suggested
+    solutions, so the widget doesn't need to request suggestions per word.
+    If the check doesn't finish in SPELLCHECK_TIMEOUT seconds, partial flag
+    is set and suggestions of remaining words are null.
+    """
+    if not settings.SPELLCHECK_ENABLED:
+        return HttpResponseBadRequest(
+            _('spell checking not supported')
+        )
+
+    text = request.POST.get('text')
+
+    if not text:
+        return HttpResponseBadRequest(
+            _('text not provided')
+        )
+
+    results, complete = spellcheck.check(text)
+    data = {'data': results, 'partial': not complete}
+
+    return HttpResponse(json.dumps(data))
@@ -0,0 +1,245 @@
+"""
+Write-behind buffer of anonymous votes. Anonymous likes and dislikes of
+comments and threads are counted in cache and flushed to their
+liked_by_count/disliked_by_count fields in batched updates every
+VOTE_BUFFER_FLUSH_INTERVAL seconds, so votes on popular threads don't
+contend for row locks.
+
+Every counter key is registered in a numbered slot when its value rises
+from zero, so flush can find buffered counters without scanning the
+cache. Slots which are still missing SLOT_GRACE_PERIOD seconds after they
+were claimed (evicted or never set by a dying process) are skipped, their
+counters are registered again by the next vote after that period.
+Increments and decrements are counted separately, because cache counters
+(e.g. in memcached) can't be negative.
+
+Buffered votes are saved by flush_votes command, which has to be kept
+running (or run every VOTE_BUFFER_FLUSH_INTERVAL seconds).
+"""
+from collections import defaultdict
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+
+VOTE_FIELDS = ('liked_by_count', 'disliked_by_count')
+
+SLOTS_KEY = 'votes:slots'
+FLUSHED_KEY = 'votes:flushed'
+FLUSH_LOCK_KEY = 'votes:flush_lock'
+CHECKPOINT_KEY = 'votes:checkpoint'
+
+# seconds after which flush lock is released if flushing process dies
+FLUSH_LOCK_TIMEOUT = 60
+
+# seconds after which claimed slots which weren't set are skipped
+SLOT_GRACE_PERIOD = 60
+
+
+def get_counter_key(instance, field, sign):
+    return 'votes:%s:%s:%s:%s' % (
+        instance._meta.label_lower, instance.pk, field, sign)
+
+
+def get_slot_key(slot):
+    return 'votes:slot:%d' % slot
+
+
+def get_registered_key(key):
+    return 'votes:registered:%s' % key
+
+
+def incr(key, delta=1):
+    """
+    Increments cache counter, creating it if it doesn't exist. Returns new
+    value of the counter.
+    """
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        if cache.add(key, delta, None):
+            return delta
+        return cache.incr(key, delta)
+
+
+def register(key):
+    cache.set(get_slot_key(incr(SLOTS_KEY)), key, None)
+
+
+def buffer_vote(instance, field, delta):
+    """
+    Adds delta to vote counter field of comment or thread in buffer and
+    mirrors the change on the instance. Returns False without doing anything
+    if buffer is disabled, so the vote has to be saved directly.
+    """
+    if not settings.VOTE_BUFFER_ENABLED:
+        return False
+
+    key = get_counter_key(instance, field, 'add' if delta > 0 else 'sub')
+    # counters are registered when they rise from zero and at most every
+    # SLOT_GRACE_PERIOD seconds otherwise, in case their slot was lost
+    expired = cache.add(get_registered_key(key), True, SLOT_GRACE_PERIOD)
+    if incr(key, abs(delta)) == abs(delta) or expired:
+        register(key)
+
+    setattr(instance, field, max(getattr(instance, field) + delta, 0))
+
+    return True
+
+
+def merge_buffered_votes(instances):
+    """
+    Adds buffered votes to vote counters of given comments or threads (of
+    the same model) loaded from DB, so they show up before they are flushed.
+    """
+    if not settings.VOTE_BUFFER_ENABLED or not instances:
+        return
+
+    counters = {}
+    for instance in instances:
+        for field in VOTE_FIELDS:
+            for sign in ('add', 'sub'):
+                key = get_counter_key(instance, field, sign)
+                counters[key] = (instance, field, sign)
+
+    for key, count in cache.get_many(counters.keys()).items():
+        instance, field, sign = counters[key]
+        delta = count if sign == 'add' else -count
+        setattr(instance, field, max(getattr(instance, field) + delta, 0))
+
+
+def take_registered_keys():
+    """
+    Removes registered counter keys from their slots and returns them.
+    """
+    first = (cache.get(FLUSHED_KEY) or 0) + 1
+    last = cache.get(SLOTS_KEY) or 0
+    slot_keys = [get_slot_key(slot) for slot in range(first, last + 1)]
+    slots = cache.get_many(slot_keys)
+
+    # checkpoint is the last claimed slot at the time it was taken, missing
+    # slots up to it are skipped once the checkpoint is old enough
+    now = time.time()
+    expired = 0
+    checkpoint = cache.get(CHECKPOINT_KEY)
+    if checkpoint is not None and now - checkpoint[1] >= SLOT_GRACE_PERIOD:
+        expired = checkpoint[0]
+    if checkpoint is None or expired:
+        cache.set(CHECKPOINT_KEY, (last, now), None)
+
+    keys = set()
+    flushed = first - 1
+    for slot, slot_key in enumerate(slot_keys, first):
+        if slot_key in slots:
+            keys.add(slots[slot_key])
+        elif slot > expired:
+            # slot counter is incremented before the slot is set, so the
+            # rest of slots is left for the next flush
+            break
+        flushed += 1
+
+    cache.delete_many(slot_keys[:flushed - first + 1])
+    cache.set(FLUSHED_KEY, flushed, None)
+
+    return keys
+
+
+def get_deltas(counts):
+    """
+    Returns dict mapping (model label, pk, field) to deltas of given
+    counters.
+    """
+    deltas = defaultdict(int)
+    for key, count in counts.items():
+        label, pk, field, sign = key.split(':')[1:]
+        deltas[(label, int(pk), field)] += count if sign == 'add' else -count
+    return deltas
+
+
+def save_deltas(deltas):
+    """
+    Adds deltas to vote counters in DB with one UPDATE per model, field and
+    delta. Returns number of updated comments and threads.
+    """
+    from models import Comment, Thread
+
+    updates = defaultdict(list)
+    for (label, pk, field), delta in deltas.items():
+        if delta:
+            updates[(label, field, delta)].append(pk)
+    if not updates:
+        return 0
+
+    comment_ids = set()
+    thread_ids = set()
+    with transaction.atomic():
+        for (label, field, delta), pks in updates.items():
+            model = apps.get_model(label)
+            values = {field: Greatest(F(field) + delta, 0)}
+            if model is Comment:
+                values['updated'] = timezone.now()
+                comment_ids.update(pks)
+            else:
+                thread_ids.update(pks)
+            model.objects.filter(pk__in=pks).update(**values)
+
+        if comment_ids:
+            comments = list(Comment.objects.filter(id__in=comment_ids))
+            Thread.objects.bump_version(
+                id__in=set(comment.thread_id for comment in comments))
+            for comment in comments:
+                comment.publish_state()
+
+    return len(comment_ids) + len(thread_ids)
+
+
+def release_counters(counts):
+    """
+    Subtracts saved counts from their counters.
+    """
+    for key, count in counts.items():
+        try:
+            remaining = cache.decr(key, count)
+        except ValueError:
+            # counter was evicted from cache
+            continue
+        # counter incremented since it was read didn't rise from zero, so
+        # it has to be registered again
+        if remaining:
+            register(key)
+
+
+def flush_votes():
+    """
+    Saves buffered votes to DB and removes them from buffer. Counters are
+    decremented only after votes are saved, so votes aren't lost if saving
+    fails (if the process dies in between, they can be saved twice).
+    Returns number of updated comments and threads.
+    """
+    if not cache.add(FLUSH_LOCK_KEY, True, FLUSH_LOCK_TIMEOUT):
+        return 0
+
+    try:
+        keys = take_registered_keys()
+        counts = dict(
+            (key, count) for key, count in cache.get_many(keys).items()
+            if count)
+        try:
+            updated = save_deltas(get_deltas(counts))
+        except Exception:
+            # counters are left intact, they only have to be found by the
+            # next flush
+            for key in counts:
+                register(key)
+            raise
+        release_counters(counts)
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+
+    return updated